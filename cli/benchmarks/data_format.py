@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Measures how long the waiter CLI takes to parse large token definition files.
+
+Usage: python benchmarks/data_format.py [--runs N] [--env-vars N]
+
+A token definition with the given number of environment variables (and as many
+metadata entries) is written as JSON and as YAML, and each file is parsed as an
+--input file would be, both by path (detected from the extension) and by
+content alone (as when reading from stdin). The previous approach, which parsed
+every input as JSON and then again as YAML, is reported for comparison.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from waiter.data_format import ANY_FORMAT, JSON, YAML  # noqa: E402
+
+
+def token_definition(env_vars):
+    """Returns a token definition with the given number of environment variables and metadata entries"""
+    return {'cmd': 'java -jar app.jar --port $PORT0',
+            'cmd-type': 'shell',
+            'cpus': 1.5,
+            'mem': 4096,
+            'health-check-url': '/status',
+            'concurrency-level': 8,
+            'env': {f'APP_SETTING_{i}': f'value-{i}-' + 'x' * 40 for i in range(env_vars)},
+            'metadata': {f'annotation-{i}': f'annotated by benchmark {i}' for i in range(env_vars)},
+            'permitted-user': '*',
+            'run-as-user': 'app'}
+
+
+def parse_twice(data):
+    """The previous detection, which parsed the data as JSON and then (even if that succeeded) as YAML"""
+    content = None
+    for input_format in [JSON, YAML]:
+        try:
+            content = input_format.parse(data)
+        except Exception:
+            pass
+    return content
+
+
+def time_parse(parse_fn, runs):
+    """Returns the wall-clock time (in seconds) of each of the given number of runs of parse_fn"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        parse_fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark parsing large token definition files')
+    parser.add_argument('--runs', '-n', help='number of runs per case', type=int, default=5)
+    parser.add_argument('--env-vars', help='number of environment variables in the token', type=int, default=5000)
+    args = parser.parse_args()
+
+    definition = token_definition(args.env_vars)
+    with tempfile.TemporaryDirectory() as directory:
+        cases = []
+        for input_format in [JSON, YAML]:
+            path = os.path.join(directory, f'token.{input_format.name()}')
+            with open(path, 'w') as data_file:
+                input_format.dump(definition, out_file=data_file)
+            with open(path) as data_file:
+                data = data_file.read()
+            size_kb = len(data) / 1024
+            cases += [(f'{input_format} ({size_kb:.0f} KB), parsed twice', lambda d=data: parse_twice(d)),
+                      (f'{input_format} ({size_kb:.0f} KB), by content', lambda d=data: ANY_FORMAT.parse(d)),
+                      (f'{input_format} ({size_kb:.0f} KB), by path',
+                       lambda d=data, p=path: ANY_FORMAT.parse(d, path=p))]
+
+        print(f'{"case":<36}{"median (ms)":>14}{"min (ms)":>12}')
+        for name, parse_fn in cases:
+            timings = time_parse(parse_fn, args.runs)
+            print(f'{name:<36}{statistics.median(timings) * 1000:>14.1f}{min(timings) * 1000:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Measures the cold start time of the waiter CLI against the bare interpreter.
+
+Usage: python benchmarks/startup.py [--runs N]
+
+Each command is run N times in a fresh interpreter and the median wall-clock
+time is reported, along with the overhead on top of `python -c pass`.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CLI_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = [
+    ('python -c pass', ['-c', 'pass']),
+    ('waiter --version', ['-m', 'waiter', '--version']),
+    ('waiter --help', ['-m', 'waiter', '--help']),
+    ('waiter show --help', ['-m', 'waiter', 'show', '--help']),
+]
+
+
+def time_command(args, runs):
+    """Returns the wall-clock time (in seconds) of each of the given number of runs of the interpreter with args"""
+    env = dict(os.environ, PYTHONPATH=CLI_DIRECTORY)
+    env.setdefault('USER', 'benchmark')
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the waiter CLI start up time')
+    parser.add_argument('--runs', '-n', help='number of runs per command', type=int, default=20)
+    args = parser.parse_args()
+
+    baseline = None
+    print(f'{"command":<24}{"median (ms)":>14}{"min (ms)":>12}{"overhead (ms)":>16}')
+    for name, command_args in COMMANDS:
+        timings = time_command(command_args, args.runs)
+        median = statistics.median(timings)
+        if baseline is None:
+            baseline = median
+        print(f'{name:<24}{median * 1000:>14.1f}{min(timings) * 1000:>12.1f}{(median - baseline) * 1000:>16.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -384,6 +384,13 @@ def tokens(waiter_url=None, flags=None, tokens_flags=None):
     return cp
 
 
+def apply(waiter_url=None, path=None, flags=None, apply_flags=None):
+    """Applies the token definitions in the given directory or manifest via the CLI"""
+    args = f"apply {path} {apply_flags or ''}"
+    cp = cli(args, waiter_url, flags)
+    return cp
+
+
 def __tokens_json(waiter_url=None, flags=None):
     """Invokes tokens with --json, and returns the parsed JSON"""
     flags = (flags + ' ') if flags else ''
@@ -1,5 +1,7 @@
+import contextlib
 import datetime
 import getpass
+import http.server
 import json
 import logging
 import os
@@ -7,13 +9,32 @@ import re
 import tempfile
 import threading
 import unittest
+import urllib.parse
 import uuid
 from functools import partial
 import pytest
+import yaml
 
 from tests.waiter import util, cli
 
 
+class JsonRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Handles the requests to a local test cluster, which responds with JSON"""
+
+    def send(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        pass
+
+
 @pytest.mark.cli
 @pytest.mark.timeout(util.DEFAULT_TEST_TIMEOUT_SECS)
 class WaiterCliTest(util.WaiterTest):
@@ -70,6 +91,24 @@ class WaiterCliTest(util.WaiterTest):
         finally:
             util.delete_token(self.waiter_url, token_name)
 
+    def test_update_unchanged(self):
+        token_name = self.token_name()
+        util.post_token(self.waiter_url, token_name, {'cpus': 0.1, 'mem': 128})
+        try:
+            _, headers = util.load_token_with_headers(self.waiter_url, token_name)
+            cp = cli.update(self.waiter_url, token_name, update_flags='--cpus 0.1')
+            self.assertEqual(0, cp.returncode, cp.stderr)
+            self.assertIn('is unchanged', cli.stdout(cp))
+            _, unchanged_headers = util.load_token_with_headers(self.waiter_url, token_name)
+            self.assertEqual(headers['ETag'], unchanged_headers['ETag'])
+
+            cp = cli.update(self.waiter_url, token_name, update_flags='--cpus 0.2')
+            self.assertEqual(0, cp.returncode, cp.stderr)
+            self.assertIn('~ cpus: 0.1 -> 0.2', cli.stdout(cp))
+            self.assertEqual(0.2, util.load_token(self.waiter_url, token_name)['cpus'])
+        finally:
+            util.delete_token(self.waiter_url, token_name)
+
     def test_failed_create(self):
         service = util.minimal_service_description(cpus=0)
         cp = cli.create_from_service_description(self.waiter_url, self.token_name(), service)
@@ -333,6 +372,23 @@ class WaiterCliTest(util.WaiterTest):
             self.assertEqual(1, cp.returncode, cp.stderr)
             self.assertIn('must specify at least one cluster', cli.decode(cp.stderr))
 
+    def test_show_profile(self):
+        token_name = self.token_name()
+        util.post_token(self.waiter_url, token_name, {'cpus': 0.1})
+        try:
+            with tempfile.NamedTemporaryFile(suffix='.pstats') as stats_file:
+                cp = cli.show(self.waiter_url, token_name, flags=f'--profile-stats {stats_file.name}')
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                self.assertIn(token_name, cli.stdout(cp))
+                stderr = cli.decode(cp.stderr)
+                self.assertIn('Profile of waiter show', stderr)
+                self.assertIn('run show', stderr)
+                self.assertIn('render', stderr)
+                self.assertIn(f'/token?token={token_name}', stderr)
+                self.assertLess(0, os.path.getsize(stats_file.name))
+        finally:
+            util.delete_token(self.waiter_url, token_name)
+
     def __test_show(self, file_format):
         token_name = self.token_name()
         util.post_token(self.waiter_url, token_name, {'cpus': 0.1})
@@ -350,6 +406,101 @@ class WaiterCliTest(util.WaiterTest):
     def test_show_yaml(self):
         self.__test_show('yaml')
 
+    def test_show_compact(self):
+        token_name = self.token_name()
+        util.post_token(self.waiter_url, token_name, {'cpus': 0.1})
+        try:
+            cp = cli.show(self.waiter_url, token_name, show_flags='--json')
+            self.assertEqual(0, cp.returncode, cp.stderr)
+            data = json.loads(cli.stdout(cp))
+            for format_flag in ['--json', '--yaml']:
+                cp = cli.show(self.waiter_url, token_name, show_flags=f'{format_flag} --compact')
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                self.assertEqual(1, len(cli.stdout(cp).splitlines()))
+                self.assertEqual(data, yaml.safe_load(cli.stdout(cp)))
+        finally:
+            util.delete_token(self.waiter_url, token_name)
+
+    def test_show_multiple_tokens(self):
+        token_names = [self.token_name() for _ in range(3)]
+        for token_name in token_names:
+            util.post_token(self.waiter_url, token_name, {'cpus': 0.1})
+        try:
+            missing_token_name = self.token_name()
+            cp = cli.show(self.waiter_url, ' '.join(token_names + [missing_token_name]), show_flags='--json')
+            self.assertEqual(1, cp.returncode, cp.stderr)
+            results = [json.loads(line) for line in cli.stdout(cp).splitlines()]
+            results_by_token = {r['token']: r for r in results}
+            self.assertEqual(set(token_names + [missing_token_name]), set(results_by_token.keys()))
+            self.assertEqual(0, results_by_token[missing_token_name]['count'])
+            for token_name in token_names:
+                token = next(iter(results_by_token[token_name]['clusters'].values()))['token']
+                self.assertEqual(util.load_token(self.waiter_url, token_name), token)
+
+            with cli.temp_file('\n'.join(token_names)) as path:
+                cp = cli.show(self.waiter_url, '', show_flags=f'--tokens-file {path}')
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                for token_name in token_names:
+                    self.assertIn(f'=== {self.waiter_url} / {token_name} ===', cli.stdout(cp))
+        finally:
+            for token_name in token_names:
+                util.delete_token(self.waiter_url, token_name)
+
+    def test_show_response_cache(self):
+        token_name = self.token_name()
+        util.post_token(self.waiter_url, token_name, {'cpus': 0.1})
+        try:
+            with tempfile.TemporaryDirectory() as cache_directory:
+                config = {'clusters': [{'name': 'foo', 'url': self.waiter_url}],
+                          'cache': {'directory': cache_directory, 'responses': {'enabled': True}}}
+                with cli.temp_config_file(config) as path:
+                    flags = f'--config {path}'
+                    for _ in range(2):
+                        cp, tokens = cli.show_token('json', token_name=token_name, flags=flags)
+                        self.assertEqual(0, cp.returncode, cp.stderr)
+                        self.assertEqual(util.load_token(self.waiter_url, token_name), tokens[0])
+                        self.assertEqual(1, len(os.listdir(os.path.join(cache_directory, 'responses'))))
+
+                    # A modified token must not be served from the cache
+                    util.post_token(self.waiter_url, token_name, {'cpus': 0.2})
+                    cp, tokens = cli.show_token('json', token_name=token_name, flags=flags)
+                    self.assertEqual(0, cp.returncode, cp.stderr)
+                    self.assertEqual(0.2, tokens[0]['cpus'])
+        finally:
+            util.delete_token(self.waiter_url, token_name)
+
+    def test_completion(self):
+        token_name = self.token_name()
+        util.post_token(self.waiter_url, token_name, util.minimal_service_description())
+        try:
+            service_id = util.ping_token(self.waiter_url, token_name)
+            with tempfile.TemporaryDirectory() as cache_directory:
+                config = {'clusters': [{'name': 'foo', 'url': self.waiter_url}],
+                          'cache': {'directory': cache_directory}}
+                with cli.temp_config_file(config) as path:
+                    cp = cli.cli('completion refresh', flags=f'--config {path}')
+                    self.assertEqual(0, cp.returncode, cp.stderr)
+
+                    cp = cli.cli(f'__complete 4 waiter --config {path} show {token_name[:-1]}')
+                    self.assertEqual(0, cp.returncode, cp.stderr)
+                    self.assertIn(token_name, cli.stdout(cp).splitlines())
+
+                    cp = cli.cli(f'__complete 4 waiter --config {path} kill {service_id[:-1]}')
+                    self.assertEqual(0, cp.returncode, cp.stderr)
+                    self.assertIn(service_id, cli.stdout(cp).splitlines())
+
+                    cp = cli.cli(f'__complete 4 waiter --config {path} show --j')
+                    self.assertEqual(0, cp.returncode, cp.stderr)
+                    self.assertEqual(['--json'], cli.stdout(cp).splitlines())
+
+                    cp = cli.cli(f'__complete 3 waiter --config {path} --cluster')
+                    self.assertEqual(['--cluster'], cli.stdout(cp).splitlines())
+                    cp = cli.cli(f'__complete 4 waiter --config {path} --cluster f')
+                    self.assertEqual(['foo'], cli.stdout(cp).splitlines())
+        finally:
+            util.kill_services_using_token(self.waiter_url, token_name)
+            util.delete_token(self.waiter_url, token_name)
+
     @pytest.mark.serial
     def test_create_if_match(self):
 
@@ -558,6 +709,30 @@ class WaiterCliTest(util.WaiterTest):
         self.assertEqual(1, cp.returncode, cp.stderr)
         self.assertIn('No matching data found', cli.stdout(cp))
 
+    def test_ping_multiple_tokens(self):
+        token_names = [f'{self.token_name()}-{i}' for i in range(3)]
+        for token_name in token_names:
+            util.post_token(self.waiter_url, token_name, util.minimal_service_description())
+        try:
+            cp = cli.ping(self.waiter_url, ' '.join(token_names), ping_flags='--parallelism 2')
+            self.assertEqual(0, cp.returncode, cp.stderr)
+            lines = cli.stdout(cp).strip().split('\n')
+            self.assertEqual(['Token', 'Cluster', 'Result', 'Latency', 'Status'], lines[0].split())
+            for token_name in token_names:
+                line = next(l for l in lines if token_name in l)
+                self.assertIn('Succeeded', line)
+                self.assertTrue(any(s in line for s in ['Running', 'Starting']))
+                util.wait_until_services_for_token(self.waiter_url, token_name, 1)
+
+            missing_token_name = self.token_name()
+            cp = cli.ping(self.waiter_url, f'{token_names[0]} {missing_token_name}')
+            self.assertEqual(1, cp.returncode, cp.stderr)
+            self.assertIn('Not found', cli.stdout(cp))
+            self.assertIn(f'{missing_token_name}: No matching data found', cli.stderr(cp))
+        finally:
+            for token_name in token_names:
+                util.delete_token(self.waiter_url, token_name, kill_services=True)
+
     def test_ping_custom_health_check_endpoint(self):
         token_name = self.token_name()
         util.post_token(self.waiter_url, token_name, util.minimal_service_description(**{'health-check-url': '/sleep'}))
@@ -632,6 +807,50 @@ class WaiterCliTest(util.WaiterTest):
         finally:
             util.delete_token(self.waiter_url, token_name, kill_services=True)
 
+    def test_kill_multiple_services_partial_failure(self):
+        token_name = self.token_name()
+        service_ids = [f'{token_name}-{i}' for i in range(3)]
+        failing_service_id = service_ids[1]
+        killed_service_ids = []
+
+        def handler(cluster_services):
+            class KillHandler(JsonRequestHandler):
+                def do_GET(self):
+                    if urllib.parse.urlparse(self.path).path == '/apps':
+                        self.send(200, [{'service-id': service_id, 'status': 'Running',
+                                         'last-request-time': last_request_time}
+                                        for service_id, last_request_time in cluster_services])
+                    else:
+                        self.send(404, {'waiter-error': {'message': 'Not found'}})
+
+                def do_DELETE(self):
+                    service_id = urllib.parse.urlparse(self.path).path.split('/')[-1]
+                    killed_service_ids.append(service_id)
+                    if service_id == failing_service_id:
+                        self.send(503, {'waiter-error': {'message': f'Unable to kill {service_id}'}})
+                    else:
+                        self.send(200, {'routers-agree': True})
+
+            return KillHandler
+
+        # Within a cluster, the services are killed (and listed) from the most recently requested
+        handlers = [handler([(service_ids[1], '2020-01-01T00:00:00.000Z'),
+                             (service_ids[0], '2020-01-02T00:00:00.000Z')]),
+                    handler([(service_ids[2], '2020-01-03T00:00:00.000Z')])]
+        with self.__local_clusters(handlers) as path:
+            cp = cli.kill(token_name_or_service_id=token_name, flags=f'--config {path}',
+                          kill_flags='--force --parallelism 2')
+            self.assertEqual(1, cp.returncode, cp.stderr)
+            self.assertEqual(sorted(service_ids), sorted(killed_service_ids))
+            stdout = cli.stdout(cp)
+            self.assertIn(f'There are 3 services using token {token_name}', stdout)
+            self.assertEqual(2, stdout.count('Successfully killed'))
+            self.assertIn(f'Unable to kill {failing_service_id}', cli.stderr(cp))
+            results = [line.split() for line in stdout.splitlines() if line.endswith(('Killed', 'Failed'))]
+            self.assertEqual([['a', service_ids[0], 'Killed'],
+                              ['a', service_ids[1], 'Failed'],
+                              ['b', service_ids[2], 'Killed']], results)
+
     @pytest.mark.xfail
     def test_kill_services_sorted(self):
         token_name = self.token_name()
@@ -1180,6 +1399,153 @@ class WaiterCliTest(util.WaiterTest):
         finally:
             util.delete_token(self.waiter_url, token_name_1)
 
+    def test_tokens_stream(self):
+        token_name_prefix = self.token_name()
+        token_name_1 = f'{token_name_prefix}_foo'
+        token_name_2 = f'{token_name_prefix}_bar'
+        util.post_token(self.waiter_url, token_name_1, util.minimal_service_description())
+        util.post_token(self.waiter_url, token_name_2, util.minimal_service_description())
+        try:
+            cp = cli.tokens(self.waiter_url, tokens_flags='--stream')
+            stdout = cli.stdout(cp)
+            self.assertEqual(0, cp.returncode, cp.stderr)
+            self.assertIn(token_name_1, stdout)
+            self.assertIn(token_name_2, stdout)
+
+            cp = cli.tokens(self.waiter_url, tokens_flags='--stream --sort')
+            stdout = cli.stdout(cp)
+            self.assertEqual(0, cp.returncode, cp.stderr)
+            self.assertLess(stdout.index(token_name_2), stdout.index(token_name_1))
+
+            cp = cli.tokens(self.waiter_url, tokens_flags='--stream --json')
+            self.assertEqual(1, cp.returncode, cp.stderr)
+            self.assertIn('You can only use --stream with table output', cli.decode(cp.stderr))
+        finally:
+            util.delete_token(self.waiter_url, token_name_1)
+            util.delete_token(self.waiter_url, token_name_2)
+
+    def test_tokens_cut_off_response(self):
+        token_name = self.token_name()
+
+        class CutOffHandler(http.server.BaseHTTPRequestHandler):
+            """Responds to every request with a JSON array that is cut off part-way through its second element"""
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                token = {'token': token_name, 'owner': getpass.getuser(), 'etag': 'E1', 'deleted': False,
+                         'maintenance': False, 'last-update-time': '2020-01-01T00:00:00.000Z'}
+                self.wfile.write(f'[{json.dumps(token)}, {{"token": "{token_name}-'.encode())
+
+            def log_message(self, *_):
+                pass
+
+        server = http.server.HTTPServer(('127.0.0.1', 0), CutOffHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            config = {'clusters': [{'name': 'cut-off', 'url': f'http://127.0.0.1:{server.server_port}'}]}
+            with cli.temp_config_file(config) as path:
+                for tokens_flags in ['', '--stream']:
+                    cp = cli.tokens(flags=f'--config {path}', tokens_flags=tokens_flags)
+                    self.assertEqual(1, cp.returncode, cp.stderr)
+                    self.assertNotIn(token_name, cli.stdout(cp))
+                    self.assertIn('Encountered incomplete response from cut-off', cli.decode(cp.stderr))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_apply(self):
+        token_name_prefix = self.token_name()
+        token_name_1 = f'{token_name_prefix}_foo'
+        token_name_2 = f'{token_name_prefix}_bar'
+        token_1 = util.minimal_service_description()
+        token_2 = util.minimal_service_description()
+        util.post_token(self.waiter_url, token_name_1, token_1)
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                cli.write_json(os.path.join(directory, 'foo.json'), {'token': token_name_1, **token_1, 'cpus': 0.2})
+                cli.write_yaml(os.path.join(directory, 'bar.yaml'), {'token': token_name_2, **token_2})
+
+                cp = cli.apply(self.waiter_url, directory, apply_flags='--dry-run')
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                self.assertIn(f'~ cpus: {token_1["cpus"]} -> 0.2', cli.stdout(cp))
+                self.assertIn(f'Would create token {token_name_2}', cli.stdout(cp))
+                self.assertEqual(token_1['cpus'], util.load_token(self.waiter_url, token_name_1)['cpus'])
+                util.load_token(self.waiter_url, token_name_2, expected_status_code=404)
+
+                cp = cli.apply(self.waiter_url, directory)
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                self.assertEqual(['updated', 'cpus'], cli.stdout(cp).splitlines()[2].split()[2:])
+                self.assertEqual(['created'], cli.stdout(cp).splitlines()[1].split()[2:])
+                self.assertEqual(0.2, util.load_token(self.waiter_url, token_name_1)['cpus'])
+                self.assertEqual(token_2['name'], util.load_token(self.waiter_url, token_name_2)['name'])
+
+                cp = cli.apply(self.waiter_url, directory)
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                self.assertEqual(2, cli.stdout(cp).count('unchanged'))
+        finally:
+            util.delete_token(self.waiter_url, token_name_1)
+            util.delete_token(self.waiter_url, token_name_2, assert_response=False)
+
+    def test_apply_template_contexts(self):
+        token_name_prefix = self.token_name()
+        token_names = [f'{token_name_prefix}_{region}' for region in ['foo', 'bar']]
+        # The $ in the command (e.g. $PORT0) is escaped as $$ in the template
+        template = {'token': f'{token_name_prefix}_${{region}}', **util.minimal_service_description(),
+                    'cmd': util.default_cmd().replace('$', '$$'),
+                    'metadata': {'region': '${region}', 'team': '${team}'}}
+        try:
+            with cli.temp_token_file(template, 'yaml') as template_path:
+                with cli.temp_token_file({'contexts': [{'region': 'foo'}, {}]}, 'yaml') as contexts_path:
+                    cp = cli.apply(self.waiter_url, template_path, apply_flags=f'--contexts {contexts_path}')
+                    self.assertEqual(1, cp.returncode, cp.stderr)
+                    self.assertIn("context 1 has missing variable 'team'; "
+                                  "context 2 has missing variables 'region', 'team'", cli.stderr(cp))
+
+                contexts = {'contexts': [{'region': 'foo'}, {'region': 'bar'}]}
+                with cli.temp_token_file(contexts, 'yaml') as contexts_path:
+                    with cli.temp_token_file({'team': 'waiter'}, 'yaml') as context_path:
+                        cp = cli.apply(self.waiter_url, template_path,
+                                       apply_flags=f'--contexts {contexts_path} --context {context_path}')
+                        self.assertEqual(0, cp.returncode, cp.stderr)
+                        for token_name, region in zip(token_names, ['foo', 'bar']):
+                            self.assertEqual({'region': region, 'team': 'waiter'},
+                                             util.load_token(self.waiter_url, token_name)['metadata'])
+        finally:
+            for token_name in token_names:
+                util.delete_token(self.waiter_url, token_name, assert_response=False)
+
+    def test_tokens_fields_and_filters(self):
+        token_name_prefix = self.token_name()
+        token_name_1 = f'{token_name_prefix}_foo'
+        token_name_2 = f'{token_name_prefix}_bar'
+        util.post_token(self.waiter_url, token_name_1, util.minimal_service_description())
+        util.post_token(self.waiter_url, token_name_2,
+                        util.minimal_service_description(maintenance={'message': 'custom message'}))
+        try:
+            cp = cli.tokens(self.waiter_url, tokens_flags=f'--fields token,maintenance '
+                                                          f'--filter name={token_name_prefix}_*')
+            self.assertEqual(0, cp.returncode, cp.stderr)
+            lines = cli.stdout(cp).strip().split('\n')
+            self.assertEqual(['Token', 'Maintenance'], lines[0].split())
+            self.assertEqual([[token_name_2, 'True'], [token_name_1, 'False']], [l.split() for l in lines[1:]])
+
+            cp = cli.tokens(self.waiter_url, tokens_flags=f'--json --fields token '
+                                                          f'--filter name={token_name_prefix}_* '
+                                                          f'--filter maintenance=false --filter updated-since=1h')
+            self.assertEqual(0, cp.returncode, cp.stderr)
+            tokens = [t for c in json.loads(cli.stdout(cp))['clusters'].values() for t in c['tokens']]
+            self.assertEqual([{'token': token_name_1}], tokens)
+
+            cp = cli.tokens(self.waiter_url, tokens_flags='--filter maintenance=maybe')
+            self.assertEqual(2, cp.returncode, cp.stderr)
+            self.assertIn('not a valid filter', cli.stderr(cp))
+        finally:
+            util.delete_token(self.waiter_url, token_name_1)
+            util.delete_token(self.waiter_url, token_name_2)
+
     def __test_create_token_containing_token_name(self, file_format):
         token_name = self.token_name()
         with cli.temp_token_file({'token': token_name, 'cpus': 0.1, 'mem': 128}, file_format) as path:
@@ -1572,6 +1938,28 @@ class WaiterCliTest(util.WaiterTest):
         finally:
             util.delete_token(self.waiter_url, token_name, expected_status_code=404)
 
+    def test_create_token_output_json_floats(self):
+        # Every JSON backend (e.g. orjson, when installed) must format floats exactly as the json module does
+        token_name = self.token_name()
+        token_fields = {
+            'cpus': 1e-05,
+            'mem': 1e16,
+            'concurrency-level': 0.1,
+            'jitter-threshold': float('nan'),
+            'scale-factor': float('inf'),
+            'scale-down-factor': float('-inf')
+        }
+        stdin = cli.dump('json', token_fields)
+        try:
+            with tempfile.NamedTemporaryFile(delete=True, suffix='.json') as output_file:
+                flags = f'--output {output_file.name} --json -'
+                cp = cli.create(self.waiter_url, token_name, stdin=stdin, create_flags=flags)
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                with open(output_file.name) as f:
+                    self.assertEqual(json.dumps(token_fields, indent=2, sort_keys=True), f.read().rstrip('\n'))
+        finally:
+            util.delete_token(self.waiter_url, token_name, expected_status_code=404)
+
     def test_update_token_output_stdout(self):
         token_name = self.token_name()
         base_fields = {
@@ -1924,6 +2312,127 @@ class WaiterCliTest(util.WaiterTest):
         self.__test_no_cluster(partial(cli.maintenance, 'start',
                                        maintenance_flags=f'"{custom_maintenance_message}"'))
 
+    def test_maintenance_start_stop_multiple_tokens(self):
+        token_names = [f'{self.token_name()}-{i}' for i in range(3)]
+        custom_maintenance_message = "custom maintenance message"
+        for token_name in token_names:
+            util.post_token(self.waiter_url, token_name, util.minimal_service_description())
+        try:
+            cp = cli.maintenance('start', ' '.join(token_names), self.waiter_url,
+                                 maintenance_flags=f'"{custom_maintenance_message}"')
+            self.assertEqual(1, cp.returncode, cp.stderr)
+            self.assertIn('You must provide the maintenance message with --message', cli.stderr(cp))
+            for token_name in token_names:
+                self.assertNotIn('maintenance', util.load_token(self.waiter_url, token_name))
+
+            cp = cli.maintenance('start', ' '.join(token_names), self.waiter_url,
+                                 maintenance_flags=f'--no-kill --message "{custom_maintenance_message}"')
+            self.assertEqual(0, cp.returncode, cp.stderr)
+            for token_name in token_names:
+                self.assertRegex(cli.stdout(cp), f'{token_name} .* activated')
+                token_data = util.load_token(self.waiter_url, token_name)
+                self.assertEqual({'message': custom_maintenance_message}, token_data['maintenance'])
+
+            cp = cli.maintenance('start', f'{token_names[0]} {token_names[1]}', self.waiter_url,
+                                 maintenance_flags=f'-m "{custom_maintenance_message}" --ask-kill')
+            self.assertEqual(1, cp.returncode, cp.stderr)
+            self.assertIn('You cannot use --ask-kill with multiple tokens', cli.stderr(cp))
+
+            cp = cli.maintenance('stop', ' '.join(token_names), self.waiter_url, maintenance_flags='--no-ping')
+            self.assertEqual(0, cp.returncode, cp.stderr)
+            for token_name in token_names:
+                self.assertRegex(cli.stdout(cp), f'{token_name} .* deactivated')
+                self.assertNotIn('maintenance', util.load_token(self.waiter_url, token_name))
+        finally:
+            for token_name in token_names:
+                util.delete_token(self.waiter_url, token_name, kill_services=True)
+
+    @contextlib.contextmanager
+    def __local_clusters(self, handler_classes):
+        """
+        Serves each given request handler class as a local cluster, yielding the path of a config with the clusters
+        (named a, b, etc., with a as the default cluster for creating tokens)
+        """
+        servers = [http.server.HTTPServer(('127.0.0.1', 0), handler_class) for handler_class in handler_classes]
+        for server in servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            config = {'clusters': [{'name': chr(ord('a') + i), 'url': f'http://127.0.0.1:{server.server_port}'}
+                                   for i, server in enumerate(servers)]}
+            config['clusters'][0]['default-for-create'] = True
+            with cli.temp_config_file(config) as path:
+                yield path
+        finally:
+            for server in servers:
+                server.shutdown()
+                server.server_close()
+
+    @contextlib.contextmanager
+    def __token_posts_on_second_cluster(self, tokens):
+        """
+        Serves the given tokens (with etag E1) from the second of two local clusters, yielding the path of a config
+        with both clusters and the list of (cluster, If-Match header, body) of the token posts that they receive
+        """
+        posts = []
+
+        def handler(cluster_name, cluster_tokens):
+            class TokenHandler(JsonRequestHandler):
+                def do_GET(self):
+                    url = urllib.parse.urlparse(self.path)
+                    query = urllib.parse.parse_qs(url.query)
+                    token_name = query.get('token', [None])[0]
+                    if url.path == '/settings':
+                        self.send(200, {'cluster-config': {'name': cluster_name}})
+                    elif url.path == '/token' and token_name in cluster_tokens:
+                        token_data = dict(cluster_tokens[token_name])
+                        if 'metadata' in query.get('include', []):
+                            token_data.update({'cluster': cluster_name, 'deleted': False,
+                                               'last-update-time': 1577836800000, 'last-update-user': 'someone',
+                                               'previous': {}, 'root': cluster_name})
+                        self.send(200, token_data, {'ETag': 'E1'})
+                    elif url.path == '/apps':
+                        self.send(200, [])
+                    else:
+                        self.send(404, {'waiter-error': {'message': 'Couldn\'t find token'}})
+
+                def do_POST(self):
+                    token_name = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)['token'][0]
+                    body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                    posts.append((cluster_name, self.headers.get('If-Match'), body))
+                    self.send(200, {'message': f'Successfully updated {token_name}'}, {'ETag': 'E2'})
+
+            return TokenHandler
+
+        with self.__local_clusters([handler('a', {}), handler('b', tokens)]) as path:
+            yield path, posts
+
+    def test_create_update_existing_token_multi_cluster_post(self):
+        token_name = self.token_name()
+        token_data = {'cmd': 'foo', 'cpus': 0.1, 'mem': 128, 'owner': getpass.getuser(), 'version': 'v1'}
+        for action, expected_body in [('update', {**token_data, 'cpus': 0.2}), ('create', {'cpus': 0.2})]:
+            with self.__token_posts_on_second_cluster({token_name: token_data}) as (path, posts):
+                cp = getattr(cli, action)(token_name=token_name, flags=f'--config {path}',
+                                          **{f'{action}_flags': '--cpus 0.2'})
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                self.assertEqual([('b', 'E1', expected_body)], posts)
+
+    def test_maintenance_start_stop_multi_cluster_post(self):
+        token_names = [f'{self.token_name()}-{i}' for i in range(2)]
+        token_data = {'cmd': 'foo', 'cpus': 0.1, 'mem': 128, 'owner': getpass.getuser(), 'version': 'v1'}
+        maintenance = {'message': 'custom maintenance message'}
+        for names in [token_names[:1], token_names]:
+            with self.__token_posts_on_second_cluster({t: token_data for t in token_names}) as (path, posts):
+                cp = cli.maintenance('start', ' '.join(names), flags=f'--config {path}',
+                                     maintenance_flags=f'--no-kill --message "{maintenance["message"]}"')
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                self.assertEqual([('b', 'E1', {**token_data, 'maintenance': maintenance})] * len(names), posts)
+
+            tokens = {t: {**token_data, 'maintenance': maintenance} for t in token_names}
+            with self.__token_posts_on_second_cluster(tokens) as (path, posts):
+                cp = cli.maintenance('stop', ' '.join(names), flags=f'--config {path}', maintenance_flags='--no-ping')
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                self.assertEqual([('b', 'E1', token_data)] * len(names), posts)
+
     def run_maintenance_stop_no_ping_test(self, cli_fn):
         token_name = self.token_name()
         token_fields = {'cpus': 0.1, 'mem': 128, 'cmd': 'foo'}
@@ -4,7 +4,6 @@ import os
 from setuptools import setup
 
 requirements = [
-    'arrow>=0.13.1',
     'humanfriendly>=4.18',
     'pyyaml>=3.13',
     'requests>=2.20.0',
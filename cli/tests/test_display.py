@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+
+from tabulate import tabulate
+
+from waiter.display import render_table
+
+
+def green(s):
+    return f'\x1b[32m{s}\x1b[0m'
+
+
+class DisplayTest(unittest.TestCase):
+    """render_table must render exactly what tabulate renders in its plain format, which it replaced"""
+
+    def assert_same_as_tabulate(self, columns, headers=None, fallback=False):
+        expected = tabulate(list(zip(*columns)), headers=headers or (), tablefmt='plain')
+        if fallback:
+            self.assertEqual(expected, render_table(columns, headers), (columns, headers))
+        else:
+            # Hiding tabulate makes sure that the table is not just handed off to it
+            with mock.patch.dict('sys.modules', {'tabulate': None}):
+                self.assertEqual(expected, render_table(columns, headers), (columns, headers))
+
+    def test_render_table(self):
+        columns = [
+            ['foo', 'a much longer value', ''],
+            [1, 22, 333],
+            [1, -22, None],
+            [0.5, 12.25, 3.0],
+            [1e-05, 2.5, 100],
+            [None, 1.125, ''],
+            [None, None, None],
+            [True, False, None],
+            [green('Running'), 'Failing', green('Starting')],
+            [green(1), 'n/a', None],
+            [' padded ', 'x', 'y'],
+            ['[1]', '[2]', '[10]'],
+        ]
+        for column in columns:
+            self.assert_same_as_tabulate([column])
+            self.assert_same_as_tabulate([column], ['Header'])
+            self.assert_same_as_tabulate([column], ['A much longer header'])
+        self.assert_same_as_tabulate(columns)
+        self.assert_same_as_tabulate(columns, [f'Column {i}' for i in range(len(columns))])
+
+    def test_render_table_tabulate_fallback(self):
+        # Columns that depend on tabulate's number parsing or on wide characters are rendered by tabulate itself
+        columns = [
+            ['1', '22', '3.5'],
+            ['1,000', '2', None],
+            [green('1.5'), '2', '30'],
+            ['True', 'False', ''],
+            [True, 1, 2.5],
+            ['日本', 'x', 'ab'],
+            [b'bytes', 'x', 'y'],
+        ]
+        for column in columns:
+            self.assert_same_as_tabulate([column], fallback=True)
+            self.assert_same_as_tabulate([column], ['Header'], fallback=True)
+            self.assert_same_as_tabulate([['foo', 'bar', 'baz'], column, [1, 2.5, 3]], ['A', 'B', 'C'], fallback=True)
@@ -0,0 +1,100 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from waiter.format import humanize, parse_timestamp
+
+
+class FormatTest(unittest.TestCase):
+    """The expected values are the ones arrow (which these functions replaced) produced"""
+
+    def test_parse_timestamp(self):
+        utc = timezone.utc
+        self.assertEqual(datetime(2019, 1, 31, 12, tzinfo=utc), parse_timestamp('2019-01-31T12:00:00.000Z'))
+        self.assertEqual(datetime(2019, 1, 31, 12, tzinfo=utc), parse_timestamp('2019-01-31T12:00:00'))
+        self.assertEqual(datetime(2019, 1, 31, 12, tzinfo=utc), parse_timestamp('20190131T120000Z'))
+        self.assertEqual(datetime(2019, 1, 31, tzinfo=utc), parse_timestamp('2019-01-31'))
+
+        timestamp = parse_timestamp('2019-01-31T12:00:00+05:30')
+        self.assertEqual(datetime(2019, 1, 31, 6, 30, tzinfo=utc), timestamp)
+        self.assertEqual(timedelta(hours=5, minutes=30), timestamp.utcoffset())
+        timestamp = parse_timestamp('2019-01-31T12:00:00-08:00')
+        self.assertEqual(datetime(2019, 1, 31, 20, tzinfo=utc), timestamp)
+        self.assertEqual(timedelta(hours=-8), timestamp.utcoffset())
+
+        # Fractions beyond microseconds are rounded
+        self.assertEqual(datetime(2019, 1, 31, 12, 0, 0, 123457, tzinfo=utc),
+                         parse_timestamp('2019-01-31T12:00:00.123456789Z'))
+        self.assertEqual(datetime(2019, 1, 31, 12, 0, 1, tzinfo=utc), parse_timestamp('2019-01-31T12:00:00.9999999Z'))
+
+        for invalid in ['', 'yesterday', '2019-13-01', '2019-02-30T12:00:00Z', '2019-01-31T25:00:00Z']:
+            with self.assertRaises(ValueError):
+                parse_timestamp(invalid)
+
+    def test_humanize_thresholds(self):
+        now = datetime(2020, 3, 31, 12, tzinfo=timezone.utc)
+        expected_amounts = [
+            (timedelta(seconds=9), None),
+            (timedelta(seconds=10), '10 seconds'),
+            (timedelta(seconds=44), '44 seconds'),
+            (timedelta(seconds=45), '45 seconds'),
+            (timedelta(seconds=59), '59 seconds'),
+            (timedelta(seconds=60), 'a minute'),
+            (timedelta(seconds=119), 'a minute'),
+            (timedelta(seconds=120), '2 minutes'),
+            (timedelta(minutes=59), '59 minutes'),
+            (timedelta(minutes=60), 'an hour'),
+            (timedelta(minutes=89), 'an hour'),
+            (timedelta(minutes=90), 'an hour'),
+            (timedelta(minutes=119), 'an hour'),
+            (timedelta(minutes=120), '2 hours'),
+            (timedelta(hours=21), '21 hours'),
+            (timedelta(hours=22), '22 hours'),
+            (timedelta(hours=23), '23 hours'),
+            (timedelta(hours=24), 'a day'),
+            (timedelta(hours=47), 'a day'),
+            (timedelta(hours=48), '2 days'),
+            (timedelta(days=6), '6 days'),
+            (timedelta(days=7), 'a week'),
+            (timedelta(days=13), 'a week'),
+            (timedelta(days=14), '2 weeks'),
+            (timedelta(days=15), 'a month'),
+            (timedelta(days=25), 'a month'),
+            (timedelta(days=26), 'a month'),
+            (timedelta(days=304), '10 months'),
+            (timedelta(days=335), '11 months'),
+            (timedelta(days=364), '12 months'),
+            (timedelta(days=365), 'a year'),
+            (timedelta(days=517), 'a year'),
+            (timedelta(days=548), 'a year'),
+            (timedelta(days=729), 'a year'),
+            (timedelta(days=730), '2 years'),
+            (timedelta(days=1095), '3 years'),
+        ]
+        for offset, amount in expected_amounts:
+            self.assertEqual('just now' if amount is None else f'{amount} ago', humanize(now - offset, now), offset)
+            self.assertEqual('just now' if amount is None else f'in {amount}', humanize(now + offset, now), offset)
+
+    def test_humanize_month_ends(self):
+        def date(year, month, day):
+            return datetime(year, month, day, tzinfo=timezone.utc)
+
+        expected_amounts = [
+            # Shifting Jan 31 by a month clips it to the end of February
+            (date(2020, 1, 31), date(2020, 2, 29), 'a month'),
+            (date(2020, 1, 31), date(2020, 3, 1), 'a month'),
+            (date(2020, 1, 31), date(2020, 3, 16), '2 months'),
+            (date(2019, 12, 31), date(2020, 2, 29), '2 months'),
+            (date(2020, 5, 31), date(2020, 6, 30), 'a month'),
+            (date(2020, 5, 31), date(2020, 7, 15), '2 months'),
+            # Feb 29 shifted by a year clips to Feb 28
+            (date(2020, 2, 29), date(2021, 2, 28), 'a year'),
+        ]
+        for earlier, later, amount in expected_amounts:
+            self.assertEqual(f'{amount} ago', humanize(earlier, later), (earlier, later))
+            self.assertEqual(f'in {amount}', humanize(later, earlier), (earlier, later))
+
+    def test_humanize_time_zones(self):
+        now = datetime(2020, 3, 31, 12, tzinfo=timezone.utc)
+        self.assertEqual('2 hours ago', humanize(parse_timestamp('2020-03-31T15:00:00+05:00'), now))
+        self.assertEqual('in 3 hours', humanize(parse_timestamp('2020-03-31T08:00:00-07:00'), now))
+        self.assertEqual('a month ago', humanize(parse_timestamp('2020-03-01T00:00:00+14:00'), now))
@@ -0,0 +1,84 @@
+import unittest
+from unittest import mock
+
+from waiter.util import wait_until
+
+
+class FakeClock:
+    """Stands in for the time module, advancing the monotonic time by each sleep (which it records)"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class UtilTest(unittest.TestCase):
+
+    def wait_until(self, results, jitter_fraction=1, **kwargs):
+        """
+        Runs wait_until on a fake clock with a predicate returning the given results in turn (and then False), with
+        each jittered delay being the given fraction of its maximum. Returns the result, the sleeps, and the (fake)
+        times at which the predicate was polled.
+        """
+        clock = FakeClock()
+        results = iter(results)
+        polls = []
+
+        def pred():
+            polls.append(clock.now)
+            return next(results, False)
+
+        def uniform(low, high):
+            self.assertEqual(low, high / 2)
+            return high * jitter_fraction
+
+        with mock.patch('waiter.util.time', clock), mock.patch('waiter.util.random.uniform', uniform):
+            result = wait_until(pred, **kwargs)
+        return result, clock.sleeps, polls
+
+    def assert_all_almost_equal(self, expected, actual):
+        self.assertEqual(len(expected), len(actual), actual)
+        for e, a in zip(expected, actual):
+            self.assertAlmostEqual(e, a, msg=actual)
+
+    def test_wait_until_backoff(self):
+        result, sleeps, polls = self.wait_until([], timeout=10, interval=2)
+        self.assertFalse(result)
+        # The delays double from initial_interval up to interval, and the last one is cut short by the timeout
+        self.assert_all_almost_equal([0.1, 0.2, 0.4, 0.8, 1.6, 2, 2, 2, 0.9], sleeps)
+        # So the final poll happens exactly at the timeout
+        self.assertAlmostEqual(10, polls[-1])
+        self.assertEqual(len(sleeps) + 1, len(polls))
+
+    def test_wait_until_jitter(self):
+        result, sleeps, polls = self.wait_until([], jitter_fraction=0.5, timeout=5, interval=1)
+        self.assertFalse(result)
+        self.assert_all_almost_equal([0.05, 0.1, 0.2, 0.4, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.25], sleeps)
+        self.assertAlmostEqual(5, polls[-1])
+
+    def test_wait_until_custom_backoff(self):
+        _, sleeps, polls = self.wait_until([], timeout=3, interval=1.5, initial_interval=0.5, multiplier=3)
+        self.assert_all_almost_equal([0.5, 1.5, 1], sleeps)
+        self.assertAlmostEqual(3, polls[-1])
+
+    def test_wait_until_success(self):
+        result, sleeps, polls = self.wait_until([None, 0, 'done'], timeout=10, interval=2)
+        self.assertEqual('done', result)
+        self.assert_all_almost_equal([0.1, 0.2], sleeps)
+        self.assertEqual(3, len(polls))
+
+        result, sleeps, _ = self.wait_until(['done'], timeout=10, interval=2)
+        self.assertEqual('done', result)
+        self.assertEqual([], sleeps)
+
+    def test_wait_until_no_timeout(self):
+        result, sleeps, _ = self.wait_until([False] * 7 + [True], timeout=None, interval=1)
+        self.assertTrue(result)
+        self.assert_all_almost_equal([0.1, 0.2, 0.4, 0.8, 1, 1, 1], sleeps)
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import logging
 import requests
@@ -10,71 +11,88 @@ from waiter.format import format_last_request_time
 from waiter.format import format_status
 from waiter.querying import get_service, get_services_using_token
 from waiter.querying import print_no_data, query_service, query_services
-from waiter.util import is_service_current, str2bool, response_message, print_error, wait_until
+from waiter.util import is_service_current, str2bool, response_message, print_error, print_info, wait_until
 
+DEFAULT_KILL_PARALLELISM = 8
 
-def ping_on_cluster(cluster, timeout, wait_for_request, token_name, service_exists_fn):
-    """Pings using the given token name (or ^SERVICE-ID#) in the given cluster."""
-    cluster_name = cluster['name']
 
-    def perform_ping():
-        status = None
-        try:
-            default_queue_timeout_millis = 300000
-            timeout_seconds = timeout if wait_for_request else 5
-            timeout_millis = timeout_seconds * 1000
-            headers = {
-                'X-Waiter-Queue-Timeout': str(max(default_queue_timeout_millis, timeout_millis)),
-                'X-Waiter-Token': token_name,
-                'X-Waiter-Timeout': str(timeout_millis)
-            }
-            read_timeout = timeout_seconds if wait_for_request else (timeout_seconds + 5)
-            resp = http_util.get(cluster, '/waiter-ping', headers=headers, read_timeout=read_timeout)
-            logging.debug(f'Response status code: {resp.status_code}')
-            resp_json = resp.json()
-            if resp.status_code == 200:
-                status = resp_json['service-state']['status']
-                ping_response = resp_json['ping-response']
-                ping_response_result = ping_response['result']
-                if ping_response_result == 'received-response':
-                    ping_response_status = ping_response['status']
-                    if ping_response_status == 200:
-                        print(terminal.success('Ping successful.'))
-                        result = True
-                    else:
-                        print_error(f'Ping responded with non-200 status {ping_response_status}.')
-                        try:
-                            ping_response_waiter_error = json.loads(ping_response['body'])['waiter-error']['message']
-                            print_error(ping_response_waiter_error)
-                        except json.JSONDecodeError:
-                            logging.debug('Ping response is not in json format, cannot display waiter-error message.')
-                        except KeyError:
-                            logging.debug('Ping response body does not contain waiter-error message.')
-                        result = False
-                elif ping_response_result == 'timed-out':
-                    if wait_for_request:
-                        print_error('Ping request timed out.')
-                        result = False
-                    else:
-                        logging.debug('ignoring ping request timeout due to --no-wait')
-                        result = True
+def send_ping(cluster, timeout, wait_for_request, token_name):
+    """
+    Pings using the given token name (or ^SERVICE-ID#) in the given cluster without printing anything.
+    Returns whether the ping succeeded, the service status reported by Waiter (if any), and the
+    message to show the user (if any) describing the outcome of the ping.
+    """
+    status = None
+    message = None
+    try:
+        default_queue_timeout_millis = 300000
+        timeout_seconds = timeout if wait_for_request else 5
+        timeout_millis = timeout_seconds * 1000
+        headers = {
+            'X-Waiter-Queue-Timeout': str(max(default_queue_timeout_millis, timeout_millis)),
+            'X-Waiter-Token': token_name,
+            'X-Waiter-Timeout': str(timeout_millis)
+        }
+        read_timeout = timeout_seconds if wait_for_request else (timeout_seconds + 5)
+        resp = http_util.get(cluster, '/waiter-ping', headers=headers, read_timeout=read_timeout)
+        logging.debug(f'Response status code: {resp.status_code}')
+        resp_json = resp.json()
+        if resp.status_code == 200:
+            status = resp_json['service-state']['status']
+            ping_response = resp_json['ping-response']
+            ping_response_result = ping_response['result']
+            if ping_response_result == 'received-response':
+                ping_response_status = ping_response['status']
+                if ping_response_status == 200:
+                    message = 'Ping successful.'
+                    result = True
                 else:
-                    print_error(f'Encountered unknown ping result: {ping_response_result}.')
+                    message = f'Ping responded with non-200 status {ping_response_status}.'
+                    try:
+                        ping_response_waiter_error = json.loads(ping_response['body'])['waiter-error']['message']
+                        message = f'{message}\n{ping_response_waiter_error}'
+                    except json.JSONDecodeError:
+                        logging.debug('Ping response is not in json format, cannot display waiter-error message.')
+                    except KeyError:
+                        logging.debug('Ping response body does not contain waiter-error message.')
+                    result = False
+            elif ping_response_result == 'timed-out':
+                if wait_for_request:
+                    message = 'Ping request timed out.'
                     result = False
+                else:
+                    logging.debug('ignoring ping request timeout due to --no-wait')
+                    result = True
             else:
-                print_error(response_message(resp_json))
+                message = f'Encountered unknown ping result: {ping_response_result}.'
                 result = False
-        except Exception:
+        else:
+            message = response_message(resp_json)
             result = False
-            message = f'Encountered error while pinging in {cluster_name}.'
-            logging.exception(message)
-            if wait_for_request:
-                print_error(message)
+    except Exception:
+        result = False
+        error_message = f'Encountered error while pinging in {cluster["name"]}.'
+        logging.exception(error_message)
+        if wait_for_request:
+            message = error_message
 
+    return result, status, message
+
+
+def ping_on_cluster(cluster, timeout, wait_for_request, token_name, service_exists_fn):
+    """Pings using the given token name (or ^SERVICE-ID#) in the given cluster."""
+
+    def perform_ping():
+        result, status, message = send_ping(cluster, timeout, wait_for_request, token_name)
+        if message:
+            if result:
+                print(terminal.success(message))
+            else:
+                print_error(message)
         return result, status
 
     def check_service_status():
-        result = wait_until(service_exists_fn, timeout=timeout, interval=5)
+        result = wait_until(service_exists_fn, timeout=timeout)
         if result:
             print(f'Service is currently {format_status(result["status"])}.')
             return True
@@ -93,7 +111,8 @@ def ping_on_cluster(cluster, timeout, wait_for_request, token_name, service_exis
 
 def token_has_current_service(cluster, token_name, current_token_etag):
     """If the given token has a "current" service, returns that service else None"""
-    services = get_services_using_token(cluster, token_name)
+    # Only the services of the current token version are listed, so polling this is cheap
+    services = get_services_using_token(cluster, token_name, token_version=current_token_etag)
     if services is not None:
         services = [s for s in services if is_service_current(s, current_token_etag, token_name)]
         return services[0] if len(services) > 0 else False
@@ -129,22 +148,24 @@ def ping_service_on_cluster(cluster, service_id, timeout, wait_for_request):
 
 
 def kill_service_on_cluster(cluster, service_id, timeout_seconds):
-    """Kills the service with the given service id in the given cluster."""
+    """
+    Kills the service with the given service id in the given cluster.
+    Callers disable retries (see http_util.set_retries) before killing any services.
+    """
     cluster_name = cluster['name']
-    http_util.set_retries(0)
     try:
-        print(f'Killing service {terminal.bold(service_id)} in {terminal.bold(cluster_name)}...')
+        print_info(f'Killing service {terminal.bold(service_id)} in {terminal.bold(cluster_name)}...')
         params = {'timeout': timeout_seconds * 1000}
         resp = http_util.delete(cluster, f'/apps/{service_id}', params=params, read_timeout=timeout_seconds)
         logging.debug(f'Response status code: {resp.status_code}')
         if resp.status_code == 200:
             routers_agree = resp.json().get('routers-agree')
             if routers_agree:
-                print(f'Successfully killed {service_id} in {cluster_name}.')
+                print_info(f'Successfully killed {service_id} in {cluster_name}.')
                 return True
             else:
-                print(f'Successfully killed {service_id} in {cluster_name}. '
-                      f'Server-side timeout waiting for routers to update.')
+                print_info(f'Successfully killed {service_id} in {cluster_name}. '
+                           f'Server-side timeout waiting for routers to update.')
                 return False
         else:
             print_error(response_message(resp.json()))
@@ -159,9 +180,42 @@ def kill_service_on_cluster(cluster, service_id, timeout_seconds):
         print_error(message)
 
 
+async def kill_services_async(cluster_service_id_pairs, timeout_seconds, parallelism):
+    """Kills the given services, with at most parallelism kills in flight at once, returning the per-service results"""
+    semaphore = asyncio.Semaphore(parallelism)
+
+    async def kill(cluster, service_id):
+        async with semaphore:
+            return await http_util.call_async(kill_service_on_cluster, cluster, service_id, timeout_seconds)
+
+    return await asyncio.gather(*[kill(c, s) for c, s in cluster_service_id_pairs])
+
+
+def kill_services(cluster_service_id_pairs, timeout_seconds, parallelism):
+    """
+    Kills the given (cluster, service id) pairs concurrently, so that the wall time is bounded by the
+    slowest kill; prints a summary of the per-service results when killing more than one service.
+    Returns True if all of the services were killed successfully.
+    """
+    http_util.set_retries(0)
+    if len(cluster_service_id_pairs) == 1:
+        cluster, service_id = cluster_service_id_pairs[0]
+        return kill_service_on_cluster(cluster, service_id, timeout_seconds)
+
+    logging.debug(f'killing {len(cluster_service_id_pairs)} services with parallelism {parallelism}')
+    results = http_util.run_coroutine(kill_services_async(cluster_service_id_pairs, timeout_seconds, parallelism))
+    table = [[terminal.bold(cluster['name']), service_id,
+              terminal.success('Killed') if success else terminal.failed('Failed')]
+             for (cluster, service_id), success in zip(cluster_service_id_pairs, results)]
+    table_text = tabulate(table, headers=['Cluster', 'Service Id', 'Result'], tablefmt='plain')
+    print(f'\n{table_text}\n')
+    return all(results)
+
+
 def process_kill_request(clusters, token_name_or_service_id, is_service_id, force_flag, timeout_secs,
-                         no_service_result=False):
+                         no_service_result=False, parallelism=DEFAULT_KILL_PARALLELISM):
     """Kills the service(s) using the given token name or service-id.
+    Services that are killed without prompting are killed concurrently (at most parallelism at a time).
     Returns False if no services can be found or if there was a failure in deleting any service.
     Returns True if all services using the token were deleted successfully."""
     if is_service_id:
@@ -183,6 +237,8 @@ def process_kill_request(clusters, token_name_or_service_id, is_service_id, forc
     cluster_data_pairs = sorted(query_result['clusters'].items())
     clusters_by_name = {c['name']: c for c in clusters}
     overall_success = True
+    should_prompt = not force_flag and num_services > 1
+    cluster_service_id_pairs_to_kill = []
     for cluster_name, data in cluster_data_pairs:
         if is_service_id:
             service = data['service']
@@ -198,7 +254,7 @@ def process_kill_request(clusters, token_name_or_service_id, is_service_id, forc
             status = format_status(status_string)
             inactive = status_string == 'Inactive'
             should_kill = False
-            if force_flag or num_services == 1:
+            if not should_prompt:
                 should_kill = True
             else:
                 url = urljoin(cluster['url'], f'apps/{service_id}')
@@ -234,6 +290,14 @@ def process_kill_request(clusters, token_name_or_service_id, is_service_id, forc
                 should_kill = False
 
             if should_kill:
-                success = kill_service_on_cluster(cluster, service_id, timeout_secs)
-                overall_success = overall_success and success
+                if should_prompt:
+                    http_util.set_retries(0)
+                    success = kill_service_on_cluster(cluster, service_id, timeout_secs)
+                    overall_success = overall_success and success
+                else:
+                    cluster_service_id_pairs_to_kill.append((cluster, service_id))
+
+    if cluster_service_id_pairs_to_kill:
+        success = kill_services(cluster_service_id_pairs_to_kill, timeout_secs, parallelism)
+        overall_success = overall_success and success
     return overall_success
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+from waiter import http_util
+
+CLUSTER_NAMES_FILE = 'cluster-names.json'
+
+__directory = None
+__responses_enabled = False
+__responses_max_bytes = None
+__cluster_names_ttl_secs = 0
+
+
+def configure(config):
+    """Configures the on-disk cache using the given config"""
+    global __directory
+    global __responses_enabled
+    global __responses_max_bytes
+    global __cluster_names_ttl_secs
+    cache_config = config.get('cache')
+    __directory = os.path.expanduser(cache_config.get('directory'))
+    responses_config = cache_config.get('responses')
+    __responses_enabled = responses_config.get('enabled')
+    __responses_max_bytes = responses_config.get('max-bytes')
+    __cluster_names_ttl_secs = cache_config.get('cluster-names').get('ttl-secs')
+    logging.debug(f'using cache directory {__directory} (responses enabled = {__responses_enabled})')
+
+
+def cache_path(*names):
+    """
+    Returns the path of the given file in the cache directory, creating any
+    missing parent directories; returns None if the cache is not configured
+    """
+    if not __directory:
+        return None
+    path = os.path.join(__directory, *names)
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    except OSError:
+        logging.exception(f'unable to create cache directory for {path}')
+        return None
+    return path
+
+
+def read_json(path):
+    """Returns the JSON content of the given cache file, or None if it is missing or unreadable"""
+    if not path or not os.path.isfile(path):
+        return None
+    try:
+        with open(path) as cache_file:
+            return json.load(cache_file)
+    except Exception:
+        logging.exception(f'encountered exception when reading cache file {path}')
+        return None
+
+
+def write_json(path, content):
+    """Atomically replaces the given cache file with the JSON-encoded content"""
+    if not path:
+        return
+    try:
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path), delete=False) as temp_file:
+            json.dump(content, temp_file)
+        os.replace(temp_file.name, path)
+    except Exception:
+        logging.exception(f'encountered exception when writing cache file {path}')
+
+
+def __response_path(cluster, endpoint, params):
+    """Returns the path of the cached response for the given request"""
+    key = json.dumps([cluster['url'], endpoint, params], sort_keys=True)
+    return cache_path('responses', hashlib.sha256(key.encode()).hexdigest())
+
+
+def __evict_responses():
+    """Removes the least recently used responses until the cache fits in the configured number of bytes"""
+    responses_directory = cache_path('responses', '')
+    try:
+        entries = []
+        for entry in os.scandir(responses_directory):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= __responses_max_bytes:
+                break
+            logging.debug(f'evicting cached response {path}')
+            os.remove(path)
+            total_bytes -= size
+    except OSError:
+        logging.exception('encountered exception when evicting cached responses')
+
+
+def get_data(cluster, endpoint, params=None):
+    """
+    GETs (via make_data_request) the JSON data at /endpoint on the cluster. When the response cache
+    is enabled, the request is revalidated with If-None-Match against the cached ETag, and the cached
+    data is used when the server reports it has not been modified. Servers that ignore If-None-Match
+    always respond with the full data (and a 200), which simply refreshes the cached entry.
+    """
+    if not __responses_enabled:
+        return http_util.make_data_request(cluster, lambda: http_util.get(cluster, endpoint, params=params))
+
+    path = __response_path(cluster, endpoint, params)
+    entry = read_json(path)
+    cached_data = entry['data'] if entry else None
+    headers = {'If-None-Match': entry['etag']} if entry else {}
+    data, resp_headers = http_util.make_data_request(
+        cluster, lambda: http_util.get(cluster, endpoint, params=params, headers=headers), not_modified_data=cached_data)
+    if data is not None and data is cached_data:
+        logging.debug(f'using cached response for {endpoint} with params {params} on {cluster["name"]}')
+        resp_headers.setdefault('ETag', entry['etag'])
+        try:
+            os.utime(path)
+        except OSError:
+            logging.exception(f'unable to mark cached response {path} as used')
+    elif data is not None and resp_headers.get('ETag'):
+        write_json(path, {'url': cluster['url'], 'endpoint': endpoint, 'params': params,
+                          'etag': resp_headers['ETag'], 'data': data})
+        __evict_responses()
+    return data, resp_headers
+
+
+def get_cluster_names(urls):
+    """Returns the cached server-side cluster names, keyed by cluster url, of the given urls that have not expired"""
+    if not __cluster_names_ttl_secs:
+        return {}
+    entries = read_json(cache_path(CLUSTER_NAMES_FILE)) or {}
+    now = time.time()
+    return {url: entries[url]['name']
+            for url in urls
+            if url in entries and now - entries[url]['time'] < __cluster_names_ttl_secs}
+
+
+def put_cluster_names(url_to_name):
+    """Caches the given server-side cluster names, keyed by cluster url"""
+    if not __cluster_names_ttl_secs or not url_to_name:
+        return
+    path = cache_path(CLUSTER_NAMES_FILE)
+    entries = read_json(path) or {}
+    now = time.time()
+    entries.update({url: {'name': name, 'time': now} for url, name in url_to_name.items()})
+    write_json(path, entries)
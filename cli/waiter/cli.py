@@ -1,64 +1,117 @@
 import argparse
+import importlib
 import logging
+import time
 from urllib.parse import urlparse
 
-from waiter import configuration, http_util, metrics, version
-from waiter.subcommands import create, delete, init, kill, maintenance, ping, show, ssh, tokens, update
+from waiter import completion, configuration, metrics, profiling, version
 import waiter.plugins as waiter_plugins
 
-parser = argparse.ArgumentParser(description='waiter is the Waiter CLI')
-parser.add_argument('--cluster', '-c', help='the name of the Waiter cluster to use')
-parser.add_argument('--url', '-u', help='the url of the Waiter cluster to use')
-parser.add_argument('--config', '-C', help='the configuration file to use')
-parser.add_argument('--verbose', '-v', help='be more verbose/talkative (useful for debugging)',
-                    dest='verbose', action='store_true')
-parser.add_argument('--version', help='output version information and exit',
-                    version=f'%(prog)s version {version.VERSION}', action='version')
-
-subparsers = parser.add_subparsers(dest='action')
-
+# Subcommand modules (and, through them, requests, tabulate, yaml, etc.) are
+# only imported once we know which action is being run, so that commands like
+# `waiter --version` and `waiter --help` start up quickly
 actions = {
+    'apply': {
+        'module': 'apply',
+        'help': 'create or update the tokens defined in a directory or manifest'
+    },
+    'completion': {
+        'module': 'completion',
+        'help': 'shell completion support'
+    },
     'create': {
-        'run-function': create.register(subparsers.add_parser),
-        'implicit-args-function': create.add_implicit_arguments
+        'module': 'create',
+        'help': 'create token'
     },
     'delete': {
-        'run-function': delete.register(subparsers.add_parser)
+        'module': 'delete',
+        'help': 'delete token by name'
     },
     'init': {
-        'run-function': init.register(subparsers.add_parser),
-        'implicit-args-function': init.add_implicit_arguments
+        'module': 'init',
+        'help': 'init token'
     },
     'kill': {
-        'run-function': kill.register(subparsers.add_parser)
+        'module': 'kill',
+        'help': 'kill services'
     },
     'maintenance': {
-        'run-function': maintenance.register(subparsers.add_parser)
+        'module': 'maintenance',
+        'help': 'manage maintenance mode for a token'
     },
     'ping': {
-        'run-function': ping.register(subparsers.add_parser)
+        'module': 'ping',
+        'help': 'ping token by name'
     },
     'show': {
-        'run-function': show.register(subparsers.add_parser)
+        'module': 'show',
+        'help': 'show token(s) by name'
     },
     'ssh': {
-        'run-function': ssh.register(subparsers.add_parser)
+        'module': 'ssh',
+        'help': 'ssh to a Waiter instance'
     },
     'start': {
-        'run-function': maintenance.register_stop('start', subparsers.add_parser)
+        'module': 'maintenance',
+        'help': 'stop maintenance mode for a token. '
+                'Requests to the token will be handled normally. '
+                'By default, also ping the token to ensure a running service.',
+        'register-function': lambda module, add_parser: module.register_stop('start', add_parser)
     },
     'stop': {
-        'run-function': maintenance.register_start('stop', subparsers.add_parser)
+        'module': 'maintenance',
+        'help': 'start maintenance mode for a token. '
+                'All requests to this token will begin to receive a 503 response. '
+                "By default, also kill the token's currently running services.",
+        'register-function': lambda module, add_parser: module.register_start('stop', add_parser)
     },
     'tokens': {
-        'run-function': tokens.register(subparsers.add_parser)
+        'module': 'tokens',
+        'help': 'list tokens by owner'
     },
     'update': {
-        'run-function': update.register(subparsers.add_parser),
-        'implicit-args-function': update.add_implicit_arguments
+        'module': 'update',
+        'help': 'update token'
     }
 }
 
+# Hidden action used by the shell completion scripts; answered from the local index without any network I/O
+COMPLETE_ACTION = '__complete'
+
+
+def build_parser(selected_action=None):
+    """
+    Builds the top-level argument parser. Only the selected action's subcommand module is imported and
+    registered; every other action gets a lightweight placeholder so that it still shows up in the help.
+    Returns the parser along with the selected action's run function and implicit arguments function.
+    """
+    parser = argparse.ArgumentParser(description='waiter is the Waiter CLI')
+    parser.add_argument('--cluster', '-c', help='the name of the Waiter cluster to use')
+    parser.add_argument('--url', '-u', help='the url of the Waiter cluster to use')
+    parser.add_argument('--config', '-C', help='the configuration file to use')
+    parser.add_argument('--verbose', '-v', help='be more verbose/talkative (useful for debugging)',
+                        dest='verbose', action='store_true')
+    parser.add_argument('--profile', help='print where the time went (parsing, configuration, each HTTP request, '
+                                          'rendering, etc.) to standard error', dest='profile', action='store_true')
+    parser.add_argument('--profile-stats', help='also write cProfile stats of the main thread to the given file '
+                                                '(implies --profile)', dest='profile_stats', metavar='PSTATS_FILE')
+    parser.add_argument('--version', help='output version information and exit',
+                        version=f'%(prog)s version {version.VERSION}', action='version')
+
+    subparsers = parser.add_subparsers(dest='action')
+    run_function = None
+    add_implicit_arguments = None
+    for action, action_config in actions.items():
+        if action == selected_action:
+            module = importlib.import_module(f'waiter.subcommands.{action_config["module"]}')
+            register = action_config.get('register-function', lambda m, add_parser: m.register(add_parser))
+            run_function = register(module, subparsers.add_parser)
+            add_implicit_arguments = getattr(module, 'add_implicit_arguments', None)
+        else:
+            subparsers.add_parser(action, help=action_config['help'], add_help=False)
+
+    return parser, run_function, add_implicit_arguments
+
 
 def load_target_clusters(config_map, url=None, cluster=None):
     """Given the config and (optional) url and cluster flags, returns the list of clusters to target"""
@@ -90,8 +143,16 @@ def run(args, plugins):
     processes global command line arguments, and calls other command line 
     sub-commands (actions) if necessary.
     """
-    args, unknown_args = parser.parse_known_args(args)
-    verbose = args.verbose
+    started_at = time.perf_counter()
+    if args and args[0] == COMPLETE_ACTION:
+        return completion.complete(args[1:])
+
+    selected_action = build_parser()[0].parse_known_args(args)[0].action
+    import_started_at = time.perf_counter()
+    parser, run_function, add_implicit_arguments = build_parser(selected_action)
+    import_ended_at = time.perf_counter()
+    parsed_args, unknown_args = parser.parse_known_args(args)
+    verbose = parsed_args.verbose
     if verbose:
         log_format = '%(asctime)s [%(levelname)s] [%(name)s] %(message)s'
         logging.getLogger('').handlers = []
@@ -99,15 +160,19 @@ def run(args, plugins):
     else:
         logging.disable(logging.FATAL)
 
-    if args.action:
-        add_implicit_arguments = actions[args.action].get('implicit-args-function', None)
-        if add_implicit_arguments:
-            add_implicit_arguments(unknown_args)
+    if add_implicit_arguments:
+        add_implicit_arguments(unknown_args)
 
-    args = parser.parse_args()
+    args = parser.parse_args(args)
     args = vars(args)
     logging.debug('args: %s', args)
     args.pop('verbose')
+    profile_stats = args.pop('profile_stats')
+    if args.pop('profile') or profile_stats:
+        profiling.start(started_at, profile_stats)
+        profiling.record_phase('import subcommand module', import_ended_at - import_started_at)
+        profiling.record_phase('parse arguments',
+                               (import_started_at - started_at) + (time.perf_counter() - import_ended_at))
 
     action = args.pop('action')
     config_path = args.pop('config')
@@ -120,15 +185,21 @@ def run(args, plugins):
     if action is None:
         parser.print_help()
     else:
-        config_map = configuration.load_config_with_defaults(config_path)
+        with profiling.phase('import http modules'):
+            from waiter import cache, http_util
+        with profiling.phase('load configuration'):
+            config_map = configuration.load_config_with_defaults(config_path)
         try:
-            metrics.initialize(config_map)
-            metrics.inc(f'command.{action}.runs')
-            clusters = load_target_clusters(config_map, url, cluster)
-            enforce_cluster = (url or cluster) and True
-            http_util.configure(config_map, plugins)
+            with profiling.phase('configure metrics and http'):
+                metrics.initialize(config_map)
+                metrics.inc(f'command.{action}.runs')
+                clusters = load_target_clusters(config_map, url, cluster)
+                enforce_cluster = (url or cluster) and True
+                http_util.configure(config_map, plugins)
+                cache.configure(config_map)
             args = {k: v for k, v in args.items() if v is not None}
-            result = actions[action]['run-function'](clusters, args, config_path, enforce_cluster)
+            with profiling.phase(f'run {action}'):
+                result = run_function(clusters, args, config_path, enforce_cluster)
             logging.debug(f'result: {result}')
             if result == 0:
                 metrics.inc(f'command.{action}.result.success')
@@ -136,6 +207,10 @@ def run(args, plugins):
                 metrics.inc(f'command.{action}.result.failure')
             return result
         finally:
-            metrics.close()
+            with profiling.phase('log connection pool statistics'):
+                http_util.log_pool_statistics()
+            with profiling.phase('close metrics'):
+                metrics.close()
+            profiling.report(f'waiter {action}')
 
     return None
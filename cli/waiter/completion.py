@@ -0,0 +1,204 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+from waiter import configuration, version
+
+INDEX_FILE = 'completion-index.json'
+REFRESH_LOCK_FILE = 'completion-refresh.lock'
+
+# A refresh that has held the lock for longer than this is assumed to have died
+REFRESH_LOCK_STALE_SECS = 5 * 60
+
+# Global options that take a value, mapped to the argparse dest of that value
+GLOBAL_VALUE_OPTIONS = {'--cluster': 'cluster', '-c': 'cluster',
+                        '--url': 'url', '-u': 'url',
+                        '--config': 'config', '-C': 'config'}
+
+
+def __cache_file(config, name):
+    """Returns the path of the given completion file in the configured cache directory"""
+    return os.path.join(os.path.expanduser(config['cache']['directory']), name)
+
+
+def __subparsers_choices(parser):
+    """Returns the name -> parser map of the given parser's sub-commands, or an empty map if it has none"""
+    return next((a.choices for a in parser._actions if isinstance(a, argparse._SubParsersAction)), {})
+
+
+def __parser_spec(parser):
+    """Returns the option strings, value-taking option strings, positionals and sub-commands of the given parser"""
+    options = []
+    value_options = []
+    positionals = []
+    for action in parser._actions:
+        if isinstance(action, argparse._SubParsersAction):
+            continue
+        if action.option_strings:
+            options.extend(action.option_strings)
+            if action.nargs != 0:
+                value_options.extend(action.option_strings)
+        else:
+            positionals.append(action.dest)
+    return {'options': sorted(options),
+            'value-options': sorted(value_options),
+            'positionals': positionals,
+            'sub-commands': {name: __parser_spec(p) for name, p in __subparsers_choices(parser).items()}}
+
+
+def parser_spec():
+    """
+    Returns the completion spec (option strings, positionals and sub-commands) of the CLI and every
+    action. This imports every subcommand module, so it is only computed when the index is refreshed.
+    """
+    from waiter import cli
+    spec = __parser_spec(cli.build_parser()[0])
+    for action in cli.actions:
+        action_parser = cli.build_parser(action)[0]
+        spec['sub-commands'][action] = __parser_spec(__subparsers_choices(action_parser)[action])
+    return spec
+
+
+def load_index(config):
+    """Returns the completion index in the configured cache directory, or None if it is missing or unreadable"""
+    try:
+        with open(__cache_file(config, INDEX_FILE)) as index_file:
+            return json.load(index_file)
+    except (OSError, ValueError):
+        return None
+
+
+def __acquire_refresh_lock(config):
+    """Attempts to create the refresh lock file, returning True if this process now holds the lock"""
+    path = __cache_file(config, REFRESH_LOCK_FILE)
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        if os.path.exists(path) and time.time() - os.path.getmtime(path) > REFRESH_LOCK_STALE_SECS:
+            os.remove(path)
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+        return True
+    except OSError:
+        return False
+
+
+def __release_refresh_lock(config):
+    """Removes the refresh lock file"""
+    try:
+        os.remove(__cache_file(config, REFRESH_LOCK_FILE))
+    except OSError:
+        logging.exception('unable to remove the completion refresh lock')
+
+
+def __spawn_refresh(config, config_path):
+    """Refreshes the completion index in a detached background process, unless a refresh is already running"""
+    if not __acquire_refresh_lock(config):
+        return
+    # Re-run the same entry point (which may be a wrapper that configures plugins) unless we were run via -m
+    if os.path.basename(sys.argv[0]) == '__main__.py':
+        command = [sys.executable, '-m', 'waiter']
+    else:
+        command = [sys.executable, sys.argv[0]]
+    if config_path:
+        command.extend(['--config', os.path.abspath(config_path)])
+    command.extend(['completion', 'refresh'])
+    try:
+        subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+    except OSError:
+        __release_refresh_lock(config)
+
+
+def __parse_words(words, spec):
+    """
+    Walks the given (already complete) command line words, returning the global option values, the spec
+    of the innermost sub-command, the number of positionals given to it so far, and the dest of the option
+    whose value is being completed (the option string itself if it is not a global option), if any
+    """
+    global_values = {}
+    command_spec = spec
+    num_positionals = 0
+    value_option = None
+    for word in words:
+        if value_option:
+            global_values[value_option] = word
+            value_option = None
+        elif word.startswith('-'):
+            if command_spec is spec and word in GLOBAL_VALUE_OPTIONS:
+                value_option = GLOBAL_VALUE_OPTIONS[word]
+            elif word in command_spec['value-options']:
+                value_option = word
+        elif num_positionals == 0 and word in command_spec['sub-commands']:
+            command_spec = command_spec['sub-commands'][word]
+        else:
+            num_positionals += 1
+    return global_values, command_spec, num_positionals, value_option
+
+
+def __positional_candidates(index, global_values, dest):
+    """Returns the indexed tokens, service ids and instance id prefixes that can be given as the dest positional"""
+    cluster_name = global_values.get('cluster')
+    cluster_entries = [entry for name, entry in index.get('clusters', {}).items()
+                       if not cluster_name or name.lower() == cluster_name.lower()]
+    kinds = dest.split('-or-')
+    candidates = set()
+    for entry in cluster_entries:
+        if 'token' in kinds:
+            candidates.update(entry['tokens'])
+        if 'service-id' in kinds:
+            candidates.update(entry['service-ids'])
+        if 'instance-id' in kinds:
+            candidates.update(f'{service_id}.' for service_id in entry['service-ids'])
+    return candidates
+
+
+def complete(args):
+    """
+    Prints the completions, one per line, for the word at position args[0] of the command line args[1:]
+    (which includes the program name). Only the local index is consulted, so completions are answered
+    without any network I/O; a stale or missing index is refreshed in the background.
+    """
+    if not args:
+        return 1
+    current = int(args[0])
+    words = args[1:]
+    prefix = words[current] if current < len(words) else ''
+
+    config_path = next((words[i + 1] for i in range(1, min(current, len(words)) - 1)
+                        if GLOBAL_VALUE_OPTIONS.get(words[i]) == 'config'), None)
+    try:
+        config = configuration.load_config_with_defaults(config_path)
+    except Exception:
+        return 1
+
+    index = load_index(config)
+    refresh_interval_secs = config['completion']['refresh-interval-secs']
+    if not index or index.get('version') != version.VERSION:
+        __spawn_refresh(config, config_path)
+        index = {'spec': parser_spec(), 'clusters': (index or {}).get('clusters', {})}
+    elif time.time() - index.get('time', 0) > refresh_interval_secs:
+        __spawn_refresh(config, config_path)
+
+    spec = index['spec']
+    global_values, command_spec, num_positionals, value_option = __parse_words(words[1:current], spec)
+    if value_option == 'cluster':
+        candidates = {c['name'] for c in config.get('clusters', [])}
+    elif value_option:
+        # Let the shell fall back to its default (file name) completion
+        candidates = set()
+    elif prefix.startswith('-'):
+        candidates = set(command_spec['options'])
+    elif num_positionals == 0 and command_spec['sub-commands']:
+        candidates = set(command_spec['sub-commands'])
+    elif command_spec['positionals']:
+        dest = command_spec['positionals'][min(num_positionals, len(command_spec['positionals']) - 1)]
+        candidates = __positional_candidates(index, global_values, dest)
+    else:
+        candidates = set()
+
+    for candidate in sorted(c for c in candidates if c.startswith(prefix)):
+        print(candidate)
+    return 0
@@ -17,10 +17,22 @@ ADDITIONAL_CONFIG_PATHS = ['.waiter.json',
 
 DEFAULT_CONFIG = {'http': {'retries': 2,
                            'connect-timeout': 3.05,
-                           'read-timeout': 20},
+                           'read-timeout': 20,
+                           'max-concurrency': 32,
+                           'pool-connections': 10,
+                           'pool-maxsize': 32,
+                           'pool-block': False,
+                           'keep-alive-idle-secs': None},
+                  'cache': {'directory': '~/.cache/waiter',
+                            'responses': {'enabled': False,
+                                          'max-bytes': 64 * 1024 * 1024},
+                            'cluster-names': {'ttl-secs': 24 * 60 * 60}},
+                  'completion': {'refresh-interval-secs': 15 * 60},
                   'metrics': {'disabled': True,
+                              'transport': 'tcp',
                               'max-retries': 2,
-                              'timeout': 0.15}}
+                              'timeout': 0.15,
+                              'flush-interval-secs': None}}
 
 
 def __load_first_json_file(paths):
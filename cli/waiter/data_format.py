@@ -1,11 +1,146 @@
 import json
 import logging
 import os
-import string
+import re
 import sys
 
 import yaml
 
+from waiter import profiling
+from waiter.templating import compile_template, format_missing_variables
+
+# Compact YAML is written in flow style on a single line, as if the line width were (practically) unlimited
+COMPACT_YAML_WIDTH = 2 ** 30
+
+# The serializer backends of each format, most preferred first (see register_serializer),
+# and the backends that are actually available, which are loaded on first use
+__serializer_backends = {'json': [], 'yaml': []}
+__loaded_serializers = {}
+
+
+def register_serializer(format_name, backend_fn):
+    """
+    Registers a serializer backend for the given format (json or yaml), taking precedence over the backends
+    registered before it. backend_fn is called on first use of the format, and returns a (loads, dumps) pair,
+    where dumps(data, compact) returns the serialized data, or None to defer to the next backend (e.g. for
+    data that the backend cannot serialize exactly as the next one would). backend_fn raises ImportError if
+    the backend's library is not installed, in which case the backend is skipped.
+    """
+    __serializer_backends[format_name].insert(0, backend_fn)
+    __loaded_serializers.pop(format_name, None)
+
+
+def __serializers(format_name):
+    """Returns the (loads, dumps) pairs of the available backends of the given format, most preferred first"""
+    serializers = __loaded_serializers.get(format_name)
+    if serializers is None:
+        serializers = []
+        for backend_fn in __serializer_backends[format_name]:
+            try:
+                serializers.append(backend_fn())
+            except ImportError:
+                logging.debug(f'{backend_fn.__name__} serializer for {format_name} is not available')
+        __loaded_serializers[format_name] = serializers
+    return serializers
+
+
+def loads(format_name, data):
+    """Parses the given data using the first available backend of the format that is able to parse it"""
+    serializers = __serializers(format_name)
+    for index, (loads_fn, _) in enumerate(serializers):
+        try:
+            return loads_fn(data)
+        except Exception:
+            # Only the last (most lenient) backend's error is reported
+            if index == len(serializers) - 1:
+                raise
+
+
+def dumps(format_name, data, compact=False):
+    """Serializes the given data using the first available backend of the format that is able to serialize it"""
+    for _, dumps_fn in __serializers(format_name):
+        result = dumps_fn(data, compact)
+        if result is not None:
+            return result
+
+
+def __json_backend():
+    """The standard library JSON backend"""
+
+    def dumps_fn(data, compact):
+        if compact:
+            return json.dumps(data, sort_keys=True, separators=(',', ':'))
+        return json.dumps(data, indent=2, sort_keys=True)
+
+    return json.loads, dumps_fn
+
+
+def __floats(data):
+    """Returns the list of the floats in the given (JSON-like) data"""
+    floats = []
+    pending = [data]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, float):
+            floats.append(value)
+        elif isinstance(value, dict):
+            pending.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            pending.extend(value)
+    return floats
+
+
+def __orjson_backend():
+    """
+    The (much faster) orjson backend; it defers to the standard library for data with non-ASCII characters
+    (which the standard library escapes), for data with floats that orjson formats differently (e.g. 1e-5 rather
+    than 1e-05, and null rather than NaN or Infinity), and for data orjson does not support (e.g. non-string keys)
+    """
+    import orjson
+
+    def dumps_fn(data, compact):
+        floats = __floats(data)
+        # json.dumps formats floats with repr, and so must orjson for the output to be identical
+        if floats and orjson.dumps(floats) != f'[{",".join(repr(f) for f in floats)}]'.encode():
+            return None
+        option = orjson.OPT_SORT_KEYS if compact else orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2
+        try:
+            result = orjson.dumps(data, option=option)
+        except TypeError:
+            return None
+        return result.decode() if result.isascii() else None
+
+    return orjson.loads, dumps_fn
+
+
+def __pyyaml_backend():
+    """The pure Python PyYAML backend"""
+
+    def dumps_fn(data, compact):
+        if compact:
+            return yaml.safe_dump(data, default_flow_style=True, width=COMPACT_YAML_WIDTH)
+        return yaml.safe_dump(data)
+
+    return yaml.safe_load, dumps_fn
+
+
+def __libyaml_backend():
+    """The (much faster) libyaml backend of PyYAML, which is only available if PyYAML was built with libyaml"""
+    from yaml import CSafeDumper, CSafeLoader
+
+    def dumps_fn(data, compact):
+        if compact:
+            return yaml.dump(data, Dumper=CSafeDumper, default_flow_style=True, width=COMPACT_YAML_WIDTH)
+        return yaml.dump(data, Dumper=CSafeDumper)
+
+    return lambda data: yaml.load(data, Loader=CSafeLoader), dumps_fn
+
+
+register_serializer('json', __json_backend)
+register_serializer('json', __orjson_backend)
+register_serializer('yaml', __pyyaml_backend)
+register_serializer('yaml', __libyaml_backend)
+
 
 class DataFormat:
     def __str__(self):
@@ -16,14 +151,15 @@ class DataFormat:
         """Returns the name of the format."""
         raise NotImplementedError('Method has not been implemented!')
 
-    def parse(self, data):
-        """Returns the parsed data."""
+    def parse(self, data, path=None):
+        """Returns the parsed data, which was read from the given path (if any)."""
         raise NotImplementedError('Method has not been implemented!')
 
-    def dump(self, out_data, out_file=None):
+    def dump(self, out_data, out_file=None, compact=False):
         """
         If the file is provided, writes the string representation of the data to the file.
         Else it returns the string representation of the data in the format.
+        If compact is true, the data is written without indentation or line breaks.
         """
         raise NotImplementedError('Method has not been implemented!')
 
@@ -32,69 +168,90 @@ class JsonDataFormat(DataFormat):
     def name(self):
         return 'json'
 
-    def parse(self, data):
+    def parse(self, data, path=None):
         try:
             logging.debug(f'parsing input data as json')
-            content = json.loads(data)
+            content = loads(self.name(), data)
             return content
         except Exception:
             raise ValueError('Malformed JSON in input.')
 
-    def dump(self, out_data, out_file=None):
+    def dump(self, out_data, out_file=None, compact=False):
         if out_file:
-            json.dump(out_data, out_file, indent=2, sort_keys=True)
+            out_file.write(dumps(self.name(), out_data, compact=compact))
         else:
-            return json.dumps(out_data, indent=2, sort_keys=True)
+            return dumps(self.name(), out_data, compact=compact)
 
 
 class YamlDataFormat(DataFormat):
     def name(self):
         return 'yaml'
 
-    def parse(self, data):
+    def parse(self, data, path=None):
         try:
             logging.debug(f'parsing input data as yaml')
-            content = yaml.safe_load(data)
+            content = loads(self.name(), data)
             return content
         except Exception:
             raise ValueError('Malformed YAML in input.')
 
-    def dump(self, out_data, out_file=None):
+    def dump(self, out_data, out_file=None, compact=False):
         if out_file:
-            yaml.safe_dump(out_data, out_file)
+            out_file.write(dumps(self.name(), out_data, compact=compact))
         else:
-            return yaml.safe_dump(out_data)
+            return dumps(self.name(), out_data, compact=compact)
 
 
 JSON = JsonDataFormat()
 YAML = YamlDataFormat()
 
+# File extensions that identify the format of a file
+FORMAT_EXTENSIONS = {'.json': JSON, '.yaml': YAML, '.yml': YAML}
+
+# Leading whitespace to skip when sniffing the first character of the data
+LEADING_WHITESPACE_PATTERN = re.compile(r'\s*')
+
 
 class AnySupportedFormat(DataFormat):
     def name(self):
         return 'data'
 
-    def parse(self, data):
-        content = None
-        for input_format in [JSON, YAML]:
+    def parse(self, data, path=None):
+        """
+        Parses the data as the format it most likely is (see detect_formats), falling back to the other
+        formats only if that fails, so that the data is normally parsed just once
+        """
+        for input_format in detect_formats(data, path):
             try:
                 logging.debug(f'attempting to parse input data as {input_format}')
                 content = input_format.parse(data)
                 logging.debug(f'successfully parsed input data as {input_format}')
-                continue
+                return content
             except Exception:
                 logging.debug(f'error parsing input data as {input_format}')
-        if content is None:
-            raise ValueError('Malformed data in input.')
-        return content
+        raise ValueError('Malformed data in input.')
 
-    def dump(self, out_data, out_file=None):
+    def dump(self, out_data, out_file=None, compact=False):
         raise NotImplementedError('Data format needs to be specified explicitly!')
 
 
 ANY_FORMAT = AnySupportedFormat()
 
 
+def detect_formats(data, path=None):
+    """
+    Returns the formats to try when parsing the given data (read from path, if given), most likely first. The
+    format is detected from the path's extension if it has a known one, and otherwise from the first character
+    of the data: JSON documents start with { or [, which a YAML document rarely does (flow style YAML also
+    does, so YAML remains a fallback).
+    """
+    likely_format = FORMAT_EXTENSIONS.get(os.path.splitext(path)[1].lower()) if path else None
+    if likely_format is None:
+        start = LEADING_WHITESPACE_PATTERN.match(data).end()
+        likely_format = JSON if data[start:start + 1] in ('{', '[') else YAML
+    return [likely_format] + [f for f in [JSON, YAML] if f is not likely_format]
+
+
 def validate_options(options):
     """Validates whether unique file format is specified."""
     as_json = options.get(JSON.name())
@@ -139,6 +296,33 @@ def load_file(path):
     return content
 
 
+def load_context(context_file):
+    """Loads the context variables, used to render data files as templates, from the given JSON/YAML file"""
+    logging.debug(f'reading context from {context_file}')
+    context_content = load_file(context_file)
+    if not context_content:
+        raise Exception(f'Unable to load context from {context_file}.')
+
+    context_file_obj = YAML.parse(context_content)
+    if not isinstance(context_file_obj, dict):
+        raise Exception(f'Provided context file must evaluate to a dictionary, instead it is {context_file_obj}')
+    return context_file_obj
+
+
+def render_template(content, context):
+    """
+    Renders the given content as a template (see templating.Template) with the given context, reporting
+    every missing variable at once
+    """
+    try:
+        logging.debug(f'applying string templating to input using context {context}')
+        return compile_template(content).render(context)
+    except KeyError as ex:
+        raise Exception(f'Error when processing template: {format_missing_variables(ex.args)}')
+    except ValueError as ex:
+        raise Exception(f'Error when processing template: {ex}')
+
+
 def load_data(options):
     """
     Decode a JSON/YAML formatted file.
@@ -164,32 +348,18 @@ def load_data(options):
         context_file = options.get('context_file')
         if context_file:
             context_provided = True
-            logging.debug(f'reading context from {context_file}')
-            context_content = load_file(context_file)
-            if not context_content:
-                raise Exception(f'Unable to load context from {context_file}.')
-
-            context_file_obj = YAML.parse(context_content)
-            if not isinstance(context_file_obj, dict):
-                raise Exception(f'Provided context file must evaluate to a dictionary, instead it is {context_file_obj}')
-            context_dict.update(context_file_obj)
+            context_dict.update(load_context(context_file))
 
         context_overrides = options.get('context_overrides')
-        if context_overrides:
+        if context_overrides is not None:
             context_provided = True
             logging.debug(f'merging additional context {context_overrides}')
             context_dict.update(context_overrides)
 
         if context_provided:
-            try:
-                logging.debug(f'applying string templating to input using context {context_dict}')
-                string_template = string.Template(content)
-                content = string_template.substitute(context_dict)
-            except Exception as ex:
-                message = f'missing variable {ex}' if isinstance(ex, KeyError) else str(ex)
-                raise Exception(f'Error when processing template: {message}')
-
-    content = input_format.parse(content)
+            content = render_template(content, context_dict)
+
+    content = input_format.parse(content, path=None if input_file == '-' else input_file)
     if type(content) is dict:
         return content
     else:
@@ -197,8 +367,9 @@ def load_data(options):
 
 
 def display_data(options, data):
-    """Display data as JSON/YAML format to standard output."""
+    """Display data as JSON/YAML format (compact, if the compact option is set) to standard output."""
     input_format = determine_format(options)
-    result = input_format.dump(data)
-    if result:
-        print(result)
+    with profiling.phase('render'):
+        result = input_format.dump(data, compact=options.get('compact', False))
+        if result:
+            print(result)
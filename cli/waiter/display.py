@@ -1,11 +1,16 @@
-import collections
-
-from tabulate import tabulate
+import re
 
 from waiter import terminal
-from waiter.format import format_last_request_time, format_mem_field, format_memory_amount, format_status
+from waiter.format import format_mem_field, format_memory_amount, format_status, format_timestamp_strings
 from waiter.util import is_service_current, print_error
 
+# The separator between table columns, and how much wider than its header a column must be, as in tabulate's
+# plain format (which render_table reproduces)
+COLUMN_SEPARATOR = '  '
+HEADER_MIN_PADDING = 2
+
+ANSI_ESCAPE_PATTERN = re.compile(r'\x1b\[[0-9;]*m')
+
 
 def retrieve_num_instances(service):
     """Returns the total number of instances."""
@@ -36,6 +41,139 @@ def format_instance_status(instance):
         return terminal.failed(status)
 
 
+def __is_number(s):
+    """Returns true if tabulate might parse the given (color-stripped) string as a number (or a boolean)"""
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return s in ('True', 'False') or bool(re.fullmatch(r'\s*[+-]?[\d,]+(\.\d*)?\s*', s))
+
+
+def __column_type(values):
+    """
+    Returns the type (int, float or str) of the given column values, ignoring missing (None or empty) values, or
+    None if tabulate's own type detection is needed (e.g. when every present value is a numeric string). Booleans
+    are rendered (and aligned) as strings, unless they are mixed with numbers.
+    """
+    column_type = None
+    has_bool = False
+    needs_tabulate = False
+    for value in values:
+        if value is None or value == '':
+            continue
+        value_type = type(value)
+        if value_type is str:
+            if not __is_number(ANSI_ESCAPE_PATTERN.sub('', value) if '\x1b' in value else value):
+                return str
+            needs_tabulate = True
+        elif value_type is float:
+            column_type = float
+        elif value_type is int:
+            column_type = column_type or int
+        elif value_type is bool:
+            has_bool = True
+        else:
+            needs_tabulate = True
+    return None if needs_tabulate or has_bool and column_type else column_type or str
+
+
+def __after_point(s):
+    """Returns the number of characters after the decimal point (or exponent) of the formatted number s, or -1"""
+    position = s.rfind('.')
+    if position < 0:
+        position = s.rfind('e')
+    return len(s) - position - 1 if position >= 0 else -1
+
+
+def __render_column(values, header):
+    """
+    Returns the cells of the given column, padded to the column width, and the aligned header (if any). Strings are
+    left-aligned, while numbers are right-aligned on their decimal points, as tabulate does. Returns None if the
+    column can only be rendered by tabulate.
+    """
+    column_type = __column_type(values)
+    if column_type is None:
+        return None
+    if column_type is str:
+        cells = ['' if v is None else str(v).strip() for v in values]
+    elif column_type is float:
+        cells = ['' if v is None or v == '' else format(float(v), 'g') for v in values]
+        decimals = [__after_point(c) for c in cells]
+        max_decimals = max(decimals)
+        cells = [c + ' ' * (max_decimals - d) for c, d in zip(cells, decimals)]
+    else:
+        cells = ['' if v is None or v == '' else str(v) for v in values]
+    if header is not None:
+        cells.append(header)
+
+    text = ''.join(cells)
+    if '\x1b' in text:
+        visible_cells = [ANSI_ESCAPE_PATTERN.sub('', c) if '\x1b' in c else c for c in cells]
+        text = ''.join(visible_cells)
+        if '\x1b' in text:
+            return None
+    else:
+        visible_cells = cells
+    if len(text.encode()) != len(text):
+        # Leave the width of wide (e.g. East Asian) characters to tabulate
+        return None
+    widths = [len(c) for c in visible_cells]
+    width = max(widths)
+    if header is not None:
+        width = max(width, widths[-1] + HEADER_MIN_PADDING)
+    if column_type is str:
+        cells = [c + ' ' * (width - w) for c, w in zip(cells, widths)]
+    else:
+        cells = [' ' * (width - w) + c for c, w in zip(cells, widths)]
+    return (cells[:-1], cells[-1]) if header is not None else (cells, None)
+
+
+def render_table_lines(columns, headers=None):
+    """
+    Generates the lines of a table of the given columns (each a list of values, with None for a missing value)
+    and, optionally, headers, exactly as tabulate renders them in its plain format. The table is built column by
+    column, sizing each column with a single pass over its values, so that tables of thousands of rows render
+    quickly. Columns whose rendering depends on tabulate's number parsing (e.g. a column of numeric strings) or
+    on wide characters are handed off to tabulate.
+    """
+    rendered_columns = [__render_column(values, None if headers is None else header)
+                        for values, header in zip(columns, headers or [None] * len(columns))]
+    if any(c is None for c in rendered_columns):
+        from tabulate import tabulate
+        yield from tabulate(list(zip(*columns)), headers=headers or (), tablefmt='plain').split('\n')
+        return
+    if headers is not None:
+        yield COLUMN_SEPARATOR.join(header for _, header in rendered_columns).rstrip()
+    for cells in zip(*(cells for cells, _ in rendered_columns)):
+        yield COLUMN_SEPARATOR.join(cells).rstrip()
+
+
+def render_table(columns, headers=None):
+    """Returns the table of the given columns and (optional) headers, as rendered by render_table_lines"""
+    return '\n'.join(render_table_lines(columns, headers))
+
+
+# The columns of the token services table, mapped to the function computing each column from the sorted services
+TOKEN_SERVICE_COLUMNS = {
+    'Index': lambda services, _, __: [f'[{index + 1}]' for index in range(len(services))],
+    'Service Id': lambda services, _, __: [s['service-id'] for s in services],
+    'Cluster': lambda services, _, __: [s.get('cluster', None) for s in services],
+    'Run as user': lambda services, _, __: [s['effective-parameters']['run-as-user'] for s in services],
+    'Instances': lambda services, _, __: [retrieve_num_instances(s) for s in services],
+    'CPUs': lambda services, _, __: [s['effective-parameters']['cpus'] for s in services],
+    'Memory': lambda services, _, __: [format_mem_field(s['effective-parameters']) for s in services],
+    'Version': lambda services, _, __: [s['effective-parameters']['version'] for s in services],
+    'In-flight req.': lambda services, _, __: [s['request-metrics']['outstanding'] for s in services],
+    'Status': lambda services, _, __: [format_status(s['status']) for s in services],
+    'Last request': lambda services, _, __: [last_request_time or 'n/a' for last_request_time in
+                                             format_timestamp_strings([s.get('last-request-time', None)
+                                                                       for s in services])],
+    'Current?': lambda services, token_name, token_etag: [
+        format_using_current_token(s, token_etag or s.get('etag', None), token_name) for s in services]
+}
+
+
 def tabulate_token_services(services, token_name, token_etag=None, show_index=False, summary_table=True,
                             column_names=[]):
     """
@@ -50,36 +188,18 @@ def tabulate_token_services(services, token_name, token_etag=None, show_index=Fa
     num_services = len(services)
     if num_services > 0:
         services = sorted(services, key=lambda s: s.get('last-request-time', None) or '', reverse=True)
-        rows = [collections.OrderedDict([(key, data)
-                                         for key, data in
-                                         [('Index', f'[{index + 1}]'),
-                                          ('Service Id', s['service-id']),
-                                          ('Cluster', s.get('cluster', None)),
-                                          ('Run as user', s['effective-parameters']['run-as-user']),
-                                          ('Instances', retrieve_num_instances(s)),
-                                          ('CPUs', s['effective-parameters']['cpus']),
-                                          ('Memory', format_mem_field(s['effective-parameters'])),
-                                          ('Version', s['effective-parameters']['version']),
-                                          ('In-flight req.', s['request-metrics']['outstanding']),
-                                          ('Status', format_status(s['status'])),
-                                          ('Last request', format_last_request_time(s)),
-                                          ('Current?',
-                                           format_using_current_token(s, token_etag or s.get('etag', None),
-                                                                      token_name))]
-                                         if key in column_names or show_index and key == 'Index'])
-                for index, s in enumerate(services)]
-        service_table = tabulate(rows, headers='keys', tablefmt='plain')
+        headers = [name for name in TOKEN_SERVICE_COLUMNS
+                   if name in column_names or show_index and name == 'Index']
+        columns = [TOKEN_SERVICE_COLUMNS[name](services, token_name, token_etag) for name in headers]
+        service_table = render_table(columns, headers)
         if summary_table:
             num_failing_services = len([s for s in services if s['status'] == 'Failing'])
             num_instances = sum(retrieve_num_instances(s) for s in services)
             total_mem_usage = format_memory_amount(sum(s['resource-usage']['mem'] for s in services))
             total_cpu_usage = round(sum(s['resource-usage']['cpus'] for s in services), 2)
-            table = [['# Services', num_services],
-                     ['# Failing', num_failing_services],
-                     ['# Instances', num_instances],
-                     ['Total Memory', total_mem_usage],
-                     ['Total CPUs', total_cpu_usage]]
-            summary_table = tabulate(table, tablefmt='plain')
+            summary_table = render_table([['# Services', '# Failing', '# Instances', 'Total Memory', 'Total CPUs'],
+                                          [num_services, num_failing_services, num_instances, total_mem_usage,
+                                           total_cpu_usage]])
             return f'\n\n{summary_table}\n\n{service_table}', services
         else:
             return service_table, services
@@ -95,15 +215,13 @@ def tabulate_service_instances(instances, show_index=False, column_names=[]):
     :return: tabular output string
     """
     if len(instances) > 0:
-        rows = [collections.OrderedDict([(key, data)
-                                         for key, data in
-                                         [('Index', f'[{index + 1}]'),
-                                          ('Instance Id', inst['id']),
-                                          ('Host', inst['host']),
-                                          ('Status', format_instance_status(inst))]
-                                         if key in column_names or show_index and key == 'Index'])
-                for index, inst in enumerate(instances)]
-        return tabulate(rows, headers='keys', tablefmt='plain')
+        instance_columns = [('Index', lambda: [f'[{index + 1}]' for index in range(len(instances))]),
+                            ('Instance Id', lambda: [inst['id'] for inst in instances]),
+                            ('Host', lambda: [inst['host'] for inst in instances]),
+                            ('Status', lambda: [format_instance_status(inst) for inst in instances])]
+        headers = [name for name, _ in instance_columns if name in column_names or show_index and name == 'Index']
+        columns = [column_fn() for name, column_fn in instance_columns if name in headers]
+        return render_table(columns, headers)
     else:
         return ''
 
@@ -1,8 +1,28 @@
-import arrow
+import calendar
+import re
+from datetime import datetime, timedelta, timezone
+
 import humanfriendly
 
 from waiter import terminal
 
+# ISO-8601 dates and times, in the extended (2019-01-31T12:00:00.000Z) or basic (20190131T120000Z) format
+ISO_8601_PATTERN = re.compile(r'(\d{4})-?(\d{2})-?(\d{2})'
+                              r'(?:[T ](\d{2})(?::?(\d{2})(?::?(\d{2})(?:[.,](\d+))?)?)?)?'
+                              r'(Z|[+-]\d{2}(?::?\d{2})?)?')
+
+SECS_PER_MINUTE = 60
+SECS_PER_HOUR = 60 * 60
+SECS_PER_DAY = 24 * 60 * 60
+SECS_PER_WEEK = 7 * 24 * 60 * 60
+SECS_PER_MONTH = 30.5 * 24 * 60 * 60
+SECS_PER_YEAR = 365 * 24 * 60 * 60
+
+# Every timestamp is humanized relative to the same "now", captured on first use, and memoized. Neither is ever
+# reset, which is only correct because each CLI command runs in its own short-lived process
+__now = None
+__humanized_timestamps = {}
+
 
 def format_memory_amount(mebibytes):
     """Formats an amount, in MiB, to be human-readable"""
@@ -14,9 +34,106 @@ def format_mem_field(job):
     return format_memory_amount(job['mem'])
 
 
+def parse_timestamp(s):
+    """
+    Parses the given ISO-8601 timestamp (e.g. 2019-01-31T12:00:00.000Z, or just a date) into
+    an aware datetime; timestamps without a UTC offset are taken to be in UTC, as arrow does
+    """
+    match = ISO_8601_PATTERN.fullmatch(s.strip())
+    if not match:
+        raise ValueError(f'{s} is not a valid timestamp')
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    if offset is None or offset == 'Z':
+        tz = timezone.utc
+    else:
+        offset_minutes = int(offset[1:3]) * 60 + int(offset[-2:] if len(offset) > 3 else 0)
+        tz = timezone(timedelta(minutes=-offset_minutes if offset[0] == '-' else offset_minutes))
+    microsecond = round(int(fraction[:7].ljust(7, '0')) / 10) if fraction else 0
+    try:
+        timestamp = datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0),
+                             tzinfo=tz)
+    except ValueError as e:
+        raise ValueError(f'{s} is not a valid timestamp: {e}')
+    return timestamp + timedelta(microseconds=microsecond)
+
+
+def __add_months(dt, months):
+    """Returns dt shifted by the given number of months, clipping the day to the end of the resulting month"""
+    year, month = divmod(dt.month - 1 + months, 12)
+    year += dt.year
+    return dt.replace(year=year, month=month + 1, day=min(dt.day, calendar.monthrange(year, month + 1)[1]))
+
+
+def __calendar_months(earlier, later):
+    """Returns the number of calendar months between the given datetimes, counting over two weeks as a full month"""
+    months = (later.year - earlier.year) * 12 + later.month - earlier.month
+    shifted = __add_months(earlier, months)
+    while later < shifted:
+        months -= 1
+        shifted = __add_months(earlier, months)
+    if (later - shifted).days > 14:
+        months += 1
+    return min(months, 12)
+
+
+def humanize(dt, now):
+    """Describes the given datetime relative to now, e.g. "3 hours ago" or "in a minute", exactly as arrow does"""
+    delta = int(round((dt - now).total_seconds()))
+    sign = -1 if delta < 0 else 1
+    diff = abs(delta)
+    if diff < 10:
+        return 'just now'
+
+    if diff < SECS_PER_MINUTE:
+        amount = f'{diff} seconds'
+    elif diff < SECS_PER_MINUTE * 2:
+        amount = 'a minute'
+    elif diff < SECS_PER_HOUR:
+        amount = f'{max(diff // SECS_PER_MINUTE, 2)} minutes'
+    elif diff < SECS_PER_HOUR * 2:
+        amount = 'an hour'
+    elif diff < SECS_PER_DAY:
+        amount = f'{max(diff // SECS_PER_HOUR, 2)} hours'
+    elif diff < SECS_PER_DAY * 2:
+        amount = 'a day'
+    elif diff < SECS_PER_WEEK:
+        amount = f'{max(diff // SECS_PER_DAY, 2)} days'
+    else:
+        now = now.astimezone(dt.tzinfo)
+        months = __calendar_months(min(dt, now), max(dt, now))
+        if months >= 1 and diff < SECS_PER_YEAR:
+            amount = 'a month' if months == 1 else f'{months} months'
+        elif diff < SECS_PER_WEEK * 2:
+            amount = 'a week'
+        elif diff < SECS_PER_MONTH:
+            amount = f'{max(diff // SECS_PER_WEEK, 2)} weeks'
+        elif diff < SECS_PER_YEAR * 2:
+            amount = 'a year'
+        else:
+            amount = f'{max(diff // SECS_PER_YEAR, 2)} years'
+    return f'{amount} ago' if sign < 0 else f'in {amount}'
+
+
 def format_timestamp_string(s):
-    """Formats the given timestamp string in the "time ago" format"""
-    return arrow.get(s).humanize()
+    """
+    Formats the given timestamp string in the "time ago" format. Every timestamp is humanized
+    relative to the same "now" (captured on first use), and each distinct timestamp only once.
+    The results are never refreshed, so this is only suitable for a short-lived process (a single
+    CLI command); a long-running caller should use humanize with its own "now" instead.
+    """
+    global __now
+    humanized = __humanized_timestamps.get(s)
+    if humanized is None:
+        if __now is None:
+            __now = datetime.now(timezone.utc)
+        humanized = humanize(parse_timestamp(s), __now)
+        __humanized_timestamps[s] = humanized
+    return humanized
+
+
+def format_timestamp_strings(strings):
+    """Formats the given timestamp strings in the "time ago" format; missing timestamps are formatted as None"""
+    return [format_timestamp_string(s) if s else None for s in strings]
 
 
 def format_field_name(s):
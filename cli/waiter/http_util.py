@@ -1,32 +1,111 @@
+import asyncio
+import codecs
 import importlib
+import inspect
 import json
 import logging
+import socket
+import time
 import uuid
+from concurrent import futures
+from functools import partial
 from urllib.parse import urljoin
 
 import requests
 
 import waiter
+from waiter import metrics, profiling
 from waiter.util import print_error
 
 
 session = None
 timeouts = None
 adapter_factory = None
+adapter = None
+executor = None
 
 
 def set_retries(retries):
-    """Sets the number of retries to use"""
-    adapter = adapter_factory(max_retries=retries)
+    """
+    Sets the number of retries to use, keeping the warm connections of the mounted adapter. The adapter is shared
+    by all requests, so this must be called before (not while) requests are made concurrently.
+    """
+    adapter.max_retries = requests.adapters.Retry.from_int(retries)
+
+
+def keep_alive_socket_options(idle_secs):
+    """Returns the socket options enabling TCP keep-alive probes after the given number of idle seconds"""
+    options = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+               (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle_secs))
+    elif hasattr(socket, 'TCP_KEEPALIVE'):
+        # macOS names the idle time option TCP_KEEPALIVE
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle_secs))
+    return options
+
+
+def __accepts_pool_options(factory):
+    """Returns true if the given adapter factory accepts the pool options (plugin factories may only accept retries)"""
+    try:
+        parameters = inspect.signature(factory).parameters.values()
+    except (TypeError, ValueError):
+        return True
+    names = {p.name for p in parameters}
+    return any(p.kind == p.VAR_KEYWORD for p in parameters) or \
+        {'pool_connections', 'pool_maxsize', 'pool_block'} <= names
+
+
+def mount_adapter(http_config):
+    """Creates the (pooling) adapter used for all requests and mounts it on the session"""
+    global adapter
+    pool_connections = http_config.get('pool-connections')
+    pool_maxsize = http_config.get('pool-maxsize')
+    pool_block = http_config.get('pool-block')
+    if __accepts_pool_options(adapter_factory):
+        logging.debug('using http connection pools: connections = %s, maxsize = %s, block = %s',
+                      pool_connections, pool_maxsize, pool_block)
+        adapter = adapter_factory(max_retries=http_config.get('retries'),
+                                  pool_connections=pool_connections,
+                                  pool_maxsize=pool_maxsize,
+                                  pool_block=pool_block)
+    else:
+        logging.debug('http adapter factory does not accept the pool options, so the configured pools are not used')
+        adapter = adapter_factory(max_retries=http_config.get('retries'))
+    keep_alive_idle_secs = http_config.get('keep-alive-idle-secs')
+    if keep_alive_idle_secs and hasattr(adapter, 'init_poolmanager'):
+        logging.debug('using tcp keep-alive after %s idle seconds', keep_alive_idle_secs)
+        socket_options = keep_alive_socket_options(keep_alive_idle_secs)
+        adapter.init_poolmanager(pool_connections, pool_maxsize, block=pool_block, socket_options=socket_options)
     session.mount('http://', adapter)
     session.mount('https://', adapter)
 
 
+def log_pool_statistics():
+    """
+    Logs, per host, how many requests reused a pooled connection and how many had to open a new one. The counts are
+    urllib3 internals rather than public API, so pools (or adapters) without them are skipped rather than failing.
+    """
+    pools = getattr(getattr(adapter, 'poolmanager', None), 'pools', None)
+    if pools is None or not hasattr(pools, 'keys'):
+        return
+    for key in list(pools.keys()):
+        pool = pools.get(key)
+        num_requests = getattr(pool, 'num_requests', None)
+        num_connections = getattr(pool, 'num_connections', None)
+        if num_requests is None or num_connections is None:
+            continue
+        logging.info(f'connection pool {getattr(pool, "scheme", None)}://{getattr(pool, "host", None)}:'
+                     f'{getattr(pool, "port", None)}: {num_requests} requests, '
+                     f'{max(num_requests - num_connections, 0)} hits, {num_connections} misses')
+
+
 def configure(config, plugins):
     """Configures HTTP timeouts and retries to be used"""
     global session
     global timeouts
     global adapter_factory
+    global executor
     adapter_factory = plugins.get('http-adapter-factory', requests.adapters.HTTPAdapter)
     session_factory = plugins.get('http-session-factory', requests.Session)
     logging.getLogger('urllib3').setLevel(logging.DEBUG) # logging.disable in cli.py may override
@@ -35,9 +114,11 @@ def configure(config, plugins):
     read_timeout = http_config.get('read-timeout')
     timeouts = (connect_timeout, read_timeout)
     logging.debug('using http timeouts: %s', timeouts)
-    retries = http_config.get('retries')
+    max_concurrency = http_config.get('max-concurrency')
+    logging.debug('using http max concurrency: %s', max_concurrency)
+    executor = futures.ThreadPoolExecutor(max_workers=max_concurrency)
     session = session_factory()
-    set_retries(retries)
+    mount_adapter(http_config)
     session.headers['User-Agent'] = f"waiter/{waiter.version.VERSION} ({session.headers['User-Agent']})"
     auth_config = http_config.get('auth', None)
     if auth_config:
@@ -80,6 +161,61 @@ def __make_url(cluster, endpoint):
     return urljoin(cluster['url'], endpoint)
 
 
+def __metric_prefix(cluster, method, endpoint):
+    """
+    Returns the metric name prefix for requests to the given cluster and endpoint, e.g. http.c1.get.tokens;
+    endpoints with a path parameter (like /apps/<service-id>) share one name (apps-id) across all values
+    """
+    segments = [s for s in endpoint.split('/') if s]
+    endpoint_name = segments[0] if segments else 'root'
+    if len(segments) > 1:
+        endpoint_name = f'{endpoint_name}-id'
+    return f'http.{metrics.safe_name(cluster["name"])}.{method}.{metrics.safe_name(endpoint_name)}'
+
+
+def __record_response_metrics(prefix, start, connect_secs, resp, size):
+    """Records the latency (since start), size and number of retries of the given response"""
+    metrics.timing(f'{prefix}.latency', (time.perf_counter() - start) * 1000)
+    metrics.histogram(f'{prefix}.response-bytes', size)
+    retries = getattr(resp.raw, 'retries', None)
+    metrics.histogram(f'{prefix}.retries', len(retries.history) if retries else 0)
+    profiling.record_request(resp.request.method, resp.url, start, connect_secs, resp=resp, size=size)
+
+
+def __record_streamed_response_metrics(resp):
+    """Records the metrics of the given streamed response (if it was instrumented), once its body has been read"""
+    if hasattr(resp, 'waiter_metrics'):
+        prefix, start, connect_secs = resp.waiter_metrics
+        del resp.waiter_metrics
+        __record_response_metrics(prefix, start, connect_secs, resp, resp.raw.tell())
+
+
+def __instrumented(cluster, method, url, endpoint, send_fn, stream=False):
+    """
+    Sends a request using send_fn, recording its latency, response size and retries as metrics (and, when
+    profiling, its timings). The metrics of streamed responses are recorded once the body has been consumed
+    (see __stream_response_elements).
+    """
+    if not metrics.enabled() and not profiling.enabled():
+        return send_fn()
+    prefix = __metric_prefix(cluster, method, endpoint)
+    profiling.take_connect_secs()
+    start = time.perf_counter()
+    try:
+        resp = send_fn()
+    except Exception as e:
+        metrics.timing(f'{prefix}.latency', (time.perf_counter() - start) * 1000)
+        metrics.inc(f'{prefix}.errors')
+        profiling.record_request(method.upper(), url, start, profiling.take_connect_secs(), error=e)
+        raise
+    connect_secs = profiling.take_connect_secs()
+    if stream:
+        resp.waiter_metrics = (prefix, start, connect_secs)
+    else:
+        __record_response_metrics(prefix, start, connect_secs, resp, len(resp.content))
+    return resp
+
+
 def default_http_headers():
     """Returns the default HTTP headers, including a random CID in x-cid"""
     return {
@@ -94,21 +230,32 @@ def post(cluster, endpoint, json_body, params=None, headers=None):
         headers = {}
     url = __make_url(cluster, endpoint)
     default_headers = default_http_headers()
-    resp = __post(url, json_body, params=params, headers={**default_headers, **headers})
+    resp = __instrumented(cluster, 'post', url, endpoint,
+                          lambda: __post(url, json_body, params=params, headers={**default_headers, **headers}))
     resp.headers.pop('Set-Cookie', None)
     logging.info(f'POST response: {resp.text} (headers: {resp.headers})')
     return resp
 
 
-def get(cluster, endpoint, params=None, headers=None, read_timeout=None):
-    """GETs data corresponding to the given params from cluster at /endpoint"""
+def get(cluster, endpoint, params=None, headers=None, read_timeout=None, stream=False):
+    """
+    GETs data corresponding to the given params from cluster at /endpoint.
+    If stream is true, the response body is left unread so that it can be
+    consumed incrementally (e.g. via stream_json_array).
+    """
     if headers is None:
         headers = {}
     url = __make_url(cluster, endpoint)
     default_headers = default_http_headers()
-    resp = __get(url, params, headers={**default_headers, **headers}, read_timeout=read_timeout)
+    resp = __instrumented(cluster, 'get', url, endpoint,
+                          lambda: __get(url, params, headers={**default_headers, **headers},
+                                        read_timeout=read_timeout, stream=stream),
+                          stream=stream)
     resp.headers.pop('Set-Cookie', None)
-    logging.info(f'GET response: {resp.text} (headers: {resp.headers})')
+    if stream:
+        logging.info(f'GET response: <streamed> (headers: {resp.headers})')
+    else:
+        logging.info(f'GET response: {resp.text} (headers: {resp.headers})')
     return resp
 
 
@@ -118,20 +265,59 @@ def delete(cluster, endpoint, params=None, headers=None, read_timeout=None):
         headers = {}
     url = __make_url(cluster, endpoint)
     default_headers = default_http_headers()
-    resp = __delete(url, params, headers={**default_headers, **headers}, read_timeout=read_timeout)
+    resp = __instrumented(cluster, 'delete', url, endpoint,
+                          lambda: __delete(url, params, headers={**default_headers, **headers},
+                                           read_timeout=read_timeout))
     logging.info(f'DELETE response: {resp.text}')
     return resp
 
 
-def make_data_request(cluster, make_request_fn):
+def run_coroutine(coroutine):
+    """Runs the given coroutine to completion on a fresh event loop and returns its result"""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+async def call_async(fn, *args, **kwargs):
+    """
+    Runs the given blocking function on the shared HTTP executor, allowing
+    the calling coroutine to have many requests in flight at the same time
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(fn, *args, **kwargs))
+
+
+async def post_async(cluster, endpoint, json_body, params=None, headers=None):
+    """Asynchronous counterpart of post"""
+    return await call_async(post, cluster, endpoint, json_body, params=params, headers=headers)
+
+
+async def get_async(cluster, endpoint, params=None, headers=None, read_timeout=None):
+    """Asynchronous counterpart of get"""
+    return await call_async(get, cluster, endpoint, params=params, headers=headers, read_timeout=read_timeout)
+
+
+async def delete_async(cluster, endpoint, params=None, headers=None, read_timeout=None):
+    """Asynchronous counterpart of delete"""
+    return await call_async(delete, cluster, endpoint, params=params, headers=headers, read_timeout=read_timeout)
+
+
+def make_data_request(cluster, make_request_fn, not_modified_data=None):
     """
     Makes a request (using make_request_fn), parsing the
-    assumed-to-be-JSON response and handling common errors
+    assumed-to-be-JSON response and handling common errors.
+    If not_modified_data is provided, it is returned when
+    the server responds with 304 (Not Modified).
     """
     try:
         resp = make_request_fn()
         if resp.status_code == 200:
             return resp.json(), resp.headers
+        elif resp.status_code == 304 and not_modified_data is not None:
+            return not_modified_data, resp.headers
         elif resp.status_code == 401:
             print_error(f'Authentication failed on {cluster["name"]} ({cluster["url"]}).')
             return [], {}
@@ -151,3 +337,137 @@ def make_data_request(cluster, make_request_fn):
     except json.decoder.JSONDecodeError as jde:
         logging.exception(jde)
     return None, {}
+
+
+def stream_json_array(resp, chunk_size=64 * 1024):
+    """
+    Generates the elements of the JSON array in the body of the given (streamed) response, one at a time,
+    decoding each element as soon as it has been read. Only the element being decoded (and at most one
+    chunk beyond it) is held in memory, rather than the whole body.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(resp.encoding or 'utf-8')()
+    chunks = resp.iter_content(chunk_size=chunk_size)
+    buffer = ''
+    position = 0
+    exhausted = False
+    started = False
+
+    while True:
+        while position < len(buffer) and (buffer[position].isspace() or (started and buffer[position] == ',')):
+            position += 1
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != '[':
+                    raise json.JSONDecodeError('Expecting JSON array', buffer, position)
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+                # A value that is not yet followed by a delimiter (e.g. a number) may continue in the next chunk
+                if exhausted or (end < len(buffer) and (buffer[end].isspace() or buffer[end] in ',]')):
+                    yield element
+                    position = end
+                    continue
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise
+        elif exhausted:
+            raise json.JSONDecodeError('Unterminated JSON array', buffer, position)
+
+        chunk = next(chunks, None)
+        buffer = buffer[position:]
+        position = 0
+        if chunk is None:
+            buffer += text_decoder.decode(b'', final=True)
+            exhausted = True
+        else:
+            buffer += text_decoder.decode(chunk)
+
+
+def stream_data_request(cluster, make_request_fn):
+    """
+    Streaming counterpart of make_data_request for endpoints that respond with a JSON array. Returns a
+    generator of the array's elements (parsed incrementally from the response), or None if the request
+    failed. Errors encountered part-way through the response are reported and then raised from the generator
+    as an IncompleteResponseError, so that a truncated array is never mistaken for a complete one.
+    """
+    try:
+        resp = make_request_fn()
+        if resp.status_code == 200:
+            return __stream_response_elements(cluster, resp)
+        # Read the (error) body of the unsuccessful response before recording its size
+        resp.content
+        __record_streamed_response_metrics(resp)
+        if resp.status_code == 401:
+            print_error(f'Authentication failed on {cluster["name"]} ({cluster["url"]}).')
+            return iter([])
+        elif resp.status_code == 500:
+            print_error(f'Encountered server error while querying {cluster["name"]}.')
+            # fall through to logging call below
+
+        logging.warning(f'Unexpected response code {resp.status_code} for data request. Response body: {resp.text}')
+    except requests.exceptions.ConnectionError as ce:
+        logging.exception(ce)
+        print_error(f'Encountered connection error with {cluster["name"]} ({cluster["url"]}).')
+    except requests.exceptions.ReadTimeout as rt:
+        logging.exception(rt)
+        print_error(f'Encountered read timeout with {cluster["name"]} ({cluster["url"]}).')
+    except IOError as ioe:
+        logging.exception(ioe)
+    return None
+
+
+class IncompleteResponseError(Exception):
+    """Raised when a streamed response fails part-way through (after the failure has been reported)"""
+    pass
+
+
+def __stream_response_elements(cluster, resp):
+    """
+    Generates the elements of the JSON array in the given response, closing it at the end. Errors are reported and
+    raised as an IncompleteResponseError.
+    """
+    try:
+        yield from stream_json_array(resp)
+    except requests.exceptions.ConnectionError as ce:
+        logging.exception(ce)
+        print_error(f'Encountered connection error with {cluster["name"]} ({cluster["url"]}).')
+        raise IncompleteResponseError(f'connection error with {cluster["name"]}') from ce
+    except requests.exceptions.ReadTimeout as rt:
+        logging.exception(rt)
+        print_error(f'Encountered read timeout with {cluster["name"]} ({cluster["url"]}).')
+        raise IncompleteResponseError(f'read timeout with {cluster["name"]}') from rt
+    except IOError as ioe:
+        logging.exception(ioe)
+        print_error(f'Encountered incomplete response from {cluster["name"]} ({cluster["url"]}).')
+        raise IncompleteResponseError(f'error reading the response of {cluster["name"]}') from ioe
+    except json.decoder.JSONDecodeError as jde:
+        logging.exception(jde)
+        print_error(f'Encountered incomplete response from {cluster["name"]} ({cluster["url"]}).')
+        raise IncompleteResponseError(f'incomplete response from {cluster["name"]}') from jde
+    finally:
+        resp.close()
+        __record_streamed_response_metrics(resp)
+
+
+def read_streamed_elements(elements):
+    """
+    Returns the list of the elements generated by stream_data_request, or None if the request failed (elements is
+    None) or the response failed part-way through, in which case the elements read so far are discarded
+    """
+    if elements is None:
+        return None
+    try:
+        return list(elements)
+    except IncompleteResponseError as e:
+        logging.info(f'discarding the elements of the incomplete response: {e}')
+        return None
+
+
+async def make_data_request_async(cluster, make_request_fn):
+    """Asynchronous counterpart of make_data_request, parsing the response off of the event loop"""
+    return await call_async(make_data_request, cluster, make_request_fn)
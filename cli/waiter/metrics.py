@@ -1,20 +1,86 @@
+import collections
 import logging
+import re
 import socket
+import threading
 
 from waiter.util import current_user
 
+# Transports, mapped to their socket family and type
+TRANSPORTS = {'tcp': (socket.AF_INET, socket.SOCK_STREAM),
+              'udp': (socket.AF_INET, socket.SOCK_DGRAM),
+              'unix': (getattr(socket, 'AF_UNIX', None), socket.SOCK_STREAM),
+              'unixgram': (getattr(socket, 'AF_UNIX', None), socket.SOCK_DGRAM)}
+
+# The maximum size of a datagram carrying several metric lines (to avoid IP fragmentation)
+MAX_DATAGRAM_BYTES = 1432
+
 __line_formats = None
 __conn = None
 __host = socket.gethostname()
 __user = current_user()
 __disabled = True
+__config = None
+__lock = threading.Lock()
+# Buffered metrics, keyed by (type, name); counts are aggregated while timers and histograms keep every value
+__counters = collections.OrderedDict()
+__connected = threading.Event()
+__connect_thread = None
+__flush_thread = None
+__closing = threading.Event()
+
+
+def __connect():
+    """
+    Connects to the configured metrics address, retrying up to max-retries times; this runs on a
+    background thread so that (even slow) connects do not delay the command itself
+    """
+    global __conn
+    transport = __config.get('transport')
+    family, socket_type = TRANSPORTS[transport]
+    address = __config.get('path') if family != socket.AF_INET else (__config.get('host'), __config.get('port'))
+    for attempt in range(__config.get('max-retries') + 1):
+        conn = socket.socket(family, socket_type)
+        try:
+            conn.settimeout(__config.get('timeout'))
+            logging.info(f'connecting to {address} over {transport} for metrics (attempt = {attempt})...')
+            conn.connect(address)
+            logging.info(f'...connected')
+            with __lock:
+                __conn = conn
+                __connected.set()
+            return
+        except OSError:
+            logging.exception(f'unable to connect to {address} for metrics')
+            conn.close()
+    logging.error(f'unable to connect to {address} for metrics, giving up')
+
+
+def __start_connect():
+    """Starts connecting in the background, unless a connect is already in progress"""
+    global __connect_thread
+    if __connect_thread is None or not __connect_thread.is_alive():
+        __connected.clear()
+        __connect_thread = threading.Thread(target=__connect, name='metrics-connect', daemon=True)
+        __connect_thread.start()
+
+
+def __flush_periodically(interval_secs):
+    """Flushes the buffered metrics every interval_secs until metrics are closed"""
+    while not __closing.wait(interval_secs):
+        try:
+            flush()
+        except Exception:
+            # Keep flushing, since an exception would otherwise end the thread (and the periodic flushes)
+            logging.exception('exception when flushing metrics')
 
 
 def initialize(config):
     """
     Initializes the metrics module using the given
     config; note that metrics can be completely
-    disabled in which case this is essentially a no-op
+    disabled in which case this is essentially a no-op.
+    The connection is made on a background thread.
     """
     global __disabled
     try:
@@ -23,62 +89,153 @@ def initialize(config):
         if __disabled:
             return
 
-        global __conn
+        global __config
         global __line_formats
+        global __flush_thread
+        __config = metrics_config
         __line_formats = metrics_config.get('line-formats')
-        __conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        __conn.settimeout(metrics_config.get('timeout'))
-        address = (metrics_config.get('host'), metrics_config.get('port'))
-        for attempt in range(metrics_config.get('max-retries') + 1):
-            try:
-                logging.info(f'connecting to {address} for metrics (attempt = {attempt})...')
-                __conn.connect(address)
-                logging.info(f'...connected')
-                break
-            except TimeoutError:
-                logging.exception(f'timeout attempting to connect to {address}')
-        else:
-            __disabled = True
-            logging.error(f'unable to connect to {address} for metrics, giving up')
+        transport = metrics_config.get('transport')
+        if TRANSPORTS.get(transport, (None, None))[0] is None:
+            raise Exception(f'Unsupported metrics transport "{transport}".')
+        __closing.clear()
+        __start_connect()
+        flush_interval_secs = metrics_config.get('flush-interval-secs')
+        if flush_interval_secs:
+            __flush_thread = threading.Thread(target=__flush_periodically, args=(flush_interval_secs,),
+                                              name='metrics-flush', daemon=True)
+            __flush_thread.start()
     except:
         __disabled = True
         logging.exception('exception when initializing metrics')
 
 
 def close():
-    """Closes the metrics module (unless disabled)"""
+    """Flushes the buffered metrics and closes the metrics module (unless disabled)"""
     global __disabled
+    global __conn
     if __disabled:
         return
+    __closing.set()
+    if __flush_thread:
+        __flush_thread.join()
+    flush(wait_for_connection=True)
+    with __lock:
+        conn = __conn
+        __conn = None
     try:
-        __conn.close()
+        if conn:
+            conn.close()
     except:
-        __disabled = True
         logging.exception('exception when closing metrics socket')
+    __disabled = True
 
 
-def __send(metric):
-    """Sends the given metric using the configured line format"""
-    global __disabled
+def __send(conn, lines):
+    """Sends the given metric lines on conn, batching as many as possible into each write (or datagram)"""
+    if conn.type == socket.SOCK_DGRAM:
+        batch = b''
+        for line in lines:
+            data = f'{line}\n'.encode()
+            if batch and len(batch) + len(data) > MAX_DATAGRAM_BYTES:
+                conn.send(batch)
+                batch = b''
+            batch += data
+        if batch:
+            conn.send(batch)
+    else:
+        conn.sendall(''.join(f'{line}\n' for line in lines).encode())
+
+
+def flush(wait_for_connection=False):
+    """
+    Sends the buffered metrics, using the configured line formats (metric types without a line format are
+    dropped). If the connection is not (yet) established, the metrics stay buffered, unless wait_for_connection
+    is true, in which case an in-progress connect is given (at most) one more connect timeout to finish. On
+    errors, the buffered metrics are dropped and a reconnect is started.
+    """
+    global __conn
+    if __disabled:
+        return
+    if wait_for_connection and __connect_thread:
+        __connect_thread.join(__config.get('timeout'))
+
+    with __lock:
+        # The connection is read under the lock, since a failed send (on another thread) replaces it
+        conn = __conn
+        if conn is None or not __connected.is_set():
+            logging.info('not connected for metrics, keeping metrics buffered')
+            return
+        metrics = [{'namespace': 'waitercli',
+                    'name': name,
+                    'value': value,
+                    'host': __host,
+                    'user': __user,
+                    'type': metric_type}
+                   for (metric_type, name), values in __counters.items()
+                   if metric_type in __line_formats
+                   for value in (values if isinstance(values, list) else [values])]
+        __counters.clear()
+    if not metrics:
+        return
+
+    lines = []
+    for metric in metrics:
+        try:
+            lines.append(__line_formats[metric['type']].format(**metric))
+        except:
+            logging.exception(f'exception when formatting metric {metric}')
+
     try:
-        line_format = __line_formats[metric['type']]
-        metric_line = line_format.format(**metric)
-        logging.info('sending metric %s' % metric_line)
-        __conn.send(('%s\n' % metric_line).encode())
-        logging.info('metric send completed')
-    except:
-        __disabled = True
-        logging.exception('exception when sending metric %s' % metric)
+        logging.info(f'sending metrics {lines}')
+        __send(conn, lines)
+        logging.info('metrics send completed')
+    except OSError:
+        logging.exception(f'exception when sending metrics {lines}')
+        try:
+            conn.close()
+        except OSError:
+            pass
+        with __lock:
+            if __conn is conn:
+                __conn = None
+                __connected.clear()
+        if not __closing.is_set():
+            __start_connect()
 
 
 def inc(metric_name, count=1):
-    """Increments a counter with the given metric_name by count"""
+    """Increments a counter with the given metric_name by count; the total is sent on the next flush"""
     if __disabled:
         return
-    metric = {'namespace': 'waitercli',
-              'name': metric_name,
-              'value': count,
-              'host': __host,
-              'user': __user,
-              'type': 'count'}
-    __send(metric)
+    key = ('count', metric_name)
+    with __lock:
+        __counters[key] = __counters.get(key, 0) + count
+
+
+def __record(metric_type, metric_name, value):
+    """Buffers a single value of the given timer or histogram; every value is sent on the next flush"""
+    if __disabled:
+        return
+    key = (metric_type, metric_name)
+    with __lock:
+        __counters.setdefault(key, []).append(value)
+
+
+def timing(metric_name, millis):
+    """Records a duration, in milliseconds, for the timer with the given metric_name"""
+    __record('timer', metric_name, round(millis, 3))
+
+
+def histogram(metric_name, value):
+    """Records a value (e.g. a size or a count) for the histogram with the given metric_name"""
+    __record('histogram', metric_name, value)
+
+
+def safe_name(name):
+    """Returns the given name (e.g. a cluster name) with the characters that are not safe in a metric name replaced"""
+    return re.sub(r'[^A-Za-z0-9_-]', '_', name)
+
+
+def enabled():
+    """Returns true if metrics are being recorded, to allow callers to skip work that only feeds metrics"""
+    return not __disabled
@@ -0,0 +1,168 @@
+import collections
+import contextlib
+import functools
+import sys
+import threading
+import time
+
+# The maximum number of (slowest) HTTP requests listed in the report
+MAX_REPORTED_REQUESTS = 50
+
+__enabled = False
+__start = None
+__profiler = None
+__stats_path = None
+__lock = threading.Lock()
+__phases = collections.OrderedDict()
+__requests = []
+__local = threading.local()
+
+
+def enabled():
+    """Returns true if the current command is being profiled"""
+    return __enabled
+
+
+def start(started_at, stats_path=None):
+    """
+    Starts profiling the current command, which started at the given time.perf_counter() time. If stats_path
+    is given, the main thread is also profiled with cProfile and its stats are dumped to stats_path by report.
+    """
+    global __enabled
+    global __start
+    global __profiler
+    global __stats_path
+    __enabled = True
+    __start = started_at
+    __time_connections()
+    if stats_path:
+        import cProfile
+        __stats_path = stats_path
+        __profiler = cProfile.Profile()
+        __profiler.enable()
+
+
+def record_phase(name, duration_secs):
+    """Records a phase of the command that took duration_secs"""
+    if not __enabled:
+        return
+    key = (getattr(__local, 'depth', 0), name)
+    with __lock:
+        count, total = __phases.get(key, (0, 0))
+        __phases[key] = (count + 1, total + duration_secs)
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Context manager recording the time spent in its body as the given phase (nested in any enclosing phases)"""
+    if not __enabled:
+        yield
+        return
+    started_at = time.perf_counter()
+    depth = getattr(__local, 'depth', 0)
+    with __lock:
+        # Reserve the phase's place in the report ahead of the phases nested in it, which are recorded first
+        __phases.setdefault((depth, name), (0, 0))
+    __local.depth = depth + 1
+    try:
+        yield
+    finally:
+        __local.depth -= 1
+        record_phase(name, time.perf_counter() - started_at)
+
+
+def __timed_connect(connect_fn):
+    """Wraps the given connection method to accumulate the time spent connecting on the current thread"""
+
+    @functools.wraps(connect_fn)
+    def connect(self, *args, **kwargs):
+        if getattr(__local, 'connecting', False):
+            return connect_fn(self, *args, **kwargs)
+        __local.connecting = True
+        started_at = time.perf_counter()
+        try:
+            return connect_fn(self, *args, **kwargs)
+        finally:
+            __local.connecting = False
+            __local.connect_secs = getattr(__local, 'connect_secs', 0) + time.perf_counter() - started_at
+
+    return connect
+
+
+def __time_connections():
+    """Instruments urllib3 so that the time spent opening connections (DNS, TCP and TLS) is attributed to requests"""
+    from urllib3 import connection
+    for connection_class in [connection.HTTPConnection, connection.HTTPSConnection]:
+        if 'connect' in vars(connection_class):
+            connection_class.connect = __timed_connect(vars(connection_class)['connect'])
+
+
+def take_connect_secs():
+    """Returns (and resets) the time spent opening new connections on the current thread since the last call"""
+    connect_secs = getattr(__local, 'connect_secs', 0)
+    __local.connect_secs = 0
+    return connect_secs
+
+
+def record_request(method, url, started_at, connect_secs, resp=None, size=None, error=None):
+    """
+    Records an HTTP request sent at started_at, which either got the given response (of size bytes, read by now)
+    or failed with the given error. The time until the response headers arrived is split into the time spent
+    opening a new connection (if any) and the time spent waiting on the server.
+    """
+    if not __enabled:
+        return
+    total_secs = time.perf_counter() - started_at
+    request = {'method': method, 'url': url, 'start': started_at - __start, 'total': total_secs,
+               'connect': connect_secs, 'error': error}
+    if resp is not None:
+        headers_secs = resp.elapsed.total_seconds()
+        request.update({'url': resp.url, 'status': resp.status_code, 'size': size,
+                        'server': max(headers_secs - connect_secs, 0), 'read': max(total_secs - headers_secs, 0)})
+    with __lock:
+        __requests.append(request)
+
+
+def __millis(secs):
+    """Formats the given number of seconds as right-aligned milliseconds"""
+    return f'{secs * 1000:8.0f} ms'
+
+
+def __format_request(request):
+    """Formats one line of the HTTP requests section of the report"""
+    line = f'{__millis(request["total"])}  {request["method"]} {request["url"]}'
+    if request['error'] is not None:
+        return f'{line} failed: {request["error"]} (connect {request["connect"] * 1000:.0f} ms)'
+    return f'{line} -> {request["status"]}, {request["size"]} bytes ' \
+           f'(connect {request["connect"] * 1000:.0f} ms, server {request["server"] * 1000:.0f} ms, ' \
+           f'read {request["read"] * 1000:.0f} ms)'
+
+
+def report(title, out=None):
+    """
+    Prints the recorded phases and HTTP requests to out (standard error by default), and writes the cProfile stats
+    (if any) to the stats path given to start
+    """
+    global __enabled
+    if not __enabled:
+        return
+    __enabled = False
+    out = out or sys.stderr
+    print(f'Profile of {title} ({(time.perf_counter() - __start) * 1000:.0f} ms in total):', file=out)
+    for (depth, name), (count, total) in __phases.items():
+        count_text = f' (x{count})' if count > 1 else ''
+        print(f'{__millis(total)}  {"  " * depth}{name}{count_text}', file=out)
+
+    requests = sorted(__requests, key=lambda r: r['start'])
+    print(f'HTTP requests ({len(requests)}):', file=out)
+    if len(requests) > MAX_REPORTED_REQUESTS:
+        slowest = set(id(r) for r in sorted(requests, key=lambda r: r['total'], reverse=True)[:MAX_REPORTED_REQUESTS])
+        print(f'  (only the {MAX_REPORTED_REQUESTS} slowest are listed)', file=out)
+        requests = [r for r in requests if id(r) in slowest]
+    for request in requests:
+        print(__format_request(request), file=out)
+
+    if __profiler:
+        __profiler.disable()
+        __profiler.dump_stats(__stats_path)
+        print(f'Wrote cProfile stats to {__stats_path} (view them with python -m pstats {__stats_path})', file=out)
@@ -1,35 +1,73 @@
+import asyncio
 import concurrent
 import logging
 import os
+import time
 from concurrent import futures
 
-from waiter import http_util, terminal
+from waiter import cache, http_util, metrics, terminal
+from waiter.token_diff import user_fields
 
 
-def query_across_clusters(clusters, query_fn):
-    """Attempts to query entities from the given clusters."""
+def __combine_cluster_entities(cluster_entities_pairs):
+    """Combines the per-cluster query results into a single result, skipping clusters with no entities"""
     count = 0
     all_entities = {'clusters': {}}
+    for cluster, entities in cluster_entities_pairs:
+        cluster_count = entities['count']
+        if cluster_count > 0:
+            all_entities['clusters'][cluster['name']] = entities
+            count += cluster_count
+    all_entities['count'] = count
+    return all_entities
+
+
+def __record_query_latency(cluster, start):
+    """Records the time since start taken to query the given cluster (or all clusters, if cluster is None)"""
+    name = 'query.latency' if cluster is None else f'query.{metrics.safe_name(cluster["name"])}.latency'
+    metrics.timing(name, (time.perf_counter() - start) * 1000)
+
+
+def query_across_clusters(clusters, query_fn):
+    """Attempts to query entities from the given clusters."""
     max_workers = os.cpu_count()
     logging.debug('querying with max workers = %s' % max_workers)
+    start = time.perf_counter()
     with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
         future_to_cluster = {query_fn(c, executor): c for c in clusters}
         for future, cluster in future_to_cluster.items():
-            entities = future.result()
-            cluster_count = entities['count']
-            if cluster_count > 0:
-                all_entities['clusters'][cluster['name']] = entities
-                count += cluster_count
-    all_entities['count'] = count
+            future.add_done_callback(lambda _, c=cluster: __record_query_latency(c, start))
+        all_entities = __combine_cluster_entities((c, f.result()) for f, c in future_to_cluster.items())
+    __record_query_latency(None, start)
     return all_entities
 
 
+async def __timed_query_async(cluster, query, start):
+    """Awaits the given query of cluster, recording how long it took"""
+    try:
+        return await query
+    finally:
+        __record_query_latency(cluster, start)
+
+
+async def query_across_clusters_async(clusters, query_fn):
+    """
+    Attempts to query entities from the given clusters, where query_fn returns
+    an awaitable for each cluster; the queries for all clusters are in flight at once.
+    """
+    logging.debug('querying %s clusters asynchronously' % len(clusters))
+    start = time.perf_counter()
+    cluster_entities = await asyncio.gather(*[__timed_query_async(c, query_fn(c), start) for c in clusters])
+    __record_query_latency(None, start)
+    return __combine_cluster_entities(zip(clusters, cluster_entities))
+
+
 def get_token(cluster, token_name, include=None):
     """Gets the token with the given name from the given cluster"""
     params = {'token': token_name}
     if include:
         params['include'] = include
-    token_data, headers = http_util.make_data_request(cluster, lambda: http_util.get(cluster, 'token', params=params))
+    token_data, headers = cache.get_data(cluster, 'token', params=params)
     etag = headers.get('ETag', None)
     return token_data, etag
 
@@ -59,29 +97,63 @@ def print_no_instances(service):
     print(f'Check the --include flags for active, failed, and killed instances.')
 
 
-def get_token_on_cluster(cluster, token_name, include_services=False):
-    """Gets the token with the given name on the given cluster"""
-    token_data, token_etag = get_token(cluster, token_name, include='metadata')
+def __token_on_cluster_result(cluster, token_data, token_etag, services=None):
+    """Builds the per-cluster token query result from the token (and optionally services) data"""
     if token_data:
         data = {'count': 1, 'token': token_data, 'etag': token_etag}
-        if include_services:
-            data['services'] = get_services_using_token(cluster, token_name)
+        if services is not None:
+            data['services'] = services
         return data
     else:
         logging.info(f'Unable to retrieve token information on {cluster["name"]} ({cluster["url"]}).')
         return {'count': 0}
 
 
-def query_token(clusters, token, include_services=False):
+def get_token_on_cluster(cluster, token_name, include_services=False):
+    """Gets the token with the given name on the given cluster"""
+    token_data, token_etag = get_token(cluster, token_name, include='metadata')
+    services = get_services_using_token(cluster, token_name) if token_data and include_services else None
+    return __token_on_cluster_result(cluster, token_data, token_etag, services)
+
+
+async def get_token_on_cluster_async(cluster, token_name, include_services=False):
     """
-    Uses query_across_clusters to make the token
-    requests in parallel across the given clusters
+    Asynchronous counterpart of get_token_on_cluster; the
+    services request is made concurrently with the token request
     """
+    token_request = http_util.call_async(get_token, cluster, token_name, include='metadata')
+    if include_services:
+        services_request = http_util.call_async(get_services_using_token, cluster, token_name)
+        (token_data, token_etag), services = await asyncio.gather(token_request, services_request)
+    else:
+        (token_data, token_etag), services = await token_request, None
+    return __token_on_cluster_result(cluster, token_data, token_etag, services)
+
+
+async def query_token_async(clusters, token, include_services=False):
+    """Makes the token requests concurrently across the given clusters"""
+    return await query_across_clusters_async(
+        clusters,
+        lambda cluster: get_token_on_cluster_async(cluster, token, include_services))
+
+
+async def query_tokens_async(clusters, token_names, parallelism):
+    """Queries the given tokens across the given clusters, with at most parallelism tokens in flight at once"""
+    semaphore = asyncio.Semaphore(parallelism)
 
-    def submit(cluster, executor):
-        return executor.submit(get_token_on_cluster, cluster, token, include_services)
+    async def query(token_name):
+        async with semaphore:
+            return await query_token_async(clusters, token_name)
 
-    return query_across_clusters(clusters, submit)
+    return await asyncio.gather(*[query(t) for t in token_names])
+
+
+def query_token(clusters, token, include_services=False):
+    """
+    Uses query_across_clusters_async to make the token
+    requests in parallel across the given clusters
+    """
+    return http_util.run_coroutine(query_token_async(clusters, token, include_services))
 
 
 def get_service(cluster, service_id):
@@ -101,12 +173,21 @@ def get_service_on_cluster(cluster, service_id):
         return {'count': 0}
                      
                      
-def get_services_using_token(cluster, token_name):
-    """Retrieves all services that are using the token"""
+def stream_services_using_token(cluster, token_name, token_version=None):
+    """
+    Returns a generator of the services that are using the token (only those created from the given
+    version of the token, if any), parsed as they are read, or None on failure
+    """
     params = {'effective-parameters': 'true',
               'token': token_name}
-    services, _ = http_util.make_data_request(cluster, lambda: http_util.get(cluster, 'apps', params=params))
-    return services
+    if token_version:
+        params['token-version'] = token_version
+    return http_util.stream_data_request(cluster, lambda: http_util.get(cluster, 'apps', params=params, stream=True))
+
+
+def get_services_using_token(cluster, token_name, token_version=None):
+    """Retrieves all services that are using the token (only those using the given token version, if any)"""
+    return http_util.read_streamed_elements(stream_services_using_token(cluster, token_name, token_version))
 
 
 def get_services_on_cluster(cluster, token_name):
@@ -118,31 +199,46 @@ def get_services_on_cluster(cluster, token_name):
         return {'count': 0}
 
 
+async def query_service_async(clusters, service_id):
+    """Makes the service requests concurrently across the given clusters"""
+    return await query_across_clusters_async(
+        clusters,
+        lambda cluster: http_util.call_async(get_service_on_cluster, cluster, service_id))
+
+
 def query_service(clusters, service_id):
     """
-    Uses query_across_clusters to make the service
+    Uses query_across_clusters_async to make the service
     requests in parallel across the given clusters
     """
-    return query_across_clusters(
-        clusters,
-        lambda cluster, executor: executor.submit(get_service_on_cluster, cluster, service_id))
+    return http_util.run_coroutine(query_service_async(clusters, service_id))
 
 
 def query_services(clusters, token_name):
     """
-    Uses query_across_clusters to make the service
+    Uses query_across_clusters_async to make the service
     requests in parallel across the given clusters
     """
-    return query_across_clusters(
+    return http_util.run_coroutine(query_across_clusters_async(
         clusters,
-        lambda cluster, executor: executor.submit(get_services_on_cluster, cluster, token_name))
+        lambda cluster: http_util.call_async(get_services_on_cluster, cluster, token_name)))
+
+
+def stream_tokens(cluster, user, include_metadata=True, params=None):
+    """
+    Returns a generator of the tokens owned by the given user (or list of users) on the given cluster,
+    parsed one at a time as the response is read, or None if the request failed. Any additional params
+    (e.g. maintenance) are passed along to the server to filter the tokens.
+    """
+    params = {**(params or {}), 'owner': user}
+    if include_metadata:
+        params['include'] = 'metadata'
+    return http_util.stream_data_request(cluster, lambda: http_util.get(cluster, 'tokens', params=params, stream=True))
 
 
 def get_tokens(cluster, user):
     """Gets the tokens owned by the given user from the given cluster"""
-    params = {'owner': user, 'include': 'metadata'}
-    tokens, _ = http_util.make_data_request(cluster, lambda: http_util.get(cluster, 'tokens', params=params))
-    return tokens
+    return http_util.read_streamed_elements(stream_tokens(cluster, user))
 
 
 def get_tokens_on_cluster(cluster, user):
@@ -158,18 +254,117 @@ def get_tokens_on_cluster(cluster, user):
 
 def query_tokens(clusters, user):
     """
-    Uses query_across_clusters to make the token
+    Uses query_across_clusters_async to make the token
     requests in parallel across the given clusters
     """
-    return query_across_clusters(
+    return http_util.run_coroutine(query_across_clusters_async(
+        clusters,
+        lambda cluster: http_util.call_async(get_tokens_on_cluster, cluster, user)))
+
+
+def get_token_rows_on_cluster(cluster, user, row_fn, include_metadata=True, params=None):
+    """
+    Gets row_fn(cluster, token) for each token owned by the given user on the given cluster, skipping tokens
+    for which row_fn returns None; each token is mapped as soon as it is parsed, so only the rows (and not
+    the full tokens) are held in memory
+    """
+    tokens = stream_tokens(cluster, user, include_metadata=include_metadata, params=params)
+    try:
+        rows = [row for row in (row_fn(cluster, token) for token in tokens) if row is not None] \
+            if tokens is not None else []
+    except http_util.IncompleteResponseError as e:
+        # The rows of a partial response are not shown as if they were all of the cluster's tokens
+        logging.info(f'discarding the token rows of the incomplete response: {e}')
+        rows = []
+    if rows:
+        return {'count': len(rows), 'rows': rows}
+    else:
+        logging.info(f'Unable to retrieve token information on {cluster["name"]} ({cluster["url"]}).')
+        return {'count': 0}
+
+
+def query_token_rows(clusters, user, row_fn, include_metadata=True, params=None):
+    """
+    Uses query_across_clusters_async to stream the token
+    requests in parallel across the given clusters, mapping
+    each token to row_fn(cluster, token) as it is parsed
+    """
+    return http_util.run_coroutine(query_across_clusters_async(
         clusters,
-        lambda cluster, executor: executor.submit(get_tokens_on_cluster, cluster, user))
+        lambda cluster: http_util.call_async(get_token_rows_on_cluster, cluster, user, row_fn,
+                                             include_metadata=include_metadata, params=params)))
+
+
+def stream_token_rows(clusters, user, row_fn, include_metadata=True, params=None):
+    """
+    Generates a (cluster, rows) pair for each of the given clusters as soon as that cluster's tokens have been
+    read, in the order in which the clusters respond, where rows are the token rows given by get_token_rows_on_cluster
+    """
+    future_to_cluster = {http_util.executor.submit(get_token_rows_on_cluster, c, user, row_fn,
+                                                   include_metadata=include_metadata, params=params): c
+                         for c in clusters}
+    for future in futures.as_completed(future_to_cluster):
+        yield future_to_cluster[future], future.result().get('rows', [])
+
+
+def get_cluster_config_name(cluster):
+    """Retrieves the server-side (cluster-config) name of the given cluster from its /settings, or None"""
+    cluster_settings, _ = http_util.make_data_request(cluster, lambda: http_util.get(cluster, '/settings'))
+    try:
+        return cluster_settings['cluster-config']['name']
+    except (KeyError, TypeError):
+        logging.warning(f'Unable to retrieve the cluster-config name of {cluster["name"]} ({cluster["url"]}).')
+        return None
+
+
+async def __query_cluster_config_names(clusters):
+    """Retrieves the server-side names of the given clusters concurrently"""
+    return await asyncio.gather(*[http_util.call_async(get_cluster_config_name, c) for c in clusters])
 
 
-def _get_latest_cluster(clusters, query_result):
+async def get_cluster_config_names_async(clusters, use_cache=True):
+    """
+    Returns a map from the local name of each given cluster to its server-side (cluster-config) name.
+    Names are cached locally by cluster url, so changing a cluster's configured url invalidates its entry;
+    names that are not cached are retrieved from /settings concurrently.
+    Clusters whose name cannot be retrieved are omitted.
+    """
+    url_to_name = cache.get_cluster_names([c['url'] for c in clusters]) if use_cache else {}
+    uncached_clusters = [c for c in clusters if c['url'] not in url_to_name]
+    if uncached_clusters:
+        names = await __query_cluster_config_names(uncached_clusters)
+        retrieved_url_to_name = {c['url']: n for c, n in zip(uncached_clusters, names) if n}
+        cache.put_cluster_names(retrieved_url_to_name)
+        url_to_name.update(retrieved_url_to_name)
+    return {c['name']: url_to_name[c['url']] for c in clusters if c['url'] in url_to_name}
+
+
+def get_cluster_config_names(clusters, use_cache=True):
+    """
+    Synchronous counterpart of get_cluster_config_names_async. It runs its own event loop on the shared HTTP
+    executor, so it must never be called from a function run on that executor (e.g. via http_util.call_async).
+    """
+    return http_util.run_coroutine(get_cluster_config_names_async(clusters, use_cache=use_cache))
+
+
+def memoized_cluster_config_names():
+    """Returns a version of get_cluster_config_names that retrieves the cluster names (at most) once per command"""
+    cluster_names = {}
+
+    def get_cluster_names(clusters, use_cache=True):
+        if use_cache not in cluster_names:
+            cluster_names[use_cache] = get_cluster_config_names(clusters, use_cache=use_cache)
+        return cluster_names[use_cache]
+
+    return get_cluster_names
+
+
+def _get_latest_cluster(clusters, query_result, get_cluster_names=None):
     """
     :param clusters: list of local cluster configs from the configuration file
     :param query_result: value from query_token function
+    :param get_cluster_names: function used to retrieve the server-side names of the clusters (get_cluster_config_names
+     by default), which callers resolving the clusters of many tokens can replace with a memoized version
     :return: Finds latest token configuration from the query_result. Gets the cluster that is configured in the
      token description and returns a local cluster who's serverside name matches the one specified in the token.
      If the token's cluster does not exist in one of the local cluster configurations then an Exception is raised.
@@ -177,13 +372,15 @@ def _get_latest_cluster(clusters, query_result):
     token_descriptions = list(query_result['clusters'].values())
     token_result = max(token_descriptions, key=lambda token: token['token']['last-update-time'])
     cluster_name_goal = token_result['token']['cluster']
-    provided_cluster_names = []
-    for c in clusters:
-        cluster_settings, _ = http_util.make_data_request(c, lambda: http_util.get(c, '/settings'))
-        cluster_config_name = cluster_settings['cluster-config']['name']
-        provided_cluster_names.append(cluster_config_name)
-        if cluster_name_goal.upper() == cluster_config_name.upper():
-            return c
+    get_cluster_names = get_cluster_names or get_cluster_config_names
+    for use_cache in (True, False):
+        cluster_config_names = get_cluster_names(clusters, use_cache=use_cache)
+        for c in clusters:
+            cluster_config_name = cluster_config_names.get(c['name'])
+            if cluster_config_name and cluster_name_goal.upper() == cluster_config_name.upper():
+                return c
+        logging.debug(f'no cluster named {cluster_name_goal} in {cluster_config_names} (cached = {use_cache})')
+    provided_cluster_names = [cluster_config_names[c['name']] for c in clusters if c['name'] in cluster_config_names]
     raise Exception(f'The token is configured in cluster {cluster_name_goal}, which is not provided.' +
                     f' The following clusters were provided: {", ".join(provided_cluster_names)}.')
 
@@ -196,6 +393,17 @@ def get_target_cluster_from_token(clusters, token_name, enforce_cluster):
     :return: Return the target cluster config for various token operations
     """
     query_result = query_token(clusters, token_name)
+    return get_target_cluster_from_query_result(clusters, query_result, enforce_cluster)
+
+
+def get_target_cluster_from_query_result(clusters, query_result, enforce_cluster, get_cluster_names=None):
+    """
+    :param clusters: list of local cluster configs from the configuration file
+    :param query_result: value from query_token function for the token
+    :param enforce_cluster: boolean describing if cluster was explicitly specified as an cli argument
+    :param get_cluster_names: see _get_latest_cluster
+    :return: Return the target cluster config for various token operations, without querying the token again
+    """
     if query_result["count"] == 0:
         raise Exception('The token does not exist. You must create it first.')
     elif enforce_cluster:
@@ -219,7 +427,48 @@ def get_target_cluster_from_token(clusters, token_name, enforce_cluster):
                             f'groups that contain a description for this token: groups-{sync_groups_set} '
                             f'clusters-{cluster_names}.'
                             '\nConsider specifying with the --cluster flag which cluster you are targeting.')
-        return _get_latest_cluster(clusters, query_result)
+        return _get_latest_cluster(clusters, query_result, get_cluster_names)
+
+
+class TokenFetchContext:
+    """
+    The tokens read while running a single command, so that each token is read at most once per cluster: the
+    target cluster, token data and etag of a token are all taken from a single query_token of the given clusters.
+    Tokens posted by the command are not read again, so the context only reflects the tokens as they were read.
+    """
+
+    def __init__(self, clusters):
+        self.clusters = clusters
+        self.__query_results = {}
+        self.__get_cluster_names = memoized_cluster_config_names()
+
+    def query_token(self, token_name):
+        """Returns the query_token result of the given token, querying the clusters only the first time"""
+        if token_name not in self.__query_results:
+            self.__query_results[token_name] = query_token(self.clusters, token_name)
+        return self.__query_results[token_name]
+
+    def query_tokens(self, token_names, parallelism):
+        """Queries the given tokens that have not been read yet concurrently, at most parallelism tokens at a time"""
+        token_names = [t for t in dict.fromkeys(token_names) if t not in self.__query_results]
+        if token_names:
+            query_results = http_util.run_coroutine(query_tokens_async(self.clusters, token_names, parallelism))
+            self.__query_results.update(zip(token_names, query_results))
+
+    def get_target_cluster(self, token_name, enforce_cluster):
+        """Returns the target cluster of the given token (see get_target_cluster_from_token)"""
+        return get_target_cluster_from_query_result(self.clusters, self.query_token(token_name), enforce_cluster,
+                                                    self.__get_cluster_names)
+
+    def get_token(self, cluster, token_name):
+        """
+        Returns the data (without the server-managed fields that only come with the token metadata) and
+        etag of the given token on the given cluster, or (None, None) if the token is not on the cluster
+        """
+        entities = self.query_token(token_name)['clusters'].get(cluster['name'])
+        if entities is None:
+            return None, None
+        return user_fields(entities['token']), entities['etag']
 
 
 def get_service_id_from_instance_id(instance_id):
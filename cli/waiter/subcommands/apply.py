@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import os
+
+import requests
+
+from waiter import http_util, profiling, terminal
+from waiter.data_format import ANY_FORMAT, FORMAT_EXTENSIONS, load_context, load_data, load_file
+from waiter.display import render_table
+from waiter.querying import get_target_cluster_from_query_result, memoized_cluster_config_names, query_tokens_async
+from waiter.templating import compile_template, format_missing_variables
+from waiter.token_diff import diff_tokens, format_change, format_path
+from waiter.token_post import get_default_cluster_for_create, post_token
+from waiter.util import check_positive, guard_no_cluster, is_admin_enabled, response_message
+
+# The maximum number of changed fields listed for each token in the results table
+MAX_LISTED_CHANGES = 3
+
+# How each result is highlighted in the results table
+RESULT_COLORS = {'created': terminal.success, 'updated': terminal.success, 'failed': terminal.failed}
+
+
+def __load_contexts(contexts_file):
+    """Loads the list of contexts (each a map of variables) in the given JSON/YAML file"""
+    content = load_file(contexts_file)
+    if not content:
+        raise Exception(f'Unable to load contexts from {contexts_file}.')
+    contexts = ANY_FORMAT.parse(content, path=contexts_file)
+    if isinstance(contexts, dict):
+        contexts = contexts.get('contexts')
+    if not isinstance(contexts, list) or not all(isinstance(c, dict) for c in contexts):
+        raise Exception(f'The contexts in {contexts_file} must be a list of maps of variables '
+                        f'(or a map with such a list under "contexts").')
+    return contexts
+
+
+def render_token_definitions(template_path, contexts, shared_context=None):
+    """
+    Renders the template in the given file once per context, with the variables of the context (added to those of
+    the shared context), returning (source, definition) pairs. The template is only parsed once, and every context is
+    checked before any is rendered, so that all of the missing variables are reported together.
+    """
+    content = load_file(template_path)
+    if not content:
+        raise Exception(f'Unable to load template from {template_path}.')
+    try:
+        template = compile_template(content)
+    except ValueError as e:
+        raise Exception(f'Error when processing template {template_path}: {e}')
+    contexts = [{**(shared_context or {}), **c} for c in contexts]
+    errors = [f'context {index + 1} has {format_missing_variables(template.missing_variables(c))}'
+              for index, c in enumerate(contexts) if template.missing_variables(c)]
+    if errors:
+        raise Exception(f'Error when processing template {template_path}: {"; ".join(errors)}.')
+
+    definitions = []
+    for index, context in enumerate(contexts):
+        source = f'{template_path} (context {index + 1})'
+        definition = ANY_FORMAT.parse(template.render(context), path=template_path)
+        if not isinstance(definition, dict):
+            raise Exception(f'The token definition in {source} must be a dictionary of attributes.')
+        definitions.append((source, definition))
+    return definitions
+
+
+def load_token_definitions(path, context_file=None, contexts_file=None):
+    """
+    Loads the token definitions in the given directory (every JSON or YAML file in it defines one token) or manifest
+    (a JSON or YAML file listing token definitions under "tokens", or defining a single token). If a contexts file
+    is given, path is instead a template that is rendered once for each context, defining one token per context.
+    Each definition names its token in its "token" field. Returns a map from token name to the token's fields, sorted
+    by name.
+    """
+    # The context file is only read once, however many definitions it is used to render
+    shared_context = load_context(context_file) if context_file else None
+    if contexts_file:
+        if os.path.isdir(path):
+            raise Exception('You can only use --contexts with a template file, not a directory.')
+        definitions = render_token_definitions(path, __load_contexts(contexts_file), shared_context)
+    elif os.path.isdir(path):
+        file_paths = sorted(os.path.join(path, f) for f in os.listdir(path)
+                            if os.path.splitext(f)[1].lower() in FORMAT_EXTENSIONS)
+        file_paths = [p for p in file_paths if os.path.isfile(p)]
+        if not file_paths:
+            raise Exception(f'There are no JSON or YAML token definitions in {path}.')
+        definitions = [(p, load_data({'data': p, 'context_overrides': shared_context})) for p in file_paths]
+    else:
+        manifest = load_data({'data': path, 'context_overrides': shared_context})
+        if 'tokens' in manifest:
+            if not isinstance(manifest['tokens'], list) or not all(isinstance(d, dict) for d in manifest['tokens']):
+                raise Exception(f'The tokens in {path} must be a list of token definitions.')
+            definitions = [(f'{path} (token definition {index + 1})', d) for index, d in enumerate(manifest['tokens'])]
+        else:
+            definitions = [(path, manifest)]
+
+    sources = {}
+    token_definitions = {}
+    for source, definition in definitions:
+        token_fields = dict(definition)
+        token_name = token_fields.pop('token', None)
+        if not token_name:
+            raise Exception(f'The token definition in {source} does not specify the token name.')
+        if token_name in token_definitions:
+            raise Exception(f'Token {token_name} is defined in both {sources[token_name]} and {source}.')
+        sources[token_name] = source
+        token_definitions[token_name] = token_fields
+    return dict(sorted(token_definitions.items()))
+
+
+def plan_token(clusters, default_cluster, enforce_cluster, token_fields, query_result, get_cluster_names):
+    """
+    Given the token's query_token result, returns the plan for applying token_fields, as a map with the target cluster,
+    the existing token (None if it does not exist) and its etag, and the changes applying the token would make
+    """
+    if query_result['count'] == 0:
+        cluster = default_cluster
+    else:
+        cluster = get_target_cluster_from_query_result(clusters, query_result, enforce_cluster, get_cluster_names)
+    entities = query_result['clusters'].get(cluster['name'], {})
+    existing_token = entities.get('token')
+    return {'cluster': cluster,
+            'existing-token': existing_token,
+            'etag': entities.get('etag'),
+            'changes': diff_tokens(existing_token, token_fields)}
+
+
+def __post_planned_token(token_name, token_fields, plan, admin_mode):
+    """POSTs the planned token, returning (true, the server's message) on success and (false, the reason) otherwise"""
+    cluster = plan['cluster']
+    try:
+        resp = post_token(cluster, token_name, token_fields, plan['etag'], admin_mode)
+        resp_json = resp.json()
+        if 'message' in resp_json:
+            return True, resp_json['message']
+        return False, response_message(resp_json)
+    except requests.exceptions.ReadTimeout as rt:
+        logging.exception(rt)
+        return False, f'Encountered read timeout with {cluster["name"]}. Your post may have completed.'
+    except IOError as ioe:
+        logging.exception(ioe)
+        return False, f'Cannot connect to {cluster["name"]} ({cluster["url"]}).'
+
+
+async def __post_tokens_async(token_plans, token_definitions, admin_mode, parallelism):
+    """POSTs the given (token name, plan) pairs, with at most parallelism posts in flight at once"""
+    semaphore = asyncio.Semaphore(parallelism)
+
+    async def post(token_name, plan):
+        async with semaphore:
+            return await http_util.call_async(__post_planned_token, token_name, token_definitions[token_name], plan,
+                                              admin_mode)
+
+    return await asyncio.gather(*[post(t, p) for t, p in token_plans])
+
+
+def __format_changes_summary(changes):
+    """Summarizes the changed fields of a token for the results table"""
+    paths = [format_path(path) for path, _, _ in changes]
+    if len(paths) > MAX_LISTED_CHANGES:
+        return f'{", ".join(paths[:MAX_LISTED_CHANGES])} and {len(paths) - MAX_LISTED_CHANGES} more'
+    return ', '.join(paths)
+
+
+def print_diff(token_name, plan):
+    """Prints the changes that applying the token would make"""
+    action = 'create' if plan['existing-token'] is None else 'update'
+    print(f'Would {action} token {terminal.bold(token_name)} on {terminal.bold(plan["cluster"]["name"])}:')
+    for change in plan['changes']:
+        print(f'    {format_change(change)}')
+
+
+def print_results(results):
+    """Prints the table of (token name, cluster name, result, details) results"""
+    results = [(token_name, cluster_name, RESULT_COLORS.get(result, str)(result), details)
+               for token_name, cluster_name, result, details in results]
+    columns = [list(column) for column in zip(*results)]
+    with profiling.phase('render'):
+        print(render_table(columns, headers=['Token', 'Cluster', 'Result', 'Details']))
+
+
+def apply(clusters, args, _, enforce_cluster):
+    """Creates or updates the tokens defined in the given directory or manifest, skipping those that are unchanged"""
+    guard_no_cluster(clusters)
+    dry_run = args.get('dry-run', False)
+    admin_mode = args.get('admin', False)
+    parallelism = args.get('parallelism')
+    token_definitions = load_token_definitions(args.get('path'), args.get('context'), args.get('contexts'))
+    default_cluster = get_default_cluster_for_create(clusters) if len(clusters) > 1 else clusters[0]
+
+    token_names = list(token_definitions)
+    query_results = http_util.run_coroutine(query_tokens_async(clusters, token_names, parallelism))
+    get_cluster_names = memoized_cluster_config_names()
+    results = {}
+    token_plans = []
+    for token_name, query_result in zip(token_names, query_results):
+        try:
+            plan = plan_token(clusters, default_cluster, enforce_cluster, token_definitions[token_name], query_result,
+                              get_cluster_names)
+        except Exception as e:
+            logging.exception(e)
+            results[token_name] = (None, 'failed', ' '.join(str(e).splitlines()))
+            continue
+        cluster_name = plan['cluster']['name']
+        if not plan['changes']:
+            results[token_name] = (cluster_name, 'unchanged', '')
+        elif dry_run:
+            print_diff(token_name, plan)
+            action = 'create' if plan['existing-token'] is None else 'update'
+            results[token_name] = (cluster_name, f'would {action}', __format_changes_summary(plan['changes']))
+        else:
+            token_plans.append((token_name, plan))
+
+    if token_plans:
+        post_results = http_util.run_coroutine(__post_tokens_async(token_plans, token_definitions, admin_mode,
+                                                                   parallelism))
+        for (token_name, plan), (success, message) in zip(token_plans, post_results):
+            cluster_name = plan['cluster']['name']
+            if not success:
+                results[token_name] = (cluster_name, 'failed', message)
+            elif plan['existing-token'] is None:
+                results[token_name] = (cluster_name, 'created', '')
+            else:
+                results[token_name] = (cluster_name, 'updated',
+                                       __format_changes_summary(plan['changes']))
+
+    print_results([(token_name, *results[token_name]) for token_name in token_names])
+    return 1 if any(result == 'failed' for _, result, _ in results.values()) else 0
+
+
+def register(add_parser):
+    """Adds this sub-command's parser and returns the action function"""
+    parser = add_parser('apply', help='create or update the tokens defined in a directory or manifest',
+                        description='Creates or updates the tokens defined in a directory, where every JSON or YAML '
+                                    'file defines one token, or in a manifest, a JSON or YAML file listing token '
+                                    'definitions under "tokens". Each definition is the full token (including its '
+                                    'name, in the "token" field), which replaces the existing token. The existing '
+                                    'tokens are fetched concurrently and compared with their definitions, and only '
+                                    'the tokens that changed are posted.')
+    parser.add_argument('path', help='the directory or manifest of token definitions')
+    parser.add_argument('--dry-run', help='show the changes that would be made, without making them',
+                        dest='dry-run', action='store_true')
+    parser.add_argument('--parallelism', '-p', type=check_positive, default=16,
+                        help='maximum number of tokens queried (or posted) at once')
+    parser.add_argument('--context', dest='context',
+                        help='this JSON/YAML file provides the context variables used to render every token '
+                             'definition as a template')
+    parser.add_argument('--contexts', dest='contexts',
+                        help='this JSON/YAML file provides a list of contexts; the path is then a template, which is '
+                             'rendered once with each context (and the variables of --context, if given) to define '
+                             'one token per context')
+    if is_admin_enabled():
+        parser.add_argument('--admin', '-a', help='run command in admin mode', action='store_true')
+    return apply
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import os
+import time
+from functools import partial
+
+from waiter import cache, completion, http_util, version
+from waiter.querying import get_services_using_token, get_tokens
+from waiter.util import current_user, guard_no_cluster
+
+BASH_SCRIPT = '''_waiter_completion() {
+    local IFS=$'\\n'
+    COMPREPLY=($("${COMP_WORDS[0]}" __complete "$COMP_CWORD" "${COMP_WORDS[@]}" 2>/dev/null))
+}
+complete -o default -F _waiter_completion waiter'''
+
+ZSH_SCRIPT = '''_waiter_completion() {
+    local -a candidates
+    candidates=("${(@f)$("${words[1]}" __complete "$((CURRENT - 1))" "${words[@]}" 2>/dev/null)}")
+    if [[ -n "${candidates[1]}" ]]; then
+        compadd -a candidates
+    else
+        _files
+    fi
+}
+compdef _waiter_completion waiter'''
+
+
+async def __index_cluster_async(cluster, user):
+    """Returns the completion index entry (token names and service ids) for the given cluster, or None on failure"""
+    tokens = await http_util.call_async(get_tokens, cluster, user)
+    if tokens is None:
+        return None
+    token_names = sorted(t['token'] for t in tokens)
+    services = await asyncio.gather(*[http_util.call_async(get_services_using_token, cluster, token_name)
+                                      for token_name in token_names])
+    service_ids = sorted({s['service-id'] for token_services in services for s in token_services or []})
+    return {'tokens': token_names, 'service-ids': service_ids}
+
+
+async def __index_clusters_async(clusters, user):
+    """Returns the completion index entries of the given clusters, indexing all of the clusters concurrently"""
+    return await asyncio.gather(*[__index_cluster_async(c, user) for c in clusters])
+
+
+def refresh_index(clusters, user):
+    """
+    Rebuilds the completion index from the tokens owned by user (and the services using them) on the given
+    clusters. Clusters that cannot be queried keep their previously indexed entries.
+    """
+    path = cache.cache_path(completion.INDEX_FILE)
+    index = cache.read_json(path) or {}
+    cluster_entries = index.get('clusters', {})
+    entries = http_util.run_coroutine(__index_clusters_async(clusters, user))
+    for cluster, entry in zip(clusters, entries):
+        if entry is None:
+            logging.info(f'unable to index {cluster["name"]} for completion')
+        else:
+            cluster_entries[cluster['name']] = entry
+    cache.write_json(path, {'version': version.VERSION,
+                            'time': time.time(),
+                            'spec': completion.parser_spec(),
+                            'clusters': cluster_entries})
+    return cluster_entries
+
+
+def refresh(clusters, _, __, ___):
+    """Refreshes the local completion index of the tokens owned by the current user"""
+    guard_no_cluster(clusters)
+    try:
+        cluster_entries = refresh_index(clusters, current_user())
+        logging.debug(f'indexed {len(cluster_entries)} clusters for completion')
+    finally:
+        lock_path = cache.cache_path(completion.REFRESH_LOCK_FILE)
+        if lock_path and os.path.exists(lock_path):
+            os.remove(lock_path)
+    return 0
+
+
+def print_script(shell, _, __, ___, ____):
+    """Prints the completion script for the given shell"""
+    print(BASH_SCRIPT if shell == 'bash' else ZSH_SCRIPT)
+    return 0
+
+
+def completion_action(parser, clusters, args, config_path, enforce_cluster):
+    """Calls the sub action for completion command. If no sub action is provided then displays the help message."""
+    sub_func = args.get('sub_func', None)
+    if sub_func is None:
+        parser.print_help()
+        return 0
+    else:
+        return sub_func(clusters, args, config_path, enforce_cluster)
+
+
+def register(add_parser):
+    """Adds this sub-command's parser and returns the action function"""
+    parser = add_parser('completion',
+                        help='shell completion support',
+                        description='Shell completion support. To enable completion of actions, options, tokens and '
+                                    'service ids in bash, add `eval "$(waiter completion bash)"` to your ~/.bashrc '
+                                    '(or `eval "$(waiter completion zsh)"` to your ~/.zshrc). Tokens and service ids '
+                                    'are completed from a local index that is refreshed in the background.')
+    subparsers = parser.add_subparsers()
+    for shell in ['bash', 'zsh']:
+        shell_parser = subparsers.add_parser(shell, help=f'print the {shell} completion script')
+        shell_parser.set_defaults(sub_func=partial(print_script, shell))
+    refresh_parser = subparsers.add_parser('refresh', help='refresh the local index of tokens and service ids')
+    refresh_parser.set_defaults(sub_func=refresh)
+    return partial(completion_action, parser)
@@ -1,4 +1,4 @@
-from waiter.action import process_kill_request
+from waiter.action import DEFAULT_KILL_PARALLELISM, process_kill_request
 from waiter.util import guard_no_cluster, check_positive
 
 
@@ -9,7 +9,9 @@ def kill(clusters, args, _, __):
     is_service_id = args.get('is-service-id', False)
     force_flag = args.get('force', False)
     timeout_secs = args['timeout']
-    success = process_kill_request(clusters, token_name_or_service_id, is_service_id, force_flag, timeout_secs)
+    parallelism = args['parallelism']
+    success = process_kill_request(clusters, token_name_or_service_id, is_service_id, force_flag, timeout_secs,
+                                   parallelism=parallelism)
     return 0 if success else 1
 
 
@@ -22,4 +24,6 @@ def register(add_parser):
                         dest='is-service-id', action='store_true')
     parser.add_argument('--timeout', '-t', help='timeout (in seconds) for kill to complete',
                         type=check_positive, default=30)
+    parser.add_argument('--parallelism', '-p', help='maximum number of services killed at once when not prompting',
+                        type=check_positive, default=DEFAULT_KILL_PARALLELISM)
     return kill
@@ -1,12 +1,19 @@
+import asyncio
 from functools import partial
 
 import requests
 
-from waiter import terminal, http_util
-from waiter.action import ping_token_on_cluster, process_kill_request
-from waiter.querying import get_target_cluster_from_token, get_token
-from waiter.token_post import post_failed_message, process_post_result
-from waiter.util import check_positive, guard_no_cluster, logging, print_info
+from waiter import terminal, http_util, profiling
+from waiter.action import DEFAULT_KILL_PARALLELISM, kill_service_on_cluster, ping_token_on_cluster, \
+    process_kill_request, send_ping
+from waiter.display import render_table
+from waiter.querying import TokenFetchContext, get_services_using_token
+from waiter.token_post import post_failed_message, post_token, process_post_result
+from waiter.util import check_positive, guard_no_cluster, logging, print_info, response_message
+
+# How each result is highlighted in the consolidated results table of multiple tokens
+RESULT_COLORS = {'activated': terminal.success, 'deactivated': terminal.success, 'killed': terminal.success,
+                 'succeeded': terminal.success, 'failed': terminal.failed}
 
 
 def _is_token_in_maintenance_mode(token_data):
@@ -15,8 +22,9 @@ def _is_token_in_maintenance_mode(token_data):
 
 def _get_existing_token_data(clusters, token_name, enforce_cluster):
     guard_no_cluster(clusters)
-    cluster = get_target_cluster_from_token(clusters, token_name, enforce_cluster)
-    existing_token_data, existing_token_etag = get_token(cluster, token_name)
+    fetch_context = TokenFetchContext(clusters)
+    cluster = fetch_context.get_target_cluster(token_name, enforce_cluster)
+    existing_token_data, existing_token_etag = fetch_context.get_token(cluster, token_name)
     return cluster, existing_token_data, existing_token_etag
 
 
@@ -43,6 +51,217 @@ def _update_token(cluster, token_name, existing_token_etag, body):
         return 1, None
 
 
+def _get_target_clusters(fetch_context, token_name, enforce_cluster, sync_group):
+    """
+    Returns the clusters to update the token on: its target cluster (first) and, with sync_group, every other
+    cluster in the target cluster's sync group that has the token
+    """
+    cluster = fetch_context.get_target_cluster(token_name, enforce_cluster)
+    group = cluster.get('sync-group')
+    if not sync_group or not group:
+        return [cluster]
+    token_clusters = fetch_context.query_token(token_name)['clusters']
+    return [cluster] + [c for c in fetch_context.clusters
+                        if c is not cluster and c.get('sync-group') == group and c['name'] in token_clusters]
+
+
+def _post_token_update(cluster, token_name, existing_token_etag, body):
+    """POSTs the token update without printing, returning None on success and the reason it failed otherwise"""
+    try:
+        resp = post_token(cluster, token_name, body, existing_token_etag)
+        resp_json = resp.json()
+        return None if 'message' in resp_json else ' '.join(response_message(resp_json).splitlines())
+    except requests.exceptions.ReadTimeout as rt:
+        logging.exception(rt)
+        return 'Encountered read timeout. The operation may have completed.'
+    except IOError as ioe:
+        logging.exception(ioe)
+        return f'Cannot connect to {cluster["url"]}.'
+
+
+async def _update_token_on_clusters_async(fetch_context, token_name, update_fns, semaphore):
+    """
+    Updates the token on each cluster (concurrently) with the given map from cluster name to a function from the
+    existing token data to the updated token body, returning the '<cluster>: <reason>' failures
+    """
+    clusters_by_name = {c['name']: c for c in fetch_context.clusters}
+
+    async def update(cluster_name, update_fn):
+        cluster = clusters_by_name[cluster_name]
+        existing_token_data, existing_token_etag = fetch_context.get_token(cluster, token_name)
+        async with semaphore:
+            reason = await http_util.call_async(_post_token_update, cluster, token_name, existing_token_etag,
+                                                update_fn(existing_token_data))
+        return f'{cluster_name}: {reason}' if reason else None
+
+    failures = await asyncio.gather(*[update(c, fn) for c, fn in update_fns.items()])
+    return [f for f in failures if f]
+
+
+async def _kill_token_services_async(clusters, token_name, timeout_secs, semaphore):
+    """Kills the token's services in the given clusters, returning the result and details for the results table"""
+
+    async def get_services(cluster):
+        async with semaphore:
+            return await http_util.call_async(get_services_using_token, cluster, token_name)
+
+    async def kill(cluster, service_id):
+        async with semaphore:
+            return await http_util.call_async(kill_service_on_cluster, cluster, service_id, timeout_secs)
+
+    cluster_services = await asyncio.gather(*[get_services(c) for c in clusters])
+    unknown_cluster_names = [c['name'] for c, services in zip(clusters, cluster_services) if services is None]
+    cluster_service_id_pairs = [(c, s['service-id']) for c, services in zip(clusters, cluster_services)
+                                for s in services or [] if s.get('status') != 'Inactive']
+    results = await asyncio.gather(*[kill(c, s) for c, s in cluster_service_id_pairs])
+    killed_count = len([r for r in results if r])
+    details = []
+    if unknown_cluster_names:
+        details.append(f'unable to retrieve the services in {", ".join(unknown_cluster_names)}')
+    if killed_count < len(cluster_service_id_pairs):
+        details.append(f'killed {killed_count} of {len(cluster_service_id_pairs)} services')
+    if details:
+        return 'failed', '; '.join(details)
+    elif killed_count == 0:
+        return 'no services', ''
+    return 'killed', f'{killed_count} service{"" if killed_count == 1 else "s"}'
+
+
+async def _ping_token_on_clusters_async(clusters, token_name, timeout, wait_for_ping, semaphore):
+    """Pings the token in the given clusters, returning the result and details for the results table"""
+
+    async def ping(cluster):
+        async with semaphore:
+            return await http_util.call_async(send_ping, cluster, timeout, wait_for_ping, token_name)
+
+    ping_results = await asyncio.gather(*[ping(c) for c in clusters])
+    failures = [f'{c["name"]}: {" ".join((message or "ping failed").splitlines())}'
+                for c, (succeeded, _, message) in zip(clusters, ping_results) if not succeeded]
+    return ('failed', '; '.join(failures)) if failures else ('succeeded', '')
+
+
+def _resolve_target_clusters(clusters, token_names, enforce_cluster, sync_group, parallelism):
+    """
+    Reads the given tokens concurrently, returning the fetch context that holds them and a map from each token to
+    either its target clusters (see _get_target_clusters) or the reason they could not be determined
+    """
+    guard_no_cluster(clusters)
+    fetch_context = TokenFetchContext(clusters)
+    fetch_context.query_tokens(token_names, parallelism)
+    token_targets = {}
+    for token_name in token_names:
+        try:
+            token_targets[token_name] = _get_target_clusters(fetch_context, token_name, enforce_cluster, sync_group)
+        except Exception as e:
+            logging.exception(e)
+            token_targets[token_name] = ' '.join(str(e).splitlines())
+    return fetch_context, token_targets
+
+
+async def _run_for_tokens_async(token_targets, token_fn, parallelism):
+    """
+    Runs token_fn (given the token, its target clusters, the update semaphore and the second stage semaphore) for
+    every token concurrently, so that the second stage for a token starts as soon as its own updates are done
+    """
+    update_semaphore = asyncio.Semaphore(parallelism)
+    second_stage_semaphore = asyncio.Semaphore(parallelism)
+
+    async def run(token_name, target_clusters):
+        if isinstance(target_clusters, str):
+            return 'failed', 'skipped', target_clusters
+        return await token_fn(token_name, target_clusters, update_semaphore, second_stage_semaphore)
+
+    return await asyncio.gather(*[run(t, c) for t, c in token_targets.items()])
+
+
+def _print_results(token_targets, results, second_stage_header):
+    """Prints the consolidated table of (maintenance result, second stage result, details) results of the tokens"""
+    rows = []
+    for (token_name, target_clusters), (maintenance_result, second_stage_result, details) in \
+            zip(token_targets.items(), results):
+        cluster_names = '' if isinstance(target_clusters, str) else ', '.join(c['name'] for c in target_clusters)
+        rows.append((token_name, cluster_names,
+                     RESULT_COLORS.get(maintenance_result, str)(maintenance_result),
+                     RESULT_COLORS.get(second_stage_result, str)(second_stage_result),
+                     details))
+    columns = [list(column) for column in zip(*rows)]
+    with profiling.phase('render'):
+        print(render_table(columns, headers=['Token', 'Clusters', 'Maintenance', second_stage_header, 'Details']))
+    return 1 if any('failed' in result[:2] for result in results) else 0
+
+
+def start_maintenance_for_tokens(clusters, token_names, args, enforce_cluster, kill_services):
+    """
+    Sets the given tokens in maintenance mode on their target clusters (or whole sync groups), updating all of the
+    tokens concurrently and killing each token's services as soon as the token is updated, and prints the results
+    """
+    message = args['message']
+    timeout_secs = args['timeout']
+    parallelism = args['parallelism']
+    fetch_context, token_targets = _resolve_target_clusters(clusters, token_names, enforce_cluster,
+                                                            args.get('sync_group', False), parallelism)
+
+    def start_body(existing_token_data):
+        return {**existing_token_data, 'maintenance': {'message': message}}
+
+    async def start_token(token_name, target_clusters, update_semaphore, kill_semaphore):
+        failures = await _update_token_on_clusters_async(fetch_context, token_name,
+                                                         {c['name']: start_body for c in target_clusters},
+                                                         update_semaphore)
+        if failures:
+            # Killing the services is skipped unless maintenance is active everywhere, since requests to the
+            # clusters not in maintenance would just start them again
+            return 'failed', 'skipped', '; '.join(failures)
+        if not kill_services:
+            return 'activated', 'skipped', ''
+        return ('activated', *await _kill_token_services_async(clusters, token_name, timeout_secs, kill_semaphore))
+
+    if kill_services:
+        # The kills run concurrently with the updates of other tokens, so retries are disabled before any of them
+        http_util.set_retries(0)
+    results = http_util.run_coroutine(_run_for_tokens_async(token_targets, start_token, parallelism))
+    return _print_results(token_targets, results, 'Kill')
+
+
+def stop_maintenance_for_tokens(clusters, token_names, args, enforce_cluster, ping_token, timeout, wait_for_ping,
+                                check_maintenance_mode):
+    """
+    Stops maintenance mode for the given tokens on their target clusters (or whole sync groups), updating all of the
+    tokens concurrently and pinging each token as soon as the token is updated, and prints the results
+    """
+    parallelism = args['parallelism']
+    fetch_context, token_targets = _resolve_target_clusters(clusters, token_names, enforce_cluster,
+                                                            args.get('sync_group', False), parallelism)
+
+    def stop_body(existing_token_data):
+        return {k: v for k, v in existing_token_data.items() if k != 'maintenance'}
+
+    async def stop_token(token_name, target_clusters, update_semaphore, ping_semaphore):
+        maintenance_cluster_names = [c['name'] for c in target_clusters
+                                     if _is_token_in_maintenance_mode(fetch_context.get_token(c, token_name)[0])]
+        if check_maintenance_mode and target_clusters[0]['name'] not in maintenance_cluster_names:
+            return 'failed', 'skipped', 'Token is not in maintenance mode'
+        failures = await _update_token_on_clusters_async(fetch_context, token_name,
+                                                         {c: stop_body for c in maintenance_cluster_names},
+                                                         update_semaphore)
+        maintenance_result = 'deactivated' if maintenance_cluster_names else 'not active'
+        if failures:
+            return 'failed', 'skipped', '; '.join(failures)
+        if not ping_token:
+            return maintenance_result, 'skipped', ''
+        return (maintenance_result,
+                *await _ping_token_on_clusters_async(target_clusters, token_name, timeout, wait_for_ping,
+                                                     ping_semaphore))
+
+    results = http_util.run_coroutine(_run_for_tokens_async(token_targets, stop_token, parallelism))
+    return _print_results(token_targets, results, 'Ping')
+
+
+def __is_single_token(token_names, args):
+    """Returns true if the command is for a single token (on its target cluster only)"""
+    return len(token_names) == 1 and not args.get('sync_group', False)
+
+
 def check_maintenance(clusters, args, _, enforce_cluster):
     """Checks if a token is in maintenance mode and displays the result. Returns 0 if the token is in maintenance mode
     and returns 1 if the token is NOT in maintenance mode."""
@@ -53,11 +272,34 @@ def check_maintenance(clusters, args, _, enforce_cluster):
     return 0 if maintenance_mode_active else 1
 
 
+def __get_token_names_and_message(args):
+    """
+    Returns the tokens and the maintenance message. With more than one token or --sync-group, the message must be
+    given with --message; otherwise it may instead be the positional argument after the token.
+    """
+    positionals = [args['token']] + args.pop('message_or_tokens', [])
+    message = args.get('message')
+    if message is not None:
+        return list(dict.fromkeys(positionals)), message
+    elif len(positionals) == 1:
+        raise Exception('You must provide a maintenance message.')
+    elif len(positionals) > 2 or args.get('sync_group', False):
+        raise Exception('You must provide the maintenance message with --message when starting maintenance for '
+                        'more than one token or with --sync-group.')
+    return positionals[:1], positionals[1]
+
+
 def start_maintenance(clusters, args, _, enforce_cluster):
-    """Sets the token in maintenance mode by updating the token user metadata fields"""
-    token_name = args['token']
+    """Sets the token(s) in maintenance mode by updating the token user metadata fields"""
+    token_names, args['message'] = __get_token_names_and_message(args)
     timeout_secs = args['timeout']
     kill_services_option = args.pop('kill_services', 'force_kill')
+    if not __is_single_token(token_names, args):
+        if kill_services_option == 'ask_kill':
+            raise Exception('You cannot use --ask-kill with multiple tokens or --sync-group.')
+        kill_services = kill_services_option == 'force_kill'
+        return start_maintenance_for_tokens(clusters, token_names, args, enforce_cluster, kill_services)
+    token_name = token_names[0]
     cluster, existing_token_data, existing_token_etag = _get_existing_token_data(clusters, token_name, enforce_cluster)
     json_body = existing_token_data
     update_doc = {"maintenance": {"message": args['message']}}
@@ -78,7 +320,8 @@ def start_maintenance(clusters, args, _, enforce_cluster):
                       f"{'force ' if force_flag else ''} kill services")
         if kill_services:
             if token_etag:
-                success = process_kill_request(clusters, token_name, False, force_flag, timeout_secs, True)
+                success = process_kill_request(clusters, token_name, False, force_flag, timeout_secs, True,
+                                               parallelism=args['parallelism'])
                 return 0 if success else 1
             else:
                 logging.debug(f'Not killing services for token {token_name} in {cluster} as token ETag is missing.')
@@ -91,12 +334,16 @@ def start_maintenance(clusters, args, _, enforce_cluster):
 
 
 def stop_maintenance(clusters, args, _, enforce_cluster):
-    """Stops maintenance mode for a token by deleting the 'maintenance' user metadata field in the token data"""
-    token_name = args['token']
+    """Stops maintenance mode for the token(s) by deleting the 'maintenance' user metadata field in the token data"""
+    token_names = list(dict.fromkeys(args['token']))
     ping_token = args.pop('ping_token', True)
     timeout = args.pop('timeout', 300)
     wait_for_ping = args.pop('wait', True)
     check_maintenance_mode = args.pop('check', False)
+    if not __is_single_token(token_names, args):
+        return stop_maintenance_for_tokens(clusters, token_names, args, enforce_cluster, ping_token, timeout,
+                                           wait_for_ping, check_maintenance_mode)
+    token_name = token_names[0]
     cluster, existing_token_data, existing_token_etag = _get_existing_token_data(clusters, token_name, enforce_cluster)
     maintenance_mode_active = _is_token_in_maintenance_mode(existing_token_data)
     logging.debug(f'Token {token_name} in {cluster} with etag {existing_token_etag} '
@@ -165,7 +412,15 @@ def register_stop(command_name, add_parser):
                              help='enforces the check that the token is currently in maintenance mode')
     check_group.add_argument('--no-check', action='store_false', dest='check',
                              help='skips checking maintenance mode; skipping the check is enabled by default')
-    parser.add_argument('token')
+    parser.add_argument('--sync-group', action='store_true', dest='sync_group',
+                        help="stop maintenance mode on every cluster in the sync group of each token's target "
+                             'cluster (that has the token), rather than only on the target cluster')
+    parser.add_argument('--parallelism', '-p', default=DEFAULT_KILL_PARALLELISM, type=check_positive,
+                        help='maximum number of token updates (and pings) in flight at once with multiple tokens '
+                             'or --sync-group.')
+    parser.add_argument('token', nargs='+',
+                        help='the token(s); with more than one token, all of the tokens are updated (and pinged) '
+                             'concurrently and the results are shown in a table')
     parser.set_defaults(sub_func=stop_maintenance)
     return stop_maintenance
 
@@ -173,6 +428,8 @@ def register_stop(command_name, add_parser):
 def register_start(command_name, add_parser):
     """Registers the maintenance start parser"""
     parser = add_parser(command_name,
+                        usage='%(prog)s [options] token message\n'
+                              '       %(prog)s [options] --message MESSAGE token [token ...]',
                         help='start maintenance mode for a token. '
                              'All requests to this token will begin to receive a 503 response. '
                              "By default, also kill the token's currently running services.")
@@ -186,10 +443,24 @@ def register_start(command_name, add_parser):
                             help="Skip killing the token's currently running services.")
     parser.add_argument('--timeout', '-t', default=10, help='timeout (in seconds) for service kill requests.',
                         type=check_positive)
-    parser.add_argument('token')
-    parser.add_argument('message',
+    parser.add_argument('--parallelism', '-p', default=DEFAULT_KILL_PARALLELISM, type=check_positive,
+                        help='maximum number of services killed at once when not prompting '
+                             '(and of token updates in flight at once with multiple tokens or --sync-group).')
+    parser.add_argument('--sync-group', action='store_true', dest='sync_group',
+                        help="start maintenance mode on every cluster in the sync group of each token's target "
+                             'cluster (that has the token), rather than only on the target cluster')
+    parser.add_argument('--message', '-m',
                         help='Your message will be provided in a 503 response for requests to the token. '
-                             'The message cannot be more than 512 characters.')
+                             'The message cannot be more than 512 characters. '
+                             'Required with more than one token or --sync-group.')
+    parser.add_argument('token', help='the token')
+    message_or_tokens = parser.add_argument('message_or_tokens', nargs='+', metavar='message | token',
+                                            help='the message, unless --message is used, in which case more tokens '
+                                                 'may be given instead; with more than one token, all of the '
+                                                 'tokens are updated (and their services killed) concurrently and '
+                                                 'the results are shown in a table')
+    # The positional is only optional with --message, which start_maintenance checks; argparse requires '+' positionals
+    message_or_tokens.required = False
     parser.set_defaults(sub_func=start_maintenance)
     return start_maintenance
 
@@ -1,15 +1,23 @@
 
+import asyncio
+import shutil
+import sys
+import time
+
+from tabulate import tabulate
+
 from waiter import http_util, terminal
-from waiter.action import ping_service_on_cluster, ping_token_on_cluster
-from waiter.querying import print_no_data, query_service, query_token
-from waiter.util import check_positive, guard_no_cluster
+from waiter.action import ping_service_on_cluster, ping_token_on_cluster, send_ping, service_is_active
+from waiter.format import format_status
+from waiter.querying import get_cluster_config_names, get_cluster_config_names_async, get_services_using_token, \
+    print_no_data, query_service, query_service_async, query_token, query_token_async
+from waiter.util import check_positive, guard_no_cluster, is_service_current, print_error, wait_until
 
+DEFAULT_PING_PARALLELISM = 16
 
-def ping(clusters, args, _, __):
-    """Pings the token with the given token name."""
-    guard_no_cluster(clusters)
-    token_name_or_service_id = args.get('token-or-service-id')
-    is_service_id = args.get('is-service-id', False)
+
+def ping_one(clusters, token_name_or_service_id, is_service_id, timeout, wait_for_request):
+    """Pings the token (or service) with the given name, printing the outcome on each cluster as it happens."""
     if is_service_id:
         query_result = query_service(clusters, token_name_or_service_id)
     else:
@@ -19,8 +27,6 @@ def ping(clusters, args, _, __):
         print_no_data(clusters)
         return 1
 
-    timeout = args.get('timeout', None)
-    wait_for_request = args.get('wait', True)
     http_util.set_retries(0)
     cluster_data_pairs = sorted(query_result['clusters'].items())
     clusters_by_name = {c['name']: c for c in clusters}
@@ -45,10 +51,157 @@ def ping(clusters, args, _, __):
     return 0 if overall_success else 1
 
 
+def current_token_service(cluster, token_name, current_token_etag):
+    """Returns the service of the current version of the given token, or None, without printing anything"""
+    services = get_services_using_token(cluster, token_name, token_version=current_token_etag) or []
+    return next((s for s in services if is_service_current(s, current_token_etag, token_name)), None)
+
+
+def live_table(headers, rows):
+    """
+    Returns a function that renders the given rows (dicts of the header -> value) as a table. On a terminal
+    that is tall enough, the table is redrawn in place (using terminal.MOVE_UP) each time the function is
+    called; otherwise the table is only printed once, when the function is called with final=True.
+    """
+    live = sys.stdout.isatty()
+    lines_drawn = 0
+
+    def render(final=False):
+        nonlocal live, lines_drawn
+        table = tabulate([[row[h] for h in headers] for row in rows], headers=headers, tablefmt='plain')
+        lines = table.split('\n')
+        if live and len(lines) >= shutil.get_terminal_size().lines:
+            live = False
+        if live:
+            sys.stdout.write(terminal.MOVE_UP * lines_drawn + ''.join(f'{terminal.CLEAR_LINE}{l}\n' for l in lines))
+            sys.stdout.flush()
+            lines_drawn = len(lines)
+        elif final:
+            print(table)
+
+    return render
+
+
+async def ping_name_async(clusters, name, is_service_id, timeout, wait_for_request, semaphore, rows, render,
+                          cluster_config_names):
+    """
+    Pings the token (or service) with the given name on every cluster that has it, with each query and ping holding
+    the semaphore. The row for the name is replaced by one row per cluster, which is updated (and the table
+    re-rendered) as the ping progresses. Returns a (cluster name, succeeded, message) triple for each cluster.
+    A token is only pinged on the clusters whose server-side name (in cluster_config_names) matches the cluster
+    it was created in.
+    """
+    name_header = 'Service Id' if is_service_id else 'Token'
+    name_row = rows[next(i for i, r in enumerate(rows) if r[name_header] == name and r['Cluster'] == '')]
+    async with semaphore:
+        name_row['Result'] = 'Querying'
+        render()
+        if is_service_id:
+            query_result = await query_service_async(clusters, name)
+        else:
+            query_result = await query_token_async(clusters, name)
+
+    if query_result['count'] == 0:
+        name_row['Result'] = terminal.failed('Not found')
+        render()
+        return [(None, False, 'No matching data found.')]
+
+    clusters_by_name = {c['name']: c for c in clusters}
+    cluster_rows = [dict(name_row, Cluster=cluster_name, Result='Pending')
+                    for cluster_name in sorted(query_result['clusters'])]
+    index = rows.index(name_row)
+    rows[index:index + 1] = cluster_rows
+    render()
+
+    async def ping_on_cluster_async(row):
+        cluster = clusters_by_name[row['Cluster']]
+        data = query_result['clusters'][row['Cluster']]
+        if is_service_id:
+            target = f'^SERVICE-ID#{name}'
+        else:
+            token_cluster_name = data['token']['cluster'].upper()
+            if len(clusters) > 1 and cluster_config_names.get(cluster['name'], '').upper() != token_cluster_name:
+                row['Result'] = f'Skipped (created in {token_cluster_name})'
+                render()
+                return row['Cluster'], True, None
+            target = name
+
+        def service_exists():
+            if is_service_id:
+                return service_is_active(cluster, name)
+            else:
+                return current_token_service(cluster, name, data['etag'])
+
+        async with semaphore:
+            row['Result'] = 'Pinging'
+            render()
+            start = time.monotonic()
+            succeeded, status, message = await http_util.call_async(send_ping, cluster, timeout, wait_for_request,
+                                                                    target)
+            row['Latency'] = f'{time.monotonic() - start:.2f}s'
+            if succeeded and (status is None or status == 'Inactive'):
+                row['Result'] = 'Waiting for service'
+                render()
+                service = await http_util.call_async(wait_until, service_exists, timeout=timeout)
+                if service:
+                    status = service['status']
+                else:
+                    message = 'Timeout while waiting for service to start.'
+        row['Result'] = terminal.success('Succeeded') if succeeded else terminal.failed('Failed')
+        row['Status'] = format_status(status) if status else ''
+        render()
+        return row['Cluster'], succeeded, None if succeeded and status else message
+
+    return await asyncio.gather(*[ping_on_cluster_async(row) for row in cluster_rows])
+
+
+async def ping_many_async(clusters, names, is_service_id, timeout, wait_for_request, parallelism):
+    """Pings the given tokens (or services) concurrently, with at most parallelism queries or pings in flight"""
+    name_header = 'Service Id' if is_service_id else 'Token'
+    headers = [name_header, 'Cluster', 'Result', 'Latency', 'Status']
+    rows = [{name_header: name, 'Cluster': '', 'Result': 'Pending', 'Latency': '', 'Status': ''} for name in names]
+    render = live_table(headers, rows)
+    render()
+    semaphore = asyncio.Semaphore(parallelism)
+    # The cluster names are resolved once, before any ping, so that the pings only compare names
+    cluster_config_names = {} if is_service_id or len(clusters) == 1 else await get_cluster_config_names_async(clusters)
+    name_results = await asyncio.gather(*[ping_name_async(clusters, name, is_service_id, timeout, wait_for_request,
+                                                         semaphore, rows, render, cluster_config_names)
+                                         for name in names])
+    render(final=True)
+    return [(name, cluster_name, succeeded, message)
+            for name, results in zip(names, name_results)
+            for cluster_name, succeeded, message in results]
+
+
+def ping_many(clusters, names, is_service_id, timeout, wait_for_request, parallelism):
+    """Pings the given tokens (or services) concurrently, showing their progress in a single table"""
+    http_util.set_retries(0)
+    results = http_util.run_coroutine(ping_many_async(clusters, names, is_service_id, timeout, wait_for_request,
+                                                      parallelism))
+    for name, cluster_name, _, message in results:
+        if message:
+            location = f' in {cluster_name}' if cluster_name else ''
+            print_error(f'{name}{location}: {message}')
+    return 0 if all(succeeded for _, _, succeeded, _ in results) else 1
+
+
+def ping(clusters, args, _, __):
+    """Pings the tokens (or services) with the given names."""
+    guard_no_cluster(clusters)
+    names = list(dict.fromkeys(args.get('token-or-service-id')))
+    is_service_id = args.get('is-service-id', False)
+    timeout = args.get('timeout', None)
+    wait_for_request = args.get('wait', True)
+    if len(names) == 1:
+        return ping_one(clusters, names[0], is_service_id, timeout, wait_for_request)
+    else:
+        return ping_many(clusters, names, is_service_id, timeout, wait_for_request, args['parallelism'])
+
+
 def token_explicitly_created_on_cluster(cluster, token_cluster_name):
     """Returns true if the given token cluster matches the configured cluster name of the given cluster"""
-    cluster_settings, _ = http_util.make_data_request(cluster, lambda: http_util.get(cluster, '/settings'))
-    cluster_config_name = cluster_settings['cluster-config']['name'].upper()
+    cluster_config_name = get_cluster_config_names([cluster]).get(cluster['name'], '').upper()
     created_on_this_cluster = token_cluster_name == cluster_config_name
     return created_on_this_cluster
 
@@ -57,7 +210,8 @@ def register(add_parser):
     """Adds this sub-command's parser and returns the action function"""
     default_timeout = 300
     parser = add_parser('ping', help='ping token by name')
-    parser.add_argument('token-or-service-id')
+    parser.add_argument('token-or-service-id', nargs='+',
+                        help='the token(s) or service id(s) to ping; several are pinged concurrently')
     parser.add_argument('--timeout', '-t', help=f'read timeout (in seconds) for ping request (default is '
                                                 f'{default_timeout} seconds)',
                         type=check_positive, default=default_timeout)
@@ -65,4 +219,7 @@ def register(add_parser):
                         dest='is-service-id', action='store_true')
     parser.add_argument('--no-wait', '-n', help='do not wait for ping request to return',
                         dest='wait', action='store_false')
+    parser.add_argument('--parallelism', '-p', type=check_positive, default=DEFAULT_PING_PARALLELISM,
+                        help=f'maximum number of pings in flight at once when pinging several tokens or services '
+                             f'(default is {DEFAULT_PING_PARALLELISM})')
     return ping
@@ -1,12 +1,16 @@
+import asyncio
+import logging
+import sys
+
 from tabulate import tabulate
 
-from waiter import terminal
-from waiter.data_format import display_data
+from waiter import http_util, profiling, terminal
+from waiter.data_format import display_data, load_file, JSON, YAML
 from waiter.format import format_field_name, format_mem_field, format_timestamp_string
 
 from waiter.display import tabulate_token_services
-from waiter.querying import print_no_data, query_token
-from waiter.util import guard_no_cluster
+from waiter.querying import print_no_data, query_token, query_token_async
+from waiter.util import check_positive, guard_no_cluster
 
 
 def tabulate_token(cluster_name, token, token_name, services, token_etag):
@@ -63,23 +67,25 @@ def tabulate_token(cluster_name, token, token_name, services, token_etag):
         f'{service_table}'
 
 
-def show(clusters, args, _, __):
+def print_token_tables(query_result, token_name, include_services):
+    """Prints the tables for the given token on every cluster in the query result"""
+    with profiling.phase('render'):
+        for cluster_name, entities in sorted(query_result['clusters'].items()):
+            services = entities['services'] if include_services else []
+            print(tabulate_token(cluster_name, entities['token'], token_name, services, entities['etag']))
+            print()
+
+
+def show_token(clusters, token_name, include_services, args):
     """Prints info for the token with the given token name."""
-    guard_no_cluster(clusters)
     as_json = args.get('json')
     as_yaml = args.get('yaml')
-    token_name = args.get('token')[0]
-    include_services = not args.get('no-services')
-
     query_result = query_token(clusters, token_name, include_services=include_services)
 
     if as_json or as_yaml:
         display_data(args, query_result)
     else:
-        for cluster_name, entities in sorted(query_result['clusters'].items()):
-            services = entities['services'] if include_services else []
-            print(tabulate_token(cluster_name, entities['token'], token_name, services, entities['etag']))
-            print()
+        print_token_tables(query_result, token_name, include_services)
 
     if query_result['count'] > 0:
         return 0
@@ -89,13 +95,95 @@ def show(clusters, args, _, __):
         return 1
 
 
+async def show_tokens_async(clusters, token_names, include_services, args, parallelism):
+    """
+    Queries the given tokens with at most parallelism tokens in flight at once, printing each
+    token as soon as its result is available (one JSON document per line when using JSON).
+    Returns the names of the tokens that were not found.
+    """
+    as_json = args.get('json')
+    as_yaml = args.get('yaml')
+    compact = args.get('compact')
+    semaphore = asyncio.Semaphore(parallelism)
+    missing_token_names = []
+
+    async def query(token_name):
+        async with semaphore:
+            return token_name, await query_token_async(clusters, token_name, include_services=include_services)
+
+    for next_query in asyncio.as_completed([query(t) for t in token_names]):
+        token_name, query_result = await next_query
+        if query_result['count'] == 0:
+            missing_token_names.append(token_name)
+        if as_json:
+            print(JSON.dump({'token': token_name, **query_result}, compact=True), flush=True)
+        elif as_yaml:
+            print('---')
+            print(YAML.dump({'token': token_name, **query_result}, compact=compact), end='', flush=True)
+        elif query_result['count'] > 0:
+            print_token_tables(query_result, token_name, include_services)
+            sys.stdout.flush()
+    return missing_token_names
+
+
+def show_tokens(clusters, token_names, include_services, args, parallelism):
+    """Prints info for each of the tokens with the given token names."""
+    missing_token_names = http_util.run_coroutine(show_tokens_async(clusters, token_names, include_services, args,
+                                                                    parallelism))
+    if missing_token_names:
+        if not args.get('json') and not args.get('yaml'):
+            missing_text = ', '.join(terminal.bold(t) for t in sorted(missing_token_names))
+            print(terminal.failed(f'No matching data found for {len(missing_token_names)} token(s): ') + missing_text)
+        return 1
+    else:
+        return 0
+
+
+def read_token_names(path):
+    """Reads token names, one per line, from the given file (or stdin if the path is -)"""
+    if path == '-':
+        logging.debug('reading token names from stdin')
+        content = sys.stdin.read()
+    else:
+        content = load_file(path)
+        if content is None:
+            raise Exception(f'Unable to load token names from {path}.')
+    lines = (line.strip() for line in content.splitlines())
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+def show(clusters, args, _, __):
+    """Prints info for the token(s) with the given token name(s)."""
+    guard_no_cluster(clusters)
+    token_names = args.get('token')
+    tokens_file = args.get('tokens-file')
+    include_services = not args.get('no-services')
+    if tokens_file:
+        token_names = token_names + read_token_names(tokens_file)
+    token_names = list(dict.fromkeys(token_names))
+
+    if len(token_names) == 0:
+        raise Exception('You must specify at least one token name.')
+    elif len(token_names) == 1 and not tokens_file:
+        return show_token(clusters, token_names[0], include_services, args)
+    else:
+        return show_tokens(clusters, token_names, include_services, args, args['parallelism'])
+
+
 def register(add_parser):
     """Adds this sub-command's parser and returns the action function"""
-    show_parser = add_parser('show', help='show token by name')
-    show_parser.add_argument('token', nargs=1)
+    show_parser = add_parser('show', help='show token(s) by name')
+    show_parser.add_argument('token', nargs='*')
+    show_parser.add_argument('--tokens-file', '-f', dest='tokens-file',
+                             help='also show the tokens named in this file, one per line (or read from stdin using -)')
+    show_parser.add_argument('--parallelism', '-p', type=check_positive, default=16,
+                             help='maximum number of tokens queried at once when showing multiple tokens')
     show_parser.add_argument('--no-services', help="don't show the token's services",
                              dest='no-services', action='store_true')
     format_group = show_parser.add_mutually_exclusive_group()
-    format_group.add_argument('--json', help='show the data in JSON format', dest='json', action='store_true')
+    format_group.add_argument('--json', help='show the data in JSON format (one line per token when showing '
+                                             'multiple tokens)', dest='json', action='store_true')
     format_group.add_argument('--yaml', help='show the data in YAML format', dest='yaml', action='store_true')
+    show_parser.add_argument('--compact', help='with --json or --yaml, show the data without indentation or line '
+                                              'breaks (e.g. for scripts)', dest='compact', action='store_true')
     return show
@@ -1,32 +1,185 @@
+import argparse
 import collections
+import fnmatch
 import getpass
+import heapq
+import re
+import sys
+import time
 
-from tabulate import tabulate
-
+from waiter import profiling, terminal
 from waiter.data_format import display_data
-from waiter.format import format_timestamp_string
-from waiter.querying import print_no_data, query_tokens
-from waiter.util import guard_no_cluster
+from waiter.display import COLUMN_SEPARATOR, HEADER_MIN_PADDING, render_table
+from waiter.format import format_timestamp_string, parse_timestamp
+from waiter.querying import print_no_data, query_token_rows, stream_token_rows
+from waiter.util import guard_no_cluster, str2bool
+
+# The fields that can be shown, mapped to their table header and the
+# key of the field in the token listing (None for the cluster name)
+FIELDS = collections.OrderedDict([('cluster', ('Cluster', None)),
+                                  ('owner', ('Owner', 'owner')),
+                                  ('token', ('Token', 'token')),
+                                  ('maintenance', ('Maintenance', 'maintenance')),
+                                  ('updated', ('Updated', 'last-update-time')),
+                                  ('etag', ('ETag', 'etag'))])
+DEFAULT_FIELDS = ['cluster', 'owner', 'token', 'maintenance', 'updated']
+
+# Fields (and filters) that are only listed by the server when the token metadata is included
+METADATA_FIELDS = {'updated', 'etag'}
+
+FILTER_KEYS = ['owner', 'maintenance', 'updated-since', 'name']
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60, 'w': 7 * 24 * 60 * 60}
+
+
+def parse_fields(value):
+    """Parses the comma-separated list of fields to show"""
+    fields = [f.strip() for f in value.split(',') if f.strip()]
+    unknown_fields = [f for f in fields if f not in FIELDS]
+    if not fields or unknown_fields:
+        raise argparse.ArgumentTypeError(f'{value} is not a valid list of fields; '
+                                         f'the fields are {", ".join(FIELDS)}')
+    return fields
+
+
+def parse_filter(value):
+    """
+    Parses a key=value filter, returning the (key, value) pair. The value of maintenance filters is a
+    boolean, and the value of updated-since filters is epoch seconds (given either as a timestamp or as
+    a duration ago, like 12h or 7d).
+    """
+    key, separator, filter_value = value.partition('=')
+    if not separator or key not in FILTER_KEYS:
+        raise argparse.ArgumentTypeError(f'{value} is not a valid filter; filters are key=value where key is one '
+                                         f'of {", ".join(FILTER_KEYS)}')
+    try:
+        if key == 'maintenance':
+            filter_value = str2bool(filter_value)
+            if filter_value is None:
+                raise ValueError('maintenance must be true or false')
+        elif key == 'updated-since':
+            duration = re.fullmatch(r'(\d+)([smhdw])', filter_value)
+            if duration:
+                filter_value = time.time() - int(duration.group(1)) * DURATION_UNITS[duration.group(2)]
+            else:
+                filter_value = parse_timestamp(filter_value).timestamp()
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f'{value} is not a valid filter: {e}')
+    return key, filter_value
+
+
+def token_predicate(filters):
+    """
+    Returns a predicate on listed tokens for the filters that the server cannot apply (updated-since
+    and name globs); owner and maintenance filters are passed to the server as query parameters
+    """
+    updated_since = max((v for k, v in filters if k == 'updated-since'), default=None)
+    name_patterns = [v for k, v in filters if k == 'name']
+
+    def predicate(token):
+        if updated_since is not None and parse_timestamp(token['last-update-time']).timestamp() < updated_since:
+            return False
+        return all(fnmatch.fnmatchcase(token['token'], p) for p in name_patterns)
+
+    return predicate
+
+
+def token_row_fn(fields, predicate, as_table):
+    """
+    Returns the function projecting each listed token that satisfies predicate onto the given fields. Table rows
+    are (sort key, values) pairs, while JSON/YAML rows are dicts (or the full token if no fields were given).
+    """
+
+    keys = [FIELDS[f][1] for f in fields or []]
 
+    def row_fn(cluster, token):
+        if not predicate(token):
+            return None
+        values = [cluster['name'] if key is None else token.get(key, False if key == 'maintenance' else None)
+                  for key in keys]
+        if as_table:
+            return (token['token'], cluster['name']), tuple(values)
+        elif fields:
+            return dict(zip(fields, values))
+        else:
+            return token
 
-def query_result_to_cluster_token_pairs(query_result):
-    """Given a query result structure, returns a sequence of (cluster, token) pairs from the result"""
-    cluster_token_pairs = ((c, t) for c, e in query_result['clusters'].items() for t in e['tokens'])
-    cluster_token_pairs_sorted = sorted(cluster_token_pairs, key=lambda p: (p[1]['token'], p[0]))
-    return cluster_token_pairs_sorted
+    return row_fn
 
 
-def print_as_table(query_result):
-    """Given a collection of (cluster, token) pairs, formats a table showing the most relevant token fields"""
-    cluster_token_pairs = query_result_to_cluster_token_pairs(query_result)
-    rows = [collections.OrderedDict([("Cluster", cluster),
-                                     ("Owner", token['owner']),
-                                     ("Token", token['token']),
-                                     ("Maintenance", token.get('maintenance', False)),
-                                     ("Updated", format_timestamp_string(token['last-update-time']))])
-            for (cluster, token) in cluster_token_pairs]
-    token_table = tabulate(rows, headers='keys', tablefmt='plain')
-    print(token_table)
+def query_result_to_columns(query_result, fields):
+    """Given a query_token_rows result of table rows, returns the columns of the rows, sorted by token then cluster"""
+    rows = [row for entities in query_result['clusters'].values() for row in entities['rows']]
+    rows.sort(key=lambda r: r[0])
+    formatters = [format_timestamp_string if f == 'updated' else None for f in fields]
+    return [[formatter(values[i]) if formatter and values[i] else values[i] for _, values in rows]
+            for i, formatter in enumerate(formatters)]
+
+
+def print_as_table(query_result, fields):
+    """Given a query_token_rows result of table rows, formats a table showing the given token fields"""
+    with profiling.phase('render'):
+        columns = query_result_to_columns(query_result, fields)
+        # Without any rows, only an empty line is printed (and print_no_data then explains why)
+        token_table = render_table(columns, [FIELDS[f][0] for f in fields]) if columns[0] else ''
+        print(token_table)
+
+
+def merge_sorted_rows(row_batches):
+    """
+    Given batches of table rows (e.g. one per cluster), returns the list of all of the rows sorted by token and then
+    cluster. Each batch is sorted as soon as it arrives (while the other clusters are still responding), and the
+    sorted batches are merged once they have all arrived.
+    """
+    sorted_batches = []
+    for rows in row_batches:
+        rows.sort(key=lambda r: r[0])
+        sorted_batches.append(rows)
+    return list(heapq.merge(*sorted_batches, key=lambda r: r[0]))
+
+
+def print_streamed_table(row_batches, fields, out):
+    """
+    Prints the table rows in each of the given batches as soon as the batch is available, returning the number of
+    rows printed. Column widths are computed from the rows printed so far, so the rows of a later batch with wider
+    values are not aligned with the rows printed before them.
+    """
+    headers = [FIELDS[f][0] for f in fields]
+    widths = [len(h) + HEADER_MIN_PADDING for h in headers]
+    formatters = [format_timestamp_string if f == 'updated' else str for f in fields]
+    count = 0
+    for rows in row_batches:
+        lines = [['' if value is None else formatter(value) for formatter, value in zip(formatters, values)]
+                 for _, values in rows]
+        if not lines:
+            continue
+        widths = [max(width, *(len(cells[i]) for cells in lines)) for i, width in enumerate(widths)]
+        if count == 0:
+            print(COLUMN_SEPARATOR.join(h.ljust(w) for h, w in zip(headers, widths)).rstrip(), file=out)
+        for cells in lines:
+            print(COLUMN_SEPARATOR.join(c.ljust(w) for c, w in zip(cells, widths)).rstrip(), file=out)
+        out.flush()
+        count += len(lines)
+    return count
+
+
+def stream_token_table(clusters, owners, fields, row_fn, include_metadata, params, sort, use_pager):
+    """
+    Prints the token table as each cluster responds, rather than after all of them have (optionally sorting the
+    rows, which requires every cluster's response), returning true if any tokens were printed
+    """
+    row_batches = (rows for _, rows in stream_token_rows(clusters, owners, row_fn,
+                                                         include_metadata=include_metadata, params=params))
+    if sort:
+        # The sorted rows are printed as a single batch, so that the columns are sized (and aligned) over all rows
+        row_batches = [merge_sorted_rows(row_batches)]
+    with terminal.pager(enabled=use_pager) as out:
+        try:
+            return print_streamed_table(row_batches, fields, out) > 0
+        except BrokenPipeError:
+            if out is sys.stdout:
+                raise
+            # The user quit the pager, which they could only do once some tokens had been printed
+            return True
 
 
 def tokens(clusters, args, _, __):
@@ -34,18 +187,49 @@ def tokens(clusters, args, _, __):
     guard_no_cluster(clusters)
     as_json = args.get('json')
     as_yaml = args.get('yaml')
-    user = args.get('user')
+    fields = args.get('fields')
+    filters = args.get('filter', [])
 
-    query_result = query_tokens(clusters, user)
-    if as_json or as_yaml:
-        display_data(args, query_result)
+    # Owner and maintenance filters are applied by the server
+    owners = [v for k, v in filters if k == 'owner'] or args.get('user')
+    params = {}
+    maintenance_values = {v for k, v in filters if k == 'maintenance'}
+    if len(maintenance_values) > 1:
+        raise Exception('You cannot filter on both maintenance=true and maintenance=false.')
+    elif maintenance_values:
+        params['maintenance'] = str(maintenance_values.pop()).lower()
+
+    as_table = not as_json and not as_yaml
+    if as_table:
+        fields = fields or DEFAULT_FIELDS
+    elif args.get('stream'):
+        raise Exception('You can only use --stream with table output.')
+    include_metadata = (not fields or any(f in METADATA_FIELDS for f in fields) or
+                        any(k == 'updated-since' for k, _ in filters))
+    row_fn = token_row_fn(fields, token_predicate(filters), as_table)
+
+    if args.get('stream'):
+        printed_tokens = stream_token_table(clusters, owners, fields, row_fn, include_metadata, params,
+                                            sort=args.get('sort'), use_pager=not args.get('no_pager'))
+        if printed_tokens:
+            return 0
+        else:
+            print_no_data(clusters)
+            return 1
+
+    query_result = query_token_rows(clusters, owners, row_fn, include_metadata=include_metadata, params=params)
+
+    if as_table:
+        print_as_table(query_result, fields)
     else:
-        print_as_table(query_result)
+        for entities in query_result['clusters'].values():
+            entities['tokens'] = entities.pop('rows')
+        display_data(args, query_result)
 
     if query_result['count'] > 0:
         return 0
     else:
-        if not as_json and not as_yaml:
+        if as_table:
             print_no_data(clusters)
         return 1
 
@@ -54,7 +238,27 @@ def register(add_parser):
     """Adds this sub-command's parser and returns the action function"""
     parser = add_parser('tokens', help='list tokens by owner')
     parser.add_argument('--user', '-u', help='list tokens owned by a user', default=getpass.getuser())
+    parser.add_argument('--fields', help=f'comma-separated fields to show (from {", ".join(FIELDS)}); only the '
+                                         f'token metadata needed for these fields is requested',
+                        type=parse_fields)
+    parser.add_argument('--filter', help='only list tokens matching key=value, where key is owner (overrides --user; '
+                                         'can be repeated to list the tokens of several owners), maintenance (true or '
+                                         'false), updated-since (a timestamp like 2019-01-31T12:00:00Z, or a '
+                                         'duration ago like 12h or 7d), or name (a glob like my-app-*)',
+                        dest='filter', action='append', type=parse_filter)
+    parser.add_argument('--stream', help='print the tokens of each cluster as soon as that cluster responds, instead '
+                                         'of waiting for every cluster; the rows are not sorted unless --sort is '
+                                         'given, and without --sort, the rows of clusters that respond later are not '
+                                         'aligned with the earlier rows if their values are wider',
+                        dest='stream', action='store_true')
+    parser.add_argument('--sort', help='with --stream, sort the rows by token and cluster; each cluster\'s rows are '
+                                       'sorted as they arrive, and all of the rows are merged (and printed) once every '
+                                       'cluster has responded', dest='sort', action='store_true')
+    parser.add_argument('--no-pager', help='with --stream, do not page the output through $PAGER (less by default) '
+                                           'when writing to a terminal', dest='no_pager', action='store_true')
     format_group = parser.add_mutually_exclusive_group()
     format_group.add_argument('--json', help='show the data in JSON format', dest='json', action='store_true')
     format_group.add_argument('--yaml', help='show the data in YAML format', dest='yaml', action='store_true')
+    parser.add_argument('--compact', help='with --json or --yaml, show the data without indentation or line breaks '
+                                          '(e.g. for scripts)', dest='compact', action='store_true')
     return tokens
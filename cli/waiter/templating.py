@@ -0,0 +1,66 @@
+import functools
+import string
+
+# Templates use the syntax of string.Template: $name or ${name} is replaced by the value of the variable name,
+# and $$ is an escaped $
+TEMPLATE_PATTERN = string.Template.pattern
+
+
+class Template:
+    """
+    A template that has been parsed once into its literal text and variable references, so that it can be rendered
+    with many contexts without parsing it again. Rendering is equivalent to string.Template.substitute, except that
+    every missing variable is reported at once (rather than only the first).
+    """
+
+    def __init__(self, text):
+        self.__parts = []
+        literal_start = 0
+        for match in TEMPLATE_PATTERN.finditer(text):
+            if match.group('invalid') is not None:
+                # Reported as string.Template reports it
+                start = match.start('invalid')
+                lines = text[:start].splitlines(keepends=True)
+                line, column = (len(lines), start - len(''.join(lines[:-1]))) if lines else (1, 1)
+                raise ValueError(f'Invalid placeholder in string: line {line}, col {column}')
+            self.__append_literal(text[literal_start:match.start()])
+            name = match.group('named') or match.group('braced')
+            if name is None:
+                self.__append_literal('$')
+            else:
+                self.__parts.append((name,))
+            literal_start = match.end()
+        self.__append_literal(text[literal_start:])
+        self.variables = list(dict.fromkeys(p[0] for p in self.__parts if isinstance(p, tuple)))
+
+    def __append_literal(self, literal):
+        """Appends the given literal text, merging it into the preceding literal (if any)"""
+        if not literal:
+            return
+        if self.__parts and isinstance(self.__parts[-1], str):
+            self.__parts[-1] += literal
+        else:
+            self.__parts.append(literal)
+
+    def missing_variables(self, context):
+        """Returns the variables used by the template that the given context does not define, in order of first use"""
+        return [v for v in self.variables if v not in context]
+
+    def render(self, context):
+        """Renders the template with the given context, raising a KeyError naming every missing variable"""
+        missing_variables = self.missing_variables(context)
+        if missing_variables:
+            raise KeyError(*missing_variables)
+        return ''.join(p if isinstance(p, str) else str(context[p[0]]) for p in self.__parts)
+
+
+@functools.lru_cache(maxsize=32)
+def compile_template(text):
+    """Returns the compiled Template of the given text, compiling each distinct text only once"""
+    return Template(text)
+
+
+def format_missing_variables(missing_variables):
+    """Formats the given missing variables for an error message, e.g. missing variables 'foo', 'bar'"""
+    names = ', '.join(repr(v) for v in missing_variables)
+    return f'missing variable{"s" if len(missing_variables) > 1 else ""} {names}'
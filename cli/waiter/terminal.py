@@ -1,10 +1,13 @@
+import contextlib
 import os
+import subprocess
 import sys
 
 import textwrap
 
 
 MOVE_UP = '\033[F'
+CLEAR_LINE = '\033[K'
 
 
 class Color:
@@ -56,6 +59,37 @@ def colorize(s, color):
     return f'{color}{s}{Color.END}' if tty() else s
 
 
+@contextlib.contextmanager
+def pager(enabled=True):
+    """
+    Context manager providing the file to write long output to: the input of $PAGER (less by default, which
+    exits right away if the output fits on one screen) when standard output is a terminal, and standard output
+    itself otherwise (or when not enabled)
+    """
+    command = os.getenv('PAGER', 'less')
+    if not enabled or not command or not sys.stdout.isatty():
+        yield sys.stdout
+        return
+    sys.stdout.flush()
+    try:
+        process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, universal_newlines=True,
+                                   env={'LESS': 'FRX', **os.environ})
+    except OSError:
+        yield sys.stdout
+        return
+    try:
+        yield process.stdin
+    except BrokenPipeError:
+        # The user quit the pager before reading all of the output
+        pass
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        process.wait()
+
+
 def tty():
     """Returns true if running in a real terminal (as opposed to being piped or redirected). If WAITER_TTY is set then
     return True else False"""
@@ -0,0 +1,71 @@
+import json
+
+# Token fields that are managed by the server (and only returned when the token metadata is included),
+# which are never part of a diff between tokens
+SERVER_MANAGED_FIELDS = {'cluster', 'deleted', 'last-update-time', 'last-update-user', 'previous', 'root'}
+
+# Token fields that the server fills in when a token POST leaves them out, so leaving them out is not a change
+SERVER_DEFAULTED_FIELDS = {'owner'}
+
+
+class Missing:
+    """Marks a field that is missing from one side of a diff"""
+
+    def __repr__(self):
+        return 'MISSING'
+
+
+MISSING = Missing()
+
+
+def user_fields(token_data):
+    """Returns the given token data without the fields managed by the server"""
+    return {k: v for k, v in (token_data or {}).items() if k not in SERVER_MANAGED_FIELDS}
+
+
+def __diff_values(path, old, new, changes):
+    """Appends the (path, old, new) changes between old and new to changes, descending into nested dicts"""
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in sorted(set(old) | set(new)):
+            __diff_values(path + (key,), old.get(key, MISSING), new.get(key, MISSING), changes)
+    elif old != new or isinstance(old, bool) != isinstance(new, bool):
+        # True == 1 in Python, so booleans are also compared by type (unlike ints and floats, which JSON conflates)
+        changes.append((path, old, new))
+
+
+def diff_tokens(existing_token, token):
+    """
+    Returns the changes that posting token (the full token body) would make to existing_token (None if the token
+    does not exist yet), as a sorted list of (path, old value, new value) triples, where path is the tuple of keys
+    leading to the field and MISSING marks an added or removed field. Server-managed fields are ignored, as are
+    server-defaulted fields (like the owner) that token leaves out. An empty list means the post is a no-op.
+    """
+    existing_token = user_fields(existing_token)
+    token = user_fields(token)
+    for field in SERVER_DEFAULTED_FIELDS:
+        if field not in token:
+            existing_token.pop(field, None)
+    changes = []
+    __diff_values((), existing_token, token, changes)
+    return changes
+
+
+def format_path(path):
+    """Formats the path of a changed field, e.g. env.FOO"""
+    return '.'.join(str(key) for key in path)
+
+
+def __format_value(value):
+    """Formats a field value as JSON"""
+    return json.dumps(value, sort_keys=True)
+
+
+def format_change(change):
+    """Formats a single (path, old value, new value) change, as + (added), - (removed) or ~ (changed) lines"""
+    path, old, new = change
+    if old is MISSING:
+        return f'+ {format_path(path)}: {__format_value(new)}'
+    elif new is MISSING:
+        return f'- {format_path(path)}: {__format_value(old)}'
+    else:
+        return f'~ {format_path(path)}: {__format_value(old)} -> {__format_value(new)}'
@@ -7,7 +7,8 @@ import requests
 
 from waiter import terminal, http_util
 from waiter.data_format import determine_format, display_data, load_data
-from waiter.querying import get_token, query_token, get_target_cluster_from_token
+from waiter.querying import TokenFetchContext
+from waiter.token_diff import diff_tokens, format_change
 from waiter.util import deep_merge, FALSE_STRINGS, is_admin_enabled, print_info, response_message, TRUE_STRINGS, \
     guard_no_cluster, str2bool, update_in
 
@@ -70,26 +71,48 @@ def merge_token_fields_from_args(token_fields_base, token_fields_from_args):
     return token_fields
 
 
-def create_or_update(cluster, token_name, token_fields, admin_mode, action, fields_from_args_only, output):
-    """Creates (or updates) the given token on the given cluster"""
+def post_token(cluster, token_name, json_body, etag, admin_mode=False):
+    """POSTs the given token body to the given cluster, provided that the token there still has the given etag"""
+    params = {'token': token_name}
+    if admin_mode:
+        params['update-mode'] = 'admin'
+    headers = {'If-Match': etag or ''}
+    return http_util.post(cluster, 'token', json_body, params=params, headers=headers)
+
+
+def print_changes(changes):
+    """Prints the changes (from token_diff.diff_tokens) that a token post makes to the existing token"""
+    print_info('\n'.join(['Changes to the existing token:'] + [f'  {format_change(c)}' for c in changes]))
+
+
+def create_or_update(fetch_context, cluster, token_name, token_fields, admin_mode, action, fields_from_args_only,
+                     output):
+    """Creates (or updates) the given token on the given cluster, using the token as read by the fetch context"""
     cluster_name = cluster['name']
     cluster_url = cluster['url']
 
-    existing_token_data, existing_token_etag = get_token(cluster, token_name)
+    existing_token_data, existing_token_etag = fetch_context.get_token(cluster, token_name)
     try:
         print_info(f'Attempting to {action} token {("in ADMIN mode " if admin_mode else "")}'
                    f'{("with dry-run enabled " if output else "")}on {terminal.bold(cluster_name)}...')
-        params = {'token': token_name}
-        if admin_mode:
-            params['update-mode'] = 'admin'
-        json_body = existing_token_data if existing_token_data and action.should_patch() else {}
+        json_body = dict(existing_token_data) if existing_token_data and action.should_patch() else {}
         if fields_from_args_only and action.should_patch():
             json_body = deep_merge(json_body, token_fields)
         else:
             json_body.update(token_fields)
+        if existing_token_data:
+            # Posting an unchanged token would still create a new token version (and could restart services)
+            changes = diff_tokens(existing_token_data, json_body)
+            if changes:
+                print_changes(changes)
+            elif output is None:
+                print_info(f'Token {terminal.bold(token_name)} on {terminal.bold(cluster_name)} is unchanged, '
+                           f'so there is nothing to {action}.')
+                return 0
+            else:
+                print_info('There are no changes to the existing token.')
         if output is None:
-            headers = {'If-Match': existing_token_etag or ''}
-            resp = http_util.post(cluster, 'token', json_body, params=params, headers=headers)
+            resp = post_token(cluster, token_name, json_body, existing_token_etag, admin_mode)
             process_post_result(resp)
         elif output == '-':
             print_info('Token configuration (as json) is:')
@@ -126,6 +149,18 @@ def pop_context_override_args(args):
         return None
 
 
+def get_default_cluster_for_create(clusters):
+    """Returns the cluster in which new tokens are created when more than one cluster is configured"""
+    default_for_create = [c for c in clusters if c.get('default-for-create', False)]
+    num_default_create_clusters = len(default_for_create)
+    if num_default_create_clusters == 0:
+        raise Exception('You must either specify a cluster via --cluster or set "default-for-create" to true for '
+                        'one of your configured clusters.')
+    elif num_default_create_clusters > 1:
+        raise Exception('You have "default-for-create" set to true for more than one cluster.')
+    return default_for_create[0]
+
+
 def create_or_update_token(clusters, args, _, enforce_cluster, action):
     """Creates (or updates) a Waiter token"""
     guard_no_cluster(clusters)
@@ -181,25 +216,19 @@ def create_or_update_token(clusters, args, _, enforce_cluster, action):
         raise Exception('You must specify the token name either as an argument or in an input file via '
                         '--json or --yaml.')
 
+    fetch_context = TokenFetchContext(clusters)
     if len(clusters) > 1:
-        default_for_create = [c for c in clusters if c.get('default-for-create', False)]
-        num_default_create_clusters = len(default_for_create)
-        if num_default_create_clusters == 0:
-            raise Exception('You must either specify a cluster via --cluster or set "default-for-create" to true for '
-                            'one of your configured clusters.')
-        elif num_default_create_clusters > 1:
-            raise Exception('You have "default-for-create" set to true for more than one cluster.')
+        default_cluster = get_default_cluster_for_create(clusters)
+        if fetch_context.query_token(token_name)['count'] > 0:
+            cluster = fetch_context.get_target_cluster(token_name, enforce_cluster)
+            logging.debug(f'token already exists in: {cluster}')
         else:
-            query_result = query_token(clusters, token_name)
-            if query_result['count'] > 0:
-                cluster = get_target_cluster_from_token(clusters, token_name, enforce_cluster)
-                logging.debug(f'token already exists in: {cluster}')
-            else:
-                cluster = default_for_create[0]
+            cluster = default_cluster
     else:
         cluster = clusters[0]
 
-    return create_or_update(cluster, token_name, token_fields, admin_mode, action, fields_from_args_only, output)
+    return create_or_update(fetch_context, cluster, token_name, token_fields, admin_mode, action,
+                            fields_from_args_only, output)
 
 
 def add_arguments(parser):
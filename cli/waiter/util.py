@@ -2,9 +2,9 @@ import argparse
 import json
 import logging
 import os
+import random
 import sys
 import time
-from datetime import datetime, timedelta
 
 from waiter import terminal
 
@@ -39,13 +39,13 @@ def current_user():
 
 
 def print_error(text):
-    """Prints text to stderr, colored as a failure"""
-    print(terminal.failed(text), file=sys.stderr)
+    """Prints text to stderr, colored as a failure (in a single write, so concurrent messages don't interleave)"""
+    print(f'{terminal.failed(text)}\n', file=sys.stderr, end='')
 
 
 def print_info(text, end='\n'):
-    """Prints text to stdout"""
-    print(text, flush=True, end=end)
+    """Prints text to stdout (in a single write, so concurrent messages don't interleave)"""
+    print(f'{text}{end}', flush=True, end='')
 
 
 def guard_no_cluster(clusters):
@@ -75,26 +75,35 @@ def response_message(resp_json):
     return message
 
 
-def wait_until(pred, timeout=30, interval=5):
+def wait_until(pred, timeout=30, interval=5, initial_interval=0.1, multiplier=2):
     """
     Wait, retrying a predicate until it is True, or the
-    timeout value has been exceeded.
+    timeout value has been exceeded. Retries start after
+    initial_interval seconds and back off exponentially (with
+    jitter) to at most interval seconds; the final retry is
+    made when the timeout is reached.
     """
     if timeout:
-        finish = datetime.now() + timedelta(seconds=timeout)
+        finish = time.monotonic() + timeout
     else:
         finish = None
 
+    delay = initial_interval
     while True:
         result = pred()
 
         if result:
             break
 
-        if finish and datetime.now() >= finish:
-            break
+        sleep_seconds = random.uniform(delay / 2, delay)
+        if finish:
+            remaining = finish - time.monotonic()
+            if remaining <= 0:
+                break
+            sleep_seconds = min(sleep_seconds, remaining)
 
-        time.sleep(interval)
+        time.sleep(sleep_seconds)
+        delay = min(delay * multiplier, interval)
 
     return result
 